@@ -0,0 +1,36 @@
+"""
+Атомарная запись файлов.
+
+Файл пишется во временный файл рядом с fsync и переименовывается
+(os.replace), поэтому bat файл или другой обработчик не может взять
+недописанный файл, а падение во время записи не портит предыдущий.
+Используется для xml заявок, журнала запуска и сессий атс.
+"""
+
+import os
+import threading
+
+
+def write_file_atomic(file_path: str, data: bytes, mode: int = None) -> None:
+    """
+    Функция записи файла во временный файл с fsync и атомарным
+    переименованием. Временный файл свой у каждого процесса и потока,
+    т.к. один файл могут писать одновременно.
+    mode - права файла, ставятся до записи данных.
+    После переименования сверяется размер файла.
+    """
+    temp_file = f"{file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(temp_file, "wb") as output_file:
+            if mode is not None:
+                os.chmod(temp_file, mode)
+            output_file.write(data)
+            output_file.flush()
+            os.fsync(output_file.fileno())
+        os.replace(temp_file, file_path)
+    except OSError:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+        raise
+    if os.path.getsize(file_path) != len(data):
+        raise OSError(f"размер {file_path} не совпадает с записанным")
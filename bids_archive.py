@@ -0,0 +1,277 @@
+"""
+Архив отправленных ценовых заявок.
+
+Каждая отправленная заявка сжимается и дописывается в суточный сегмент
+(один файл на операционные сутки, только дозапись). Индекс по
+(дата, компания, гтп, направление) и часовые объемы хранятся в sqlite
+рядом с сегментами, поэтому поиск отправленного не требует просмотра
+папки с xml на сетевом диске.
+
+Пример запроса из командной строки:
+    python bids_archive.py archive 20261020 --company AVSOLTEK --gtp GVIE0001
+"""
+
+import argparse
+import datetime
+import os
+import sqlite3
+import zlib
+from typing import Any, Dict, List, Tuple, Union
+from xml.dom import minidom
+
+import pandas as pd
+
+INDEX_FILE_NAME = "index.sqlite"
+SEGMENT_SUFFIX = ".seg"
+
+
+def open_archive_index(archive_path: str) -> sqlite3.Connection:
+    """
+    Функция открытия индекса архива, при первом вызове
+    создает папку архива и таблицы индекса.
+    """
+    os.makedirs(archive_path, exist_ok=True)
+    connection = sqlite3.connect(
+        os.path.join(archive_path, INDEX_FILE_NAME),
+        timeout=30,
+        isolation_level=None,
+    )
+    connection.executescript("""
+        CREATE TABLE IF NOT EXISTS bids (
+            bid_id INTEGER PRIMARY KEY,
+            operational_date TEXT NOT NULL,
+            company TEXT NOT NULL,
+            gtp TEXT NOT NULL,
+            direction TEXT NOT NULL,
+            filename TEXT NOT NULL,
+            sent_at TEXT NOT NULL,
+            segment TEXT NOT NULL,
+            segment_offset INTEGER NOT NULL,
+            segment_length INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS bids_key
+            ON bids (operational_date, company, gtp, direction);
+        CREATE TABLE IF NOT EXISTS volumes (
+            bid_id INTEGER NOT NULL,
+            hour INTEGER NOT NULL,
+            volume REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS volumes_bid ON volumes (bid_id);
+        """)
+    return connection
+
+
+def parse_hourly_volumes(xml_bytes: bytes) -> List[Tuple[int, float]]:
+    """
+    Функция получения часовых объемов (номер часа, high-value)
+    из xml ценовой заявки.
+    """
+    document = minidom.parseString(xml_bytes)
+    hourly_volumes = []
+    for hour in document.getElementsByTagName("hour"):
+        high_value = hour.getElementsByTagName("high-value")[0].firstChild.data
+        hourly_volumes.append(
+            (
+                int(hour.getAttribute("number")),
+                float(high_value.strip().replace(",", ".")),
+            )
+        )
+    return hourly_volumes
+
+
+def archive_sent_bids(
+    archive_path: str,
+    operational_date: str,
+    sent_bids: List[Dict[str, str]],
+) -> int:
+    """
+    Функция добавления отправленных заявок в архив.
+    sent_bids - список словарей с ключами company, gtp, direction и path
+    (путь к отправленному xml). Сегмент и индекс пишутся в одной
+    транзакции индекса, так что несколько процессов могут
+    дописывать архив одновременно.
+    Возвращает количество добавленных заявок.
+    """
+    if not sent_bids:
+        return 0
+    segment = f"{operational_date}{SEGMENT_SUFFIX}"
+    sent_at = datetime.datetime.now().isoformat(timespec="seconds")
+    connection = open_archive_index(archive_path)
+    try:
+        connection.execute("BEGIN IMMEDIATE")
+        with open(os.path.join(archive_path, segment), "ab") as segment_file:
+            for bid in sent_bids:
+                with open(bid["path"], "rb") as xml_file:
+                    xml_bytes = xml_file.read()
+                compressed = zlib.compress(xml_bytes, 9)
+                segment_offset = segment_file.tell()
+                segment_file.write(compressed)
+                cursor = connection.execute(
+                    "INSERT INTO bids (operational_date, company, gtp, direction, "
+                    "filename, sent_at, segment, segment_offset, segment_length) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        operational_date,
+                        bid["company"],
+                        bid["gtp"],
+                        bid["direction"],
+                        os.path.basename(bid["path"]),
+                        sent_at,
+                        segment,
+                        segment_offset,
+                        len(compressed),
+                    ),
+                )
+                connection.executemany(
+                    "INSERT INTO volumes (bid_id, hour, volume) VALUES (?, ?, ?)",
+                    [
+                        (cursor.lastrowid, hour, volume)
+                        for hour, volume in parse_hourly_volumes(xml_bytes)
+                    ],
+                )
+            segment_file.flush()
+            os.fsync(segment_file.fileno())
+        connection.execute("COMMIT")
+    except Exception:
+        # байты сегмента без записи в индексе не читаются,
+        # поэтому достаточно откатить индекс
+        connection.execute("ROLLBACK")
+        raise
+    finally:
+        connection.close()
+    return len(sent_bids)
+
+
+def build_filter(
+    operational_date: Union[str, None],
+    company: Union[str, None],
+    gtp: Union[str, None],
+    direction: Union[str, None],
+) -> Tuple[str, List[Any]]:
+    """
+    Функция формирования условия WHERE по ключам индекса.
+    """
+    conditions = []
+    parameters = []
+    for column, value in (
+        ("operational_date", operational_date),
+        ("company", company),
+        ("gtp", gtp),
+        ("direction", direction),
+    ):
+        if value is not None:
+            conditions.append(f"bids.{column} = ?")
+            parameters.append(value)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    return where, parameters
+
+
+def find_sent_bids(
+    archive_path: str,
+    operational_date: Union[str, None] = None,
+    company: Union[str, None] = None,
+    gtp: Union[str, None] = None,
+    direction: Union[str, None] = None,
+) -> pd.DataFrame:
+    """
+    Функция поиска отправленных заявок по индексу.
+    Дата в формате ГГГГММДД, направление "ask" или "bid".
+    """
+    where, parameters = build_filter(operational_date, company, gtp, direction)
+    connection = open_archive_index(archive_path)
+    try:
+        return pd.read_sql(
+            f"SELECT * FROM bids {where} ORDER BY bid_id", connection, params=parameters
+        )
+    finally:
+        connection.close()
+
+
+def read_sent_bid(archive_path: str, segment: str, offset: int, length: int) -> bytes:
+    """
+    Функция чтения xml заявки из сегмента архива
+    по смещению и длине из индекса.
+    """
+    with open(os.path.join(archive_path, segment), "rb") as segment_file:
+        segment_file.seek(offset)
+        return zlib.decompress(segment_file.read(length))
+
+
+def sent_volumes_dataframe(
+    archive_path: str,
+    operational_date: Union[str, None] = None,
+    company: Union[str, None] = None,
+    gtp: Union[str, None] = None,
+    direction: Union[str, None] = None,
+    latest_only: bool = True,
+) -> pd.DataFrame:
+    """
+    Функция получения часовых объемов отправленных заявок датафреймом.
+    При latest_only=True по каждой гтп и дате берется только
+    последняя отправка (повторные отправки заменяют предыдущие).
+    """
+    where, parameters = build_filter(operational_date, company, gtp, direction)
+    query = (
+        "SELECT bids.bid_id, bids.operational_date, bids.company, bids.gtp, "
+        "bids.direction, bids.sent_at, volumes.hour, volumes.volume "
+        f"FROM bids JOIN volumes ON volumes.bid_id = bids.bid_id {where}"
+    )
+    if latest_only:
+        query += (
+            f"{' AND' if where else ' WHERE'} bids.bid_id = ("
+            "SELECT MAX(latest.bid_id) FROM bids AS latest "
+            "WHERE latest.operational_date = bids.operational_date "
+            "AND latest.company = bids.company AND latest.gtp = bids.gtp "
+            "AND latest.direction = bids.direction)"
+        )
+    query += " ORDER BY bids.operational_date, bids.company, bids.gtp, volumes.hour"
+    connection = open_archive_index(archive_path)
+    try:
+        return pd.read_sql(query, connection, params=parameters)
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Поиск отправленных ценовых заявок в архиве."
+    )
+    parser.add_argument("archive_path", help="папка архива")
+    parser.add_argument("operational_date", help="операционные сутки, ГГГГММДД")
+    parser.add_argument("--company", default=None)
+    parser.add_argument("--gtp", default=None)
+    parser.add_argument("--direction", default=None, choices=("ask", "bid"))
+    parser.add_argument("--volumes", action="store_true", help="вывести часовые объемы")
+    parser.add_argument(
+        "--xml", action="store_true", help="вывести xml найденных заявок"
+    )
+    args = parser.parse_args()
+    if args.volumes:
+        print(
+            sent_volumes_dataframe(
+                args.archive_path,
+                args.operational_date,
+                args.company,
+                args.gtp,
+                args.direction,
+            ).to_string()
+        )
+    else:
+        bids = find_sent_bids(
+            args.archive_path,
+            args.operational_date,
+            args.company,
+            args.gtp,
+            args.direction,
+        )
+        print(bids.to_string())
+        if args.xml:
+            for bid in bids.itertuples():
+                print(
+                    read_sent_bid(
+                        args.archive_path,
+                        bid.segment,
+                        bid.segment_offset,
+                        bid.segment_length,
+                    ).decode("windows-1251")
+                )
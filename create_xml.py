@@ -1,33 +1,73 @@
+import argparse
+import base64
 import datetime
+import email.utils
+import functools
+import http.cookies
 import io
+import json
 import logging
 import os
 import pathlib
+import re
 import shutil
 import smtplib
 import socket
+import threading
+import tracemalloc
 import urllib.parse
 import uuid
 import warnings
+from concurrent.futures import ThreadPoolExecutor
 from sys import platform
 from time import sleep
-from typing import Any, Dict, List, Tuple, Union
+from typing import Any, Dict, Iterator, List, Tuple, Union
 from xml.dom import minidom
 
 import pandas as pd
+import pythoncom
 import requests
 import win32com.client
 import yaml
+from lxml import etree
 from requests.adapters import HTTPAdapter
 from requests.packages.urllib3.util.retry import Retry
 from sqlalchemy import create_engine
 
+if platform == "win32":
+    import win32crypt
+
+from atomic_file import write_file_atomic
+from bids_archive import archive_sent_bids
+from monitoring_history import (
+    TRACKED_COLUMNS,
+    monitoring_changes,
+    previous_check,
+    record_check,
+)
+from sampling_profiler import sampling_profile, set_thread_tag, wait_section
+from work_queue import (
+    LEASE_SECONDS,
+    LeaseLost,
+    claim_job,
+    complete_job,
+    defer_job,
+    enqueue_jobs,
+    fail_job,
+    queue_status,
+    renew_lease,
+    unfinished_jobs,
+)
+
 warnings.filterwarnings("ignore")
 
 # При выходе нового юр.лица на рынок добавить ГТП и компанию в таблицу
 # ses_gtp (237), а также указать настройки для нового ключа в файле
-# settings.yaml в корне (логин, пароль, id ключа),
+# settings.yaml в корне в разделе companies по коду участника
+# (login, password, x509id, sender, необязательно representator
+# и work_path), изменения кода не нужны,
 # дальше нужные папки и файлы по юр.лицам создадутся сами.
+# Старые разделы по юр.лицам (avsoltek: и т.п.) тоже поддерживаются.
 
 # Примерная логика работы:
 # 1) Проверяем доступность внешнего интернета (пока отключена)
@@ -40,27 +80,80 @@ warnings.filterwarnings("ignore")
 # и их id и пробуется загрузить их в порядке уменьшения точности.
 # Если не загрузился ни один прогноз (ни одна модель на завтра не подготовилась),
 # то скрипт уведомляет и закрывается.
-# 4) Далее цикл по "генерации" и "потреблению", но потребление пока отключено,
-# т.к. нет прогнозной модели. и надо бы объединить наверное датафреймы,
-# или в конце работы перед проверкой с атс объединять, т.к. в мониторинге
-# все сразу и генерация и потребление, или мониторинг разделить
-# на генераццию и потребление.
+# 4) Далее "генерация" и "потребление" обрабатываются параллельно
+# (список направлений в CZ_TYPES), потребление пока отключено,
+# т.к. нет прогнозной модели. Соответствие ГТП и компаний и сертификаты
+# загружаются один раз, перед проверкой с атс датафреймы направлений
+# объединяются, т.к. в мониторинге все сразу и генерация и потребление.
 # Заявки создаются в тех же папках что и раньше (share/cz).
+# Перед отправкой xml проверяются по xsd схеме атс (bid_schema.xsd в корне),
+# некорректные переносятся в папку *_invalid и не отправляются.
 # Отправка также пока по всем компаниям параллельно. Есть идея
 # переделать на все ГТП сразу параллельно.
+# Режим очереди: "create_xml.py --enqueue" ставит задания
+# (компания, направление, дата) в очередь QUEUE_PATH, а любое количество
+# процессов "create_xml.py --worker" на этом же хосте выполняет их
+# независимо друг от друга, с арендой и повторами. Очередь - sqlite
+# на локальном диске, через сетевую папку ее не делить. Проверка
+# в мониторинге - отдельный этап задания через TIMEOUT_BEFORE_CHECK_CZ
+# после отправки, пока он ждет, обработчик берет другие задания.
 # 5) После запуска bat файлов идет сканирование папки с ЦЗ.
-# Скрипт продолжается только если папка пустая.
+# Скрипт продолжается только если папка пустая. ГТП в bat файлах идут
+# по убыванию суточного объема, по темпу отправки оценивается окончание
+# каждой компании, и если оно позже закрытия приема заявок
+# (GATE_CLOSURE_TIME), то оставшиеся заявки компании дополнительно
+# отправляются через резервную почту с конца списка.
 # Хорошо бы как-то придумать мониторинг ошибок при работе батника.
 # 6) После отправки ценовых ждем 5 минут
 # (время настраивается в переменной TIMEOUT_BEFORE_CHECK_CZ ниже)
 # перед запуском скачивания отчетов мониторинга с АТС.
-# 7) Сверка объемов мониторинга и наших.
+# 7) Сверка объемов мониторинга и наших. Авторизованные cookie атс
+# хранятся по компаниям в течение суток (journal/ats_sessions_*.json,
+# доступен только владельцу, на windows cookie зашифрованы DPAPI),
+# отчет по cookie из кэша запрашивается без сертификата клиента,
+# повторная авторизация по сертификату только если атс сессию не принял.
+# Строки мониторинга сохраняются в историю (monitoring_history.sqlite
+# в папке архива), в телеграм уходят только изменения с прошлой проверки.
+# 8) ГТП без заявки в мониторинге, с отклоненной заявкой или с другим
+# объемом создаются и отправляются заново (только они) и проверяются
+# снова через RESUBMIT_CHECK_SECONDS, не более RESUBMIT_ATTEMPTS раз
+# и только до закрытия приема заявок. ГТП, xml которых в этом запуске
+# не прошли проверку, повторно не подаются.
 # Все запросы с повторными попытками в случае ошибки.
 # Пока отчеты сохраняются в файлы, далее настроить
 # отправку отличий в телеграм наверное надо.
 
 # Задаем переменные
 TIMEOUT_BEFORE_CHECK_CZ = 300
+# закрытие приема ценовых заявок накануне операционных суток
+# (по местному времени сервера)
+GATE_CLOSURE_TIME = datetime.time(13, 30)
+# оценка времени отправки одной заявки bat файлом до первых замеров
+# (пауза 1 секунда в bat файле, подпись и отправка письма)
+SEND_SECONDS_PER_BID = 3.0
+# период проверки папки с неотправленными заявками, секунд
+SEND_POLL_SECONDS = 5
+# метка гтп в папке меток bat файлов считается живой (bat файл упавшего
+# запуска еще отправляет заявку), пока она моложе CLAIM_STALE_SECONDS,
+# папки меток прошлых отправок удаляются через CLAIMS_KEEP_SECONDS
+CLAIM_STALE_SECONDS = 10 * 60
+CLAIMS_KEEP_SECONDS = 24 * 60 * 60
+# повторная подача заявок по результатам мониторинга: попыток,
+# пауза перед повторной проверкой, секунд, статусы отклоненной
+# заявки (в нижнем регистре) и допустимое расхождение объема, МВт*ч.
+# Статусы отклоненной заявки не сверены с реальными отчетами
+# мониторинга атс, поэтому по умолчанию их нет и заявка подается
+# заново только при отсутствии в мониторинге или по объему.
+# Сверенный список задается в settings.yaml
+# (раздел monitoring, список rejected_cz_statuses)
+RESUBMIT_ATTEMPTS = 3
+RESUBMIT_CHECK_SECONDS = 30
+REJECTED_CZ_STATUSES = ()
+RESUBMIT_VOLUME_TOLERANCE = 0.01
+# Направления подачи ценовых заявок, обрабатываются параллельно.
+# Для включения потребления добавить "consumption".
+CZ_TYPES = ("generation",)
+DIRECTIONS = {"generation": "ask", "consumption": "bid"}
 FORECAST_SOURCE_DICT_GEN = {
     "skm_LGBM_2024": 29,
     "skm_ecmwf": 27,
@@ -93,6 +186,68 @@ PRICE = "0"
 GOOGLE_HOST = "8.8.8.8"
 GOOGLE_OPENPORT = 53
 GOOGLE_TIMEOUT = 3
+# xsd схема ценовой заявки атс, по ней проверяются xml перед отправкой
+BID_XSD_PATH = f"{pathlib.Path(__file__).parent.absolute()}/bid_schema.xsd"
+# часовое значение заявки - число с запятой в качестве разделителя,
+# эта проверка выполняется и без xsd схемы
+BID_HOURS = 24
+BID_VALUE_PATTERN = re.compile(r"^-?\d+(,\d+)?$")
+VALIDATION_WORKERS = 8
+# потоков записи xml в сетевую папку
+XML_WRITE_WORKERS = 8
+# столбцы и компактные типы датафрейма прогноза
+FORECAST_DTYPES = {
+    "gtp": "category",
+    "company": "category",
+    "dt": "datetime64[ns]",
+    "load_time": "datetime64[ns]",
+    "hour": "int8",
+    "value": "float32",
+}
+# журнал запуска (этапы по направлениям и компаниям) и снимки прогноза,
+# по ним повторный запуск продолжает работу с первого невыполненного этапа.
+# CREATE_XML_FRESH_RUN=1 - начать запуск с нуля без учета журнала
+JOURNAL_PATH = f"{pathlib.Path(__file__).parent.absolute()}/journal"
+FORECAST_FILE_PATH = f"{pathlib.Path(__file__).parent.absolute()}"
+# снимки прогноза заданий очереди (компания на дату задания),
+# общий снимок направления задания не перезаписывают
+FORECAST_JOBS_DIR = "forecast_jobs"
+FRESH_RUN = os.environ.get("CREATE_XML_FRESH_RUN") == "1"
+# cookie авторизации на атс без срока действия хранится не дольше
+# ATS_SESSION_TTL секунд и не дольше конца суток
+ATS_SESSION_TTL = 3 * 60 * 60
+# ответы атс, означающие что сессия не действует
+ATS_SESSION_EXPIRED_STATUSES = (301, 302, 303, 307, 401)
+# права файла сессий атс: чтение и запись только владельцу
+ATS_SESSIONS_FILE_MODE = 0o600
+# CREATE_XML_STREAM=1 - потоковый режим: прогноз читается курсором
+# на стороне сервера, xml по ГТП создается сразу по мере получения строк
+STREAM_MODE = os.environ.get("CREATE_XML_STREAM") == "1"
+STREAM_CHUNK_ROWS = 2400
+# очередь заданий по компаниям для режима --enqueue/--worker,
+# папку (только на локальном диске) можно переопределить
+# переменной окружения
+QUEUE_PATH = os.environ.get(
+    "CREATE_XML_QUEUE", f"{pathlib.Path(__file__).parent.absolute()}/queue"
+)
+# пауза обработчика, когда в очереди нет доступных заданий, секунд
+QUEUE_POLL_SECONDS = 10
+# CREATE_XML_MEMORY_REPORT=1 включает замер пикового потребления памяти
+MEMORY_REPORT = os.environ.get("CREATE_XML_MEMORY_REPORT") == "1"
+# CREATE_XML_PROFILE=1 (или ключ --profile) включает выборочный
+# профилировщик запуска или обработчика очереди (--worker),
+# профиль пишется рядом с файлом лога
+PROFILE = os.environ.get("CREATE_XML_PROFILE") == "1"
+PROFILE_PATH = f"{pathlib.Path(__file__).parent.absolute()}"
+# папка с ini и bat файлами по компаниям и исходный CryptoSendMail.exe
+WORK_ROOT = f"{pathlib.Path(__file__).parent.absolute()}/CZ"
+CRYPTOSENDMAIL_PATH = f"{pathlib.Path(__file__).parent.absolute()}/CryptoSendMail.exe"
+# путь к файлу настроек можно переопределить переменной окружения
+# (используется при прогоне на записанных данных replay_create_xml.py)
+SETTINGS_PATH = os.environ.get(
+    "CREATE_XML_SETTINGS",
+    f"{pathlib.Path(__file__).parent.absolute()}/settings.yaml",
+)
 
 
 # Настройки для логера
@@ -104,6 +259,7 @@ if platform == "linux" or platform == "linux2":
             "%(asctime)s - %(levelname)s - " "%(funcName)s: %(lineno)d - %(message)s"
         ),
     )
+    PROFILE_PATH = "/var/log/log-execute"
 elif platform == "win32":
     logging.basicConfig(
         filename=f"{pathlib.Path(__file__).parent.absolute()}/create_send_xml_cz.log.txt",
@@ -116,19 +272,166 @@ elif platform == "win32":
 
 # Загружаем yaml файл с настройками
 with open(
-    f"{pathlib.Path(__file__).parent.absolute()}/settings.yaml",
+    SETTINGS_PATH,
     "r",
     encoding="utf8",
 ) as yaml_file:
     settings = yaml.safe_load(yaml_file)
-avsoltek_settings = pd.DataFrame(settings["avsoltek"])
-greenrus_settings = pd.DataFrame(settings["greenrus"])
-sunveter_settings = pd.DataFrame(settings["sunveter"])
 telegram_settings = pd.DataFrame(settings["telegram"])
 cz_path_settings = pd.DataFrame(settings["cz_path"])
+# архив отправленных заявок лучше держать на локальном диске,
+# папку можно задать в cz_path (archive_path)
+if "archive_path" in cz_path_settings.columns:
+    ARCHIVE_PATH = str(cz_path_settings.archive_path[0])
+else:
+    ARCHIVE_PATH = f"{pathlib.Path(__file__).parent.absolute()}/archive"
 basic_email_settings = pd.DataFrame(settings["basic_email_settings"])
 reserve_email_settings = pd.DataFrame(settings["reserve_email_settings"])
 sql_settings = pd.DataFrame(settings["sql_db"])
+if "rejected_cz_statuses" in settings.get("monitoring", {}):
+    REJECTED_CZ_STATUSES = tuple(
+        str(status).strip().lower()
+        for status in settings["monitoring"]["rejected_cz_statuses"]
+    )
+# обязательные настройки юр.лица в реестре компаний
+COMPANY_REQUIRED_KEYS = ("login", "password", "x509id", "sender")
+
+# Пул подключений к БД (engine на каждую базу создается один раз
+# и переиспользуется всеми потоками)
+DB_ENGINES = {}
+DB_ENGINES_LOCK = threading.Lock()
+# os.chdir меняет рабочую папку всего процесса, поэтому запуск
+# bat файлов из разных потоков выполняется по очереди
+START_BAT_LOCK = threading.Lock()
+# скомпилированные xsd схемы по потокам проверки
+BID_SCHEMA_LOCAL = threading.local()
+# пул проверки xml общий для всех компаний, чтобы схема
+# компилировалась один раз на поток за весь запуск
+VALIDATION_POOL = ThreadPoolExecutor(
+    max_workers=VALIDATION_WORKERS, thread_name_prefix="xml_validate"
+)
+# запись xml идет в пуле потоков, незавершенные записи {путь: future}
+XML_WRITE_POOL = ThreadPoolExecutor(
+    max_workers=XML_WRITE_WORKERS, thread_name_prefix="xml_write"
+)
+XML_WRITES = {}
+XML_WRITES_LOCK = threading.Lock()
+# журнал текущего запуска: файл, выполненные этапы {ключ этапа: время}
+# и папки меток отправки {направление/компания: название папки}
+RUN_JOURNAL = {"file": None, "stages": {}, "claims": {}}
+RUN_JOURNAL_LOCK = threading.Lock()
+# реестр компаний {код участника: настройки}, перечитывается
+# при изменении файла настроек
+COMPANY_REGISTRY = {"mtime": None, "companies": {}}
+COMPANY_REGISTRY_LOCK = threading.Lock()
+# авторизованные сессии атс {компания: {"cookie", "expires"}}
+ATS_SESSIONS = {"file": None, "sessions": {}}
+ATS_SESSIONS_LOCK = threading.Lock()
+# аренда задания обработчика очереди не продлена, задание прерывается
+# на ближайшей проверке check_job_lease
+JOB_LEASE_LOST = threading.Event()
+# соответствие ГТП и компаний (таблица ses_gtp): подпись таблицы,
+# датафрейм и словари {гтп: компания} для GVIE и PVIE. Копия хранится
+# в файле GTP_MAPPING_CACHE_NAME рядом со снимками прогноза, таблица
+# перечитывается из базы только при изменении подписи
+GTP_MAPPING_CACHE_NAME = "ses_gtp_cache.json"
+GTP_COMPANY_CACHE = {"signature": None, "dataframe": None, "index": {}}
+GTP_COMPANY_CACHE_LOCK = threading.Lock()
+
+
+def company_settings_record(section: Union[List, Dict]) -> Dict[str, str]:
+    """
+    Функция получения настроек юр.лица из раздела yaml.
+    Раздел может быть словарем, списком словарей (берется первый)
+    или словарем списков (как для pd.DataFrame).
+    """
+    if isinstance(section, list):
+        section = section[0] if section else {}
+    return {
+        str(key): (
+            "" if value is None else str(value[0] if isinstance(value, list) else value)
+        )
+        for key, value in section.items()
+    }
+
+
+def parse_company_registry(settings: Dict) -> Dict[str, Dict[str, str]]:
+    """
+    Функция разбора реестра компаний из настроек.
+    Берется раздел companies ({код участника: настройки}), а если его нет,
+    то старые разделы по юр.лицам (любой раздел с x509id).
+    Ошибки проверяются по всем компаниям сразу и выдаются
+    одним ValueError.
+    """
+    if "companies" in settings:
+        sections = list(settings["companies"].items())
+    else:
+        sections = [
+            (key, value)
+            for key, value in settings.items()
+            if isinstance(value, (list, dict))
+            and "x509id" in company_settings_record(value)
+        ]
+    registry = {}
+    errors = []
+    for code, section in sections:
+        company = str(code).upper()
+        record = company_settings_record(section)
+        missing = [key for key in COMPANY_REQUIRED_KEYS if not record.get(key)]
+        if missing:
+            errors.append(f"{company}: не заданы {', '.join(missing)}")
+        if company in registry:
+            errors.append(f"{company}: компания указана дважды")
+        record.setdefault("representator", record.get("sender", ""))
+        registry[company] = record
+    x509ids = [record.get("x509id") for record in registry.values()]
+    for x509id in {x509id for x509id in x509ids if x509ids.count(x509id) > 1}:
+        errors.append(f"x509id {x509id} указан у нескольких компаний")
+    if errors:
+        raise ValueError(f"Ошибки в реестре компаний: {'; '.join(errors)}")
+    return registry
+
+
+def reload_company_registry() -> None:
+    """
+    Функция перечитывания реестра компаний, если файл настроек
+    изменился. При ошибках в новом файле остается прежний реестр,
+    поэтому реестр можно править не останавливая работу.
+    """
+    mtime = os.path.getmtime(SETTINGS_PATH)
+    if mtime == COMPANY_REGISTRY["mtime"]:
+        return
+    with COMPANY_REGISTRY_LOCK:
+        if mtime == COMPANY_REGISTRY["mtime"]:
+            return
+        try:
+            with open(SETTINGS_PATH, "r", encoding="utf8") as yaml_file:
+                companies = parse_company_registry(yaml.safe_load(yaml_file))
+        except (OSError, ValueError, yaml.YAMLError) as err:
+            if COMPANY_REGISTRY["mtime"] is None:
+                raise
+            telegram(1, f"create_xml: Реестр компаний не обновлен - {err}")
+            logging.error(f"create_xml: Реестр компаний не обновлен - {err}")
+            return
+        COMPANY_REGISTRY["companies"] = companies
+        if COMPANY_REGISTRY["mtime"] is not None:
+            logging.info(
+                f"create_xml: Реестр компаний обновлен, компаний: {len(companies)}."
+            )
+        COMPANY_REGISTRY["mtime"] = mtime
+
+
+def get_company_settings(company: str) -> Union[Dict[str, str], None]:
+    """
+    Функция получения настроек юр.лица из реестра по коду участника.
+    Если компании нет в реестре, то отправляется уведомление
+    и возвращается None.
+    """
+    company_settings = COMPANY_REGISTRY["companies"].get(str(company).upper())
+    if company_settings is None:
+        telegram(1, f"create_xml: Нет настроек компании {company} в реестре.")
+        logging.error(f"create_xml: Нет настроек компании {company} в реестре.")
+    return company_settings
 
 
 def telegram(i: int, text: str) -> None:
@@ -176,11 +479,26 @@ def connection(i: int) -> Any:
         f"mysql://{user_yaml}:{password_yaml}@{host_yaml}:{port_yaml}/{database_yaml}"
     )
     try:
-        return create_engine(db_data).connect()
+        with DB_ENGINES_LOCK:
+            if i not in DB_ENGINES:
+                DB_ENGINES[i] = create_engine(db_data, pool_pre_ping=True)
+        return DB_ENGINES[i].connect()
     except Exception:
         return False
 
 
+def check_connection(i: int) -> bool:
+    """
+    Функция проверки доступности базы: подключение
+    сразу возвращается в пул.
+    """
+    connection_db = connection(i)
+    if connection_db is False:
+        return False
+    connection_db.close()
+    return True
+
+
 def check_internet(host: str, port: int, timeout: int) -> bool:
     """
     Функция проверки доступности внешней сети путем
@@ -230,14 +548,14 @@ def load_data_to_db(db_name: str, connect_id: int, dataframe: pd.DataFrame) -> N
     logging.info("create_xml: Старт записи в БД.")
 
     dataframe = pd.DataFrame(dataframe)
-    connection_skm = connection(connect_id)
-    dataframe.to_sql(
-        name=db_name,
-        con=connection_skm,
-        if_exists="append",
-        index=False,
-        chunksize=5000,
-    )
+    with connection(connect_id) as connection_skm:
+        dataframe.to_sql(
+            name=db_name,
+            con=connection_skm,
+            if_exists="append",
+            index=False,
+            chunksize=5000,
+        )
     rows = len(dataframe)
     telegram(1, f"create_xml: записано в БД {rows} строк.")
     if len(dataframe.columns) > 5:
@@ -247,12 +565,77 @@ def load_data_to_db(db_name: str, connect_id: int, dataframe: pd.DataFrame) -> N
     logging.info("create_xml: Финиш записи в БД.")
 
 
+def data_query(
+    db_name: str,
+    col_from_database: List,
+    id_foreca: Union[int, None],
+    gtp_type: Union[str, None],
+    target_date: Union[str, None] = None,
+    gtp_codes: Union[List[str], None] = None,
+) -> str:
+    """
+    Функция формирования запроса к базе.
+    Если задан id_foreca, то запрос прогноза на target_date (ГГГГММДД)
+    с сортировкой по гтп и времени. gtp_codes ограничивает
+    запрос гтп компании задания очереди.
+    """
+    list_col_database = ",".join(col_from_database)
+    if id_foreca is None:
+        return f"select {list_col_database} from {db_name};"
+    forecast_date = datetime.datetime.strptime(target_date, "%Y%m%d").strftime(
+        "%Y-%m-%d"
+    )
+    gtp_filter = ""
+    if gtp_codes is not None:
+        gtp_filter = f"AND gtp IN ({','.join(repr(str(gtp)) for gtp in gtp_codes)}) "
+    return (
+        f"SELECT {list_col_database} FROM {db_name} WHERE id_foreca = "
+        f"{id_foreca} AND gtp LIKE '{gtp_type}%%' {gtp_filter}AND (HOUR(load_time) < 15 "
+        "AND DATE(load_time) = DATE_ADD(DATE(dt), INTERVAL -1 DAY)) AND "
+        f"DATE(dt) = '{forecast_date}' ORDER BY gtp, dt;"
+    )
+
+
+def stream_data_from_db(
+    db_name: str,
+    col_from_database: List,
+    connect_id: int,
+    id_foreca: Union[int, None],
+    gtp_type: Union[str, None],
+    chunksize: int,
+    target_date: Union[str, None] = None,
+    gtp_codes: Union[List[str], None] = None,
+) -> Iterator[pd.DataFrame]:
+    """
+    Функция потоковой загрузки из базы частями по chunksize строк.
+    Используется курсор на стороне сервера, поэтому результат
+    запроса целиком в память не загружается.
+    """
+    logging.info("create_xml: Старт потоковой загрузки из БД.")
+    connection_db = connection(connect_id)
+    if not connection_db:
+        telegram(1, f"create_xml: Нет подключения к БД для загрузки {db_name}.")
+        logging.error(f"create_xml: Нет подключения к БД для загрузки {db_name}.")
+        raise ConnectionError(f"нет подключения к БД {connect_id}")
+    connection_db = connection_db.execution_options(stream_results=True)
+    query = data_query(
+        db_name, col_from_database, id_foreca, gtp_type, target_date, gtp_codes
+    )
+    try:
+        yield from pd.read_sql(sql=query, con=connection_db, chunksize=chunksize)
+    finally:
+        connection_db.close()
+    logging.info("create_xml: Финиш потоковой загрузки из БД.")
+
+
 def load_data_from_db(
     db_name: str,
     col_from_database: List,
     connect_id: int,
     id_foreca: Union[int, None],
     gtp_type: Union[str, None],
+    target_date: Union[str, None] = None,
+    gtp_codes: Union[List[str], None] = None,
 ) -> pd.DataFrame:
     """
     Функция загрузки датафрейма из базы.
@@ -260,39 +643,315 @@ def load_data_from_db(
     telegram(1, "create_xml: Старт загрузки из БД.")
     logging.info("create_xml: Старт загрузки из БД.")
 
-    list_col_database = ",".join(col_from_database)
+    query = data_query(
+        db_name, col_from_database, id_foreca, gtp_type, target_date, gtp_codes
+    )
     connection_db = connection(connect_id)
-    if id_foreca is None:
-        query = f"select {list_col_database} from {db_name};"
-    else:
-        query = (
-            f"SELECT {list_col_database} FROM {db_name} WHERE id_foreca = "
-            f"{id_foreca} AND gtp LIKE '{gtp_type}%%' AND (HOUR(load_time) < 15 "
-            "AND DATE(load_time) = DATE_ADD(DATE(dt), INTERVAL -1 DAY)) AND "
-            "DATE(dt) = DATE_ADD(CURDATE(), INTERVAL 1 DAY) ORDER BY gtp, dt;"
-        )
-    dataframe_from_db = pd.read_sql(sql=query, con=connection_db)
+    if not connection_db:
+        telegram(1, f"create_xml: Нет подключения к БД для загрузки {db_name}.")
+        logging.error(f"create_xml: Нет подключения к БД для загрузки {db_name}.")
+        raise ConnectionError(f"нет подключения к БД {connect_id}")
+    # подключение возвращается в пул сразу после запроса,
+    # т.к. направления загружают прогноз одновременно
+    with connection_db:
+        dataframe_from_db = pd.read_sql(sql=query, con=connection_db)
 
     telegram(1, "create_xml: Финиш загрузки из БД.")
     logging.info("create_xml: Финиш загрузки из БД.")
     return dataframe_from_db
 
 
+def gtp_mapping_signature() -> Union[List[int], None]:
+    """
+    Функция получения подписи таблицы ses_gtp одним коротким запросом:
+    количество строк и сумма crc32 строк (меняется при добавлении,
+    удалении и изменении строки, в том числе с пустой компанией).
+    None, если база недоступна.
+    """
+    connection_db = connection(0)
+    if connection_db is False:
+        return None
+    try:
+        signature = pd.read_sql(
+            sql=(
+                "SELECT COUNT(*) AS row_count, "
+                "SUM(CRC32(CONCAT(IFNULL(gtp, '<null>'), '|', "
+                "IFNULL(company, '<null>')))) AS checksum "
+                "FROM visualcrossing.ses_gtp;"
+            ),
+            con=connection_db,
+        ).iloc[0]
+    except Exception as err:
+        logging.error(f"create_xml: Подпись ses_gtp не получена - {err}")
+        return None
+    finally:
+        connection_db.close()
+    return [int(signature["row_count"]), int(signature["checksum"] or 0)]
+
+
+def build_gtp_company_index(
+    gtp_company_dataframe: pd.DataFrame,
+) -> Dict[str, Dict[str, str]]:
+    """
+    Функция создания словарей {гтп: компания} для GVIE и PVIE.
+    """
+    gtp_codes = gtp_company_dataframe["gtp"].astype(str).tolist()
+    companies = gtp_company_dataframe["company"].tolist()
+    return {
+        "GVIE": dict(zip(gtp_codes, companies)),
+        # замена GVIE на PVIE для сопоставления
+        # если гтп потребления
+        "PVIE": dict(
+            zip((gtp_code.replace("G", "P") for gtp_code in gtp_codes), companies)
+        ),
+    }
+
+
+def load_gtp_company_mapping() -> pd.DataFrame:
+    """
+    Функция загрузки соответствия ГТП и компаний из таблицы ses_gtp.
+    Сначала запрашивается подпись таблицы, и если она не изменилась,
+    то соответствие берется из памяти или файла кэша без загрузки
+    таблицы. Если база недоступна, то используется файл кэша.
+    """
+    signature = gtp_mapping_signature()
+    cache_file = os.path.join(FORECAST_FILE_PATH, GTP_MAPPING_CACHE_NAME)
+    with GTP_COMPANY_CACHE_LOCK:
+        if GTP_COMPANY_CACHE["dataframe"] is None and os.path.exists(cache_file):
+            try:
+                with open(cache_file, "r", encoding="utf8") as json_file:
+                    cached = json.load(json_file)
+                cached_dataframe = pd.DataFrame(
+                    cached["rows"], columns=["gtp", "company"]
+                )
+                GTP_COMPANY_CACHE["signature"] = cached["signature"]
+                GTP_COMPANY_CACHE["dataframe"] = cached_dataframe
+                GTP_COMPANY_CACHE["index"] = build_gtp_company_index(cached_dataframe)
+            except (OSError, ValueError, KeyError) as err:
+                logging.error(f"create_xml: Кэш {cache_file} не прочитан - {err}")
+        cached_dataframe = GTP_COMPANY_CACHE["dataframe"]
+        if cached_dataframe is not None and (
+            signature is None or signature == GTP_COMPANY_CACHE["signature"]
+        ):
+            logging.info(
+                "create_xml: Соответствие ГТП и компаний взято из кэша "
+                f"({'база недоступна' if signature is None else 'без изменений'})."
+            )
+            return cached_dataframe
+
+    gtp_company_dataframe = load_data_from_db(
+        "visualcrossing.ses_gtp",
+        [
+            "gtp",
+            "company",
+        ],
+        0,
+        None,
+        None,
+    )
+    with GTP_COMPANY_CACHE_LOCK:
+        GTP_COMPANY_CACHE["signature"] = signature
+        GTP_COMPANY_CACHE["dataframe"] = gtp_company_dataframe
+        GTP_COMPANY_CACHE["index"] = build_gtp_company_index(gtp_company_dataframe)
+    if signature is not None:
+        try:
+            write_json_atomic(
+                cache_file,
+                {
+                    "signature": signature,
+                    "rows": gtp_company_dataframe[["gtp", "company"]].values.tolist(),
+                },
+            )
+        except OSError as err:
+            logging.error(f"create_xml: Кэш {cache_file} не записан - {err}")
+    return gtp_company_dataframe
+
+
+def try_load_gtp_company_mapping() -> Union[pd.DataFrame, None]:
+    """
+    Функция загрузки соответствия ГТП и компаний для запуска.
+    None, если база ses_gtp недоступна и кэша нет: тогда прогноз
+    берется из снимков, а компании - из реестра.
+    """
+    try:
+        return load_gtp_company_mapping()
+    except ConnectionError as err:
+        telegram(
+            1,
+            f"create_xml: Нет соответствия ГТП и компаний ({err}), "
+            "прогноз берется из снимков.",
+        )
+        logging.error(
+            f"create_xml: Нет соответствия ГТП и компаний ({err}), "
+            "прогноз берется из снимков."
+        )
+        return None
+
+
+def gtp_company_mapping(
+    gtp_company_dataframe: pd.DataFrame, gtp_type: str
+) -> Dict[str, str]:
+    """
+    Функция получения словаря {гтп: компания} для типа гтп.
+    Для загруженного соответствия словари уже готовы.
+    """
+    with GTP_COMPANY_CACHE_LOCK:
+        if gtp_company_dataframe is GTP_COMPANY_CACHE["dataframe"]:
+            return GTP_COMPANY_CACHE["index"][gtp_type]
+    return build_gtp_company_index(gtp_company_dataframe)[gtp_type]
+
+
+def company_gtp_codes(
+    company_mapping: Dict[str, str], companies: Union[Tuple[str, ...], None]
+) -> Union[List[str], None]:
+    """
+    Функция получения списка гтп компаний задания для запроса прогноза.
+    None, если компании не заданы и загружается все направление.
+    """
+    if companies is None:
+        return None
+    return [
+        gtp_code
+        for gtp_code, company in company_mapping.items()
+        if company in companies
+    ]
+
+
+def forecast_snapshot_path(
+    gtp_type: str,
+    target_date: Union[str, None] = None,
+    companies: Union[Tuple[str, ...], None] = None,
+) -> str:
+    """
+    Функция получения пути снимка прогноза. Общий снимок направления
+    пишет полный запуск, задание очереди пишет снимок своих компаний
+    на дату задания в папку FORECAST_JOBS_DIR.
+    """
+    if companies is None:
+        return os.path.join(FORECAST_FILE_PATH, f"forecast_dataframe_{gtp_type}.csv")
+    return os.path.join(
+        FORECAST_FILE_PATH,
+        FORECAST_JOBS_DIR,
+        f"forecast_dataframe_{gtp_type}_{target_date}_{'_'.join(companies)}.csv",
+    )
+
+
+def write_forecast_snapshot(
+    forecast_file: str, forecast_dataframe: pd.DataFrame
+) -> None:
+    """
+    Функция записи снимка прогноза через временный файл,
+    т.к. его могут одновременно читать обработчики очереди.
+    """
+    ensure_directory(os.path.dirname(forecast_file))
+    temp_file = f"{forecast_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+    forecast_dataframe.to_csv(temp_file)
+    os.replace(temp_file, forecast_file)
+
+
+def prepare_forecast_dataframe(
+    forecast_dataframe: pd.DataFrame, company_mapping: Dict[str, str]
+) -> pd.DataFrame:
+    """
+    Функция подготовки строк прогноза из базы: час, название компании,
+    перевод в МВт*ч с заменой нулей на 0.1 и компактные типы.
+    """
+    forecast_dataframe["dt"] = pd.to_datetime(forecast_dataframe["dt"])
+    forecast_dataframe["hour"] = forecast_dataframe["dt"].dt.hour
+    # название компании добавляется по словарю, без merge и копии прогноза
+    forecast_dataframe["company"] = forecast_dataframe["gtp"].map(company_mapping)
+    value = (forecast_dataframe["value"] / 1000).round(2)
+    forecast_dataframe["value"] = value.mask(value == 0, 0.1)
+    return compact_forecast_dataframe(forecast_dataframe)
+
+
+def stream_forecast_from_db(
+    db_name: str,
+    col_from_database: List,
+    connect_id: int,
+    forecast_source_dict: Dict,
+    gtp_type: str,
+    company_mapping: Dict[str, str],
+    target_date: str,
+    gtp_codes: Union[List[str], None] = None,
+) -> Iterator[pd.DataFrame]:
+    """
+    Функция потоковой загрузки прогноза по ГТП на target_date.
+    Строки приходят отсортированными по гтп и времени, поэтому
+    ГТП отдается сразу, как только начались строки следующей.
+    Прогнозы перебираются по порядку, как в load_forecast_from_db.
+    """
+    for forecast_source, id_foreca in forecast_source_dict.items():
+        logging.info(
+            (
+                f"create_xml: Пробую загрузить прогноз {forecast_source}"
+                f" с id={id_foreca}"
+            )
+        )
+        loaded = False
+        pending = None
+        for chunk in stream_data_from_db(
+            db_name,
+            col_from_database,
+            connect_id,
+            id_foreca,
+            gtp_type,
+            STREAM_CHUNK_ROWS,
+            target_date,
+            gtp_codes,
+        ):
+            if chunk.empty:
+                continue
+            loaded = True
+            if pending is not None:
+                chunk = pd.concat([pending, chunk], ignore_index=True)
+            # строки последней гтп части могут продолжиться в следующей
+            last_gtp = chunk["gtp"].iloc[-1]
+            is_last_gtp = chunk["gtp"] == last_gtp
+            pending = chunk[is_last_gtp]
+            for gtp_code, gtp_rows in chunk[~is_last_gtp].groupby("gtp", sort=False):
+                yield prepare_forecast_dataframe(gtp_rows.copy(), company_mapping)
+        if loaded:
+            yield prepare_forecast_dataframe(pending.copy(), company_mapping)
+            telegram(1, f"create_xml: Загружен прогноз {forecast_source}")
+            logging.info(f"create_xml: Загружен прогноз {forecast_source}")
+            return
+    telegram(1, f"create_xml: Не найден ни один прогноз на {target_date}.")
+    logging.info(f"create_xml: Не найден ни один прогноз на {target_date}.")
+    if gtp_codes is not None:
+        # задание очереди не завершает обработчик, а уходит на повтор
+        raise LookupError(f"не найден прогноз {gtp_type} на {target_date}")
+    os._exit(1)
+
+
 def load_forecast_from_db(
     db_name: str,
     col_from_database: List,
     connect_id: int,
     forecast_source_dict: Dict,
     gtp_type: str,
+    target_date: str,
+    gtp_company_dataframe: Union[pd.DataFrame, None] = None,
+    companies: Union[Tuple[str, ...], None] = None,
 ) -> pd.DataFrame:
     """
-    Функция загрузки прогноза из базы с добавлением названия компании.
-    Перебирает прогнозы из словаря по порядку, на случай если
-    какой-то не подготовился, то берется следующий.
+    Функция загрузки прогноза на target_date из базы с добавлением
+    названия компании. Перебирает прогнозы из словаря по порядку,
+    на случай если какой-то не подготовился, то берется следующий.
     Расставлены по точности в порядке убывания.
+    Если таблица ses_gtp уже загружена, то она передается
+    в gtp_company_dataframe и повторно из базы не читается.
+    Если задан companies, то загружаются только гтп этих компаний.
     """
     telegram(1, "create_xml: Старт функции load_forecast_from_db.")
     logging.info("create_xml: Старт функции load_forecast_from_db.")
+    if gtp_company_dataframe is None:
+        gtp_company_dataframe = load_gtp_company_mapping()
+    company_mapping = gtp_company_mapping(gtp_company_dataframe, gtp_type)
+    gtp_codes = company_gtp_codes(company_mapping, companies)
+    if gtp_codes == []:
+        logging.info(f"create_xml: Нет гтп {gtp_type} компаний {companies}.")
+        return compact_forecast_dataframe(pd.DataFrame(columns=list(FORECAST_DTYPES)))
     for forecast_source, id_foreca in forecast_source_dict.items():
         logging.info(
             (
@@ -306,6 +965,8 @@ def load_forecast_from_db(
             connect_id,
             id_foreca,
             gtp_type,
+            target_date,
+            gtp_codes,
         )
         if not forecast_dataframe.empty:
             telegram(
@@ -319,69 +980,123 @@ def load_forecast_from_db(
     else:
         telegram(
             1,
-            (f"create_xml: Не найден ни один прогноз на завтра."),
+            (f"create_xml: Не найден ни один прогноз на {target_date}."),
         )
         logging.info(
-            (f"create_xml: Не найден ни один прогноз на завтра."),
+            (f"create_xml: Не найден ни один прогноз на {target_date}."),
         )
+        if gtp_codes is not None:
+            # задание очереди не завершает обработчик, а уходит на повтор
+            raise LookupError(f"не найден прогноз {gtp_type} на {target_date}")
         # прекращаем выполнение скрипта, т.к. если прогноза нет,
         # то и подавать нечего.
         # или вызвать загрузку из файла
-        # return load_forecast_from_file()
+        # return load_forecast_from_file(gtp_type)
         os._exit(1)
 
-    forecast_dataframe["hour"] = pd.to_datetime(forecast_dataframe.dt.values).hour
-    gtp_company_dataframe = load_data_from_db(
-        "visualcrossing.ses_gtp",
-        [
-            "gtp",
-            "company",
-        ],
-        0,
-        None,
-        None,
-    )
-    if gtp_type == "PVIE":
-        # замена GVIE на PVIE для последующего merge
-        # если гтп потребления
-        gtp_company_dataframe["gtp"] = gtp_company_dataframe["gtp"].str.replace(
-            "G", "P"
-        )
-    forecast_dataframe = forecast_dataframe.merge(
-        gtp_company_dataframe,
-        left_on=[
-            "gtp",
-        ],
-        right_on=[
-            "gtp",
-        ],
-        how="left",
+    forecast_dataframe = prepare_forecast_dataframe(forecast_dataframe, company_mapping)
+    memory_report(f"прогноз {gtp_type}", forecast_dataframe)
+    write_forecast_snapshot(
+        forecast_snapshot_path(gtp_type, target_date, companies), forecast_dataframe
     )
-    forecast_dataframe["value"] = round(forecast_dataframe["value"] / 1000, 2)
-    forecast_dataframe.value[forecast_dataframe.value == 0] = 0.1
-    forecast_dataframe.to_csv(f"forecast_dataframe.csv")
     telegram(1, "create_xml: Финиш функции load_forecast_from_db.")
     logging.info("create_xml: Финиш функции load_forecast_from_db.")
     return forecast_dataframe
 
 
-def load_forecast_from_file() -> pd.DataFrame:
+def compact_forecast_dataframe(forecast_dataframe: pd.DataFrame) -> pd.DataFrame:
+    """
+    Функция приведения датафрейма прогноза к компактным типам:
+    гтп и компания - category, час - int8, объем - float32,
+    даты - datetime64. Лишние столбцы (например индекс из csv)
+    отбрасываются, отсутствующие пропускаются.
+    """
+    dtypes = {
+        column: dtype
+        for column, dtype in FORECAST_DTYPES.items()
+        if column in forecast_dataframe.columns
+    }
+    return forecast_dataframe[list(dtypes)].astype(dtypes)
+
+
+def memory_report(stage: str, dataframe: Union[pd.DataFrame, None] = None) -> None:
+    """
+    Функция записи в лог потребления памяти: размер датафрейма
+    по столбцам и, если включен MEMORY_REPORT, текущий и пиковый
+    объем памяти, выделенной python.
+    """
+    if dataframe is not None:
+        usage = dataframe.memory_usage(deep=True, index=False)
+        columns_usage = ", ".join(
+            f"{column}={size / 1024:.1f}" for column, size in usage.items()
+        )
+        logging.info(
+            f"create_xml: Память {stage}: датафрейм {usage.sum() / 1024:.1f} КБ "
+            f"({columns_usage})"
+        )
+    if tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        logging.info(
+            f"create_xml: Память {stage}: текущая {current / 1048576:.1f} МБ, "
+            f"пиковая {peak / 1048576:.1f} МБ"
+        )
+
+
+def load_forecast_from_file(
+    gtp_type: str,
+    target_date: Union[str, None] = None,
+    companies: Union[Tuple[str, ...], None] = None,
+) -> pd.DataFrame:
     """
     Функция загрузки прогноза из csv файла
     на случай если база недоступна.
     Каждый день когда база доступна сохранятеся файл с
-    прогнозными значениями и в случае отсутствия сети или
-    при отправке не из рабочей сети, будет возможность загрузить
+    прогнозными значениями (отдельно по типу ГТП) и в случае отсутствия
+    сети или при отправке не из рабочей сети, будет возможность загрузить
     значения из файла.
+    Если задан companies, то берется снимок задания очереди,
+    а без него - строки этих компаний из общего снимка.
     """
     telegram(1, "create_xml: Старт функции load_forecast_from_file.")
     logging.info("create_xml: Старт функции load_forecast_from_file.")
-    forecast_dataframe = pd.read_csv("forecast_dataframe.csv")
+    forecast_file = forecast_snapshot_path(gtp_type, target_date, companies)
+    if companies is not None and not os.path.exists(forecast_file):
+        forecast_file = forecast_snapshot_path(gtp_type)
+    if os.path.exists(forecast_file):
+        forecast_dataframe = compact_forecast_dataframe(pd.read_csv(forecast_file))
+    else:
+        # общий снимок прежних версий (forecast_dataframe.csv),
+        # из него берутся только гтп нужного типа
+        logging.info(
+            f"create_xml: Нет снимка {forecast_file}, загрузка из forecast_dataframe.csv."
+        )
+        forecast_dataframe = pd.read_csv(
+            os.path.join(FORECAST_FILE_PATH, "forecast_dataframe.csv")
+        )
+        forecast_dataframe = compact_forecast_dataframe(
+            forecast_dataframe[
+                forecast_dataframe["gtp"].astype(str).str.startswith(gtp_type)
+            ]
+        )
+    if companies is not None:
+        forecast_dataframe = forecast_dataframe[
+            forecast_dataframe["company"].isin(companies)
+        ]
     telegram(1, "create_xml: Финиш функции load_forecast_from_file.")
     logging.info("create_xml: Финиш функции load_forecast_from_file.")
     return forecast_dataframe
 
 
+def xml_file_name(direction: str, company: str, gtp_code: str, target_date: str) -> str:
+    """
+    Функция формирования названия файла ценовой заявки.
+    """
+    if direction == "ask":
+        return f"ASP_{company}_{gtp_code}_{target_date}.xml"
+    if direction == "bid":
+        return f"BSP_{company}_{gtp_code}_{target_date}.xml"
+
+
 def create_xml(
     class_type: str,
     version: str,
@@ -401,16 +1116,14 @@ def create_xml(
     tg_values: Dict[int, float],
     price: str,
     path_to_xml: str,
-) -> None:
+) -> str:
     """
-    Функция создания XML файла ценовой заявки
+    Функция создания XML файла ценовой заявки.
+    Возвращает название созданного файла.
     """
     logging.info(f"create_xml: Старт создания xml цз для гтп {gtp_code}.")
     # формирование названия файла
-    if direction == "ask":
-        filename = f"ASP_{company}_{gtp_code}_{target_date}.xml"
-    if direction == "bid":
-        filename = f"BSP_{company}_{gtp_code}_{target_date}.xml"
+    filename = xml_file_name(direction, company, gtp_code, target_date)
 
     local_id = str(int(datetime.datetime.now().timestamp()))
     now_time = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
@@ -535,10 +1248,15 @@ def create_xml(
         child_element_intervals.appendChild(child_element_interval)
 
         # Создание и добавление элемента "high-value" к "interval"
+        # пропущенный или пустой час пишется пустым значением,
+        # такая xml не пройдет проверку и не будет отправлена
         child_element_tg_volume = root.createElement("high-value")
         child_element_interval.appendChild(child_element_tg_volume)
+        tg_value = tg_values.get(i)
         child_element_tg_volume_text = root.createTextNode(
-            str(tg_values[i]).replace(".", ",")
+            ""
+            if tg_value is None or pd.isna(tg_value)
+            else str(tg_value).replace(".", ",")
         )
         child_element_tg_volume.appendChild(child_element_tg_volume_text)
 
@@ -559,13 +1277,198 @@ def create_xml(
     # xml_str = root.toprettyxml(indent="\t", encoding="windows-1251", standalone=False)
     xml_str = root.toprettyxml(encoding="windows-1251", standalone=False)
 
-    # Запись xml в файл из бинарной строки
-    # с проверкой есть ли папка с названием года и месяца в сетевой папке CZ
-    if not os.path.exists(path_to_xml):
-        os.makedirs(path_to_xml)
-    with open(f"{path_to_xml}\{filename}", "wb") as f:
-        f.write(xml_str)
+    # Запись xml в файл из бинарной строки в пуле потоков,
+    # папка с названием года и месяца в сетевой папке CZ создается
+    # один раз за обработку направления (process_cz_type)
+    submit_xml_write(os.path.join(path_to_xml, filename), xml_str)
     logging.info(f"create_xml: Финиш создания xml цз для гтп {gtp_code}.")
+    return filename
+
+
+def ensure_directory(dir_path: str) -> None:
+    """
+    Функция создания папки, если ее нет.
+    """
+    os.makedirs(dir_path, exist_ok=True)
+
+
+def write_xml_file(file_path: str, data: bytes) -> None:
+    """
+    Функция записи xml в пуле потоков. Папка создается один раз
+    за обработку направления, но обработчик очереди работает сутками
+    и папку между заданиями могут удалить или перенести, поэтому
+    при FileNotFoundError папка создается заново и запись повторяется.
+    """
+    try:
+        write_file_atomic(file_path, data)
+    except FileNotFoundError:
+        ensure_directory(os.path.dirname(file_path))
+        write_file_atomic(file_path, data)
+
+
+def submit_xml_write(file_path: str, data: bytes) -> None:
+    """
+    Функция постановки записи xml в пул потоков записи.
+    """
+    future = XML_WRITE_POOL.submit(write_xml_file, file_path, data)
+    with XML_WRITES_LOCK:
+        XML_WRITES[file_path] = future
+
+
+def wait_xml_writes(file_paths: List[str]) -> List[str]:
+    """
+    Функция ожидания записи xml файлов.
+    Возвращает пути файлов, которые записать не удалось.
+    """
+    with XML_WRITES_LOCK:
+        futures = {
+            file_path: XML_WRITES.pop(file_path)
+            for file_path in file_paths
+            if file_path in XML_WRITES
+        }
+    failed_paths = []
+    for file_path, future in futures.items():
+        try:
+            future.result()
+        except OSError as err:
+            telegram(1, f"create_xml: Ошибка записи {file_path} - {err}")
+            logging.error(f"create_xml: Ошибка записи {file_path} - {err}")
+            failed_paths.append(file_path)
+    return failed_paths
+
+
+@functools.lru_cache(maxsize=None)
+def load_bid_schema_document(xsd_path: str) -> Union[Any, None]:
+    """
+    Функция чтения xsd схемы ценовой заявки.
+    Файл читается один раз за запуск, если схемы нет,
+    то xml проверяются только по часовым значениям.
+    """
+    if not os.path.exists(xsd_path):
+        telegram(
+            1,
+            f"create_xml: Не найдена xsd схема {xsd_path}, "
+            "xml проверяются только по часовым значениям.",
+        )
+        logging.warning(
+            f"create_xml: Не найдена xsd схема {xsd_path}, "
+            "xml проверяются только по часовым значениям."
+        )
+        return None
+    return etree.parse(xsd_path)
+
+
+def get_bid_schema(xsd_path: str) -> Union[Any, None]:
+    """
+    Функция получения скомпилированной xsd схемы.
+    Журнал ошибок XMLSchema общий для объекта, поэтому схема
+    компилируется один раз на каждый поток проверки.
+    """
+    schema_document = load_bid_schema_document(xsd_path)
+    if schema_document is None:
+        return None
+    if getattr(BID_SCHEMA_LOCAL, "schemas", None) is None:
+        BID_SCHEMA_LOCAL.schemas = {}
+    if xsd_path not in BID_SCHEMA_LOCAL.schemas:
+        BID_SCHEMA_LOCAL.schemas[xsd_path] = etree.XMLSchema(schema_document)
+    return BID_SCHEMA_LOCAL.schemas[xsd_path]
+
+
+def check_bid_structure(document: Any) -> Union[str, None]:
+    """
+    Функция проверки часовых значений xml ценовой заявки:
+    есть все 24 часа и значения - числа с запятой.
+    Возвращает текст ошибки или None.
+    """
+    hours = document.findall("request/hourly-data/hour")
+    numbers = [hour.get("number") for hour in hours]
+    if sorted(numbers) != sorted(str(i) for i in range(BID_HOURS)):
+        return f"часы заявки {numbers} вместо 0-{BID_HOURS - 1}"
+    for hour in hours:
+        values = hour.findall("prices/intervals/interval/high-value")
+        if len(values) == 0:
+            return f"нет значения часа {hour.get('number')}"
+        for value in values:
+            if not (value.text or "").strip():
+                return f"пустое значение часа {hour.get('number')}"
+            if not BID_VALUE_PATTERN.match(value.text.strip()):
+                return f"некорректное значение часа {hour.get('number')}: {value.text}"
+    return None
+
+
+def validate_xml(xml_file: str, xsd_path: str) -> Union[str, None]:
+    """
+    Функция проверки xml файла: часовые значения проверяются всегда,
+    по xsd схеме - если она есть.
+    Возвращает текст ошибки или None, если файл корректный.
+    """
+    try:
+        document = etree.parse(xml_file)
+    except (OSError, etree.XMLSyntaxError) as err:
+        return str(err)
+    error = check_bid_structure(document.getroot())
+    if error is not None:
+        return error
+    schema = get_bid_schema(xsd_path)
+    if schema is None:
+        return None
+    if schema.validate(document):
+        return None
+    return str(schema.error_log.last_error)
+
+
+def validate_company_xml(
+    company: str,
+    path_to_xml: str,
+    xml_files: Dict[str, str],
+    xsd_path: str,
+) -> Dict[str, str]:
+    """
+    Функция параллельной проверки xml файлов компании
+    (часовые значения и xsd схема).
+    xml_files - словарь {код гтп: название файла}.
+    Возвращает словарь {код гтп: текст ошибки} только по
+    некорректным файлам.
+    """
+    logging.info(f"create_xml: Старт функции проверки xml {company}.")
+    if load_bid_schema_document(xsd_path) is None:
+        logging.warning(
+            f"create_xml: xml {company} проверяются без схемы, только часовые значения."
+        )
+    gtp_codes = list(xml_files)
+    errors = VALIDATION_POOL.map(
+        validate_xml,
+        [os.path.join(path_to_xml, xml_files[gtp_code]) for gtp_code in gtp_codes],
+        [xsd_path] * len(gtp_codes),
+    )
+    invalid_xml = {
+        gtp_code: error
+        for gtp_code, error in zip(gtp_codes, errors)
+        if error is not None
+    }
+    for gtp_code, error in invalid_xml.items():
+        telegram(
+            1,
+            f"create_xml: xml цз {gtp_code} не прошла проверку - {error}",
+        )
+        logging.error(f"create_xml: xml цз {gtp_code} не прошла проверку - {error}")
+    logging.info(f"create_xml: Финиш функции проверки xml {company}.")
+    return invalid_xml
+
+
+def move_invalid_xml(path_to_xml: str, filenames: List[str]) -> None:
+    """
+    Функция переноса некорректных xml из папки отправки,
+    чтобы они не отправлялись и не блокировали ожидание
+    пустой папки с ценовыми заявками.
+    """
+    invalid_path = f"{path_to_xml}_invalid"
+    if not os.path.exists(invalid_path):
+        os.makedirs(invalid_path)
+    for filename in filenames:
+        os.replace(
+            os.path.join(path_to_xml, filename), os.path.join(invalid_path, filename)
+        )
 
 
 def create_config_and_bat(
@@ -579,10 +1482,14 @@ def create_config_and_bat(
     gtp_list: Tuple[str],
     mode: str,
     path_to_xml: str,
+    claim_path: str,
 ) -> None:
     """
     Функция создания CryptoSendMail.ini для cryptosendmail
-    и самого bat файла.
+    и самого bat файла. Перед отправкой гтп bat создает папку-метку
+    гтп в claim_path (mkdir атомарен): если метку уже создал встречный
+    bat (основной или резервный), то гтп пропускается, поэтому
+    одна заявка не отправляется двумя bat файлами.
     """
     telegram(1, f"create_xml: Старт функции создания ini и bat для {company}.")
     logging.info(f"create_xml: Старт функции создания ini и bat для {company}.")
@@ -593,7 +1500,7 @@ def create_config_and_bat(
     # если нет, то копируем из корня
     if not os.path.exists(f"{work_path}CryptoSendMail.exe"):
         shutil.copyfile(
-            f"{pathlib.Path(__file__).parent.absolute()}/CryptoSendMail.exe",
+            CRYPTOSENDMAIL_PATH,
             f"{work_path}CryptoSendMail.exe",
         )
 
@@ -623,6 +1530,7 @@ def create_config_and_bat(
         f"set pSubj=ATS-Request:{prefix_cz_file}_{company}\n",
         f"set pPath={path_to_xml}\{prefix_cz_file}_{company}\n",
         f"set pPathMove={move_cz_path}\n",
+        f"set pClaim={claim_path}\n",
         "set pSmtp_auth=Y\n",
         "set pS=Y\n",
         "set pE=Y\n\n",
@@ -657,6 +1565,7 @@ def create_config_and_bat(
             ":pCall\n",
             "TIMEOUT /T 1 /NOBREAK\n",
             "set pGTP=%1\n\n",
+            'mkdir "%pClaim%\\%pGTP%" 2>nul || exit /b\n\n',
             (
                 "CryptoSendMail /i= /s=%pS% /e=%pE% /cs= /ce= /from= /to= "
                 "/smtp_host=%pMail% /smtt_port=%pPort% /smtp_timeout=%pTimeout% "
@@ -665,6 +1574,8 @@ def create_config_and_bat(
             ),
             "set Err1=%errorlevel%\n",
             "set ERROk=0\n",
+            # при ошибке отправки метка снимается, гтп может отправить встречный bat
+            'IF NOT %ERR1%==%ErrOk% rmdir "%pClaim%\\%pGTP%"\n',
             "IF %ERR1%==%ErrOk% move %pPath%_%pGTP%_%sentdate%.xml %pPathMove%\n\n",
             "exit /b\n\n",
             ":finish\n",
@@ -681,21 +1592,107 @@ def send_xml_cz_bat(work_path: str, bat_file_name: str, company: str) -> None:
     """
     telegram(1, f"create_xml: Старт функции отправки ценовых заявок {company}")
     logging.info(f"create_xml: Старт функции отправки ценовых заявок {company}")
-    os.chdir(work_path)
-    os.startfile(bat_file_name)
+    with START_BAT_LOCK, wait_section("com"):
+        os.chdir(work_path)
+        os.startfile(bat_file_name)
 
 
 def dir_not_empty(dir_path: str) -> bool:
     """
     Функция проверки папки на наличие файлов.
+    Недописанные временные файлы (*.tmp) не учитываются.
     Возвращает True, если папка не пустая.
     """
     with os.scandir(dir_path) as iterator:
-        if any(iterator):
+        if any(not entry.name.endswith(".tmp") for entry in iterator):
             return True
     return False
 
 
+def open_run_journal(journal_path: str, target_date: str) -> None:
+    """
+    Функция загрузки журнала запуска на целевую дату.
+    Если журнала нет, он поврежден или задан FRESH_RUN,
+    то запуск начинается с нуля.
+    """
+    os.makedirs(journal_path, exist_ok=True)
+    journal_file = os.path.join(journal_path, f"run_journal_{target_date}.json")
+    stages = {}
+    claims = {}
+    if os.path.exists(journal_file) and not FRESH_RUN:
+        try:
+            with open(journal_file, "r", encoding="utf8") as json_file:
+                journal = json.load(json_file)
+            stages = journal["stages"]
+            claims = journal.get("claims", {})
+        except (OSError, ValueError, KeyError) as err:
+            logging.error(f"create_xml: Журнал {journal_file} не прочитан - {err}")
+    with RUN_JOURNAL_LOCK:
+        RUN_JOURNAL["file"] = journal_file
+        RUN_JOURNAL["stages"] = stages
+        RUN_JOURNAL["claims"] = claims
+    if stages:
+        telegram(
+            1,
+            (
+                f"create_xml: Продолжение запуска по журналу, "
+                f"выполнено этапов: {len(stages)}."
+            ),
+        )
+        logging.info(
+            f"create_xml: Продолжение запуска по журналу {journal_file}, "
+            f"выполнено этапов: {len(stages)}, для запуска с нуля "
+            "задать CREATE_XML_FRESH_RUN=1."
+        )
+        for key, stage_time in sorted(stages.items(), key=lambda item: item[1]):
+            logging.info(f"create_xml: Этап {key} выполнен {stage_time}.")
+
+
+def journal_stage_time(*keys: str) -> Union[datetime.datetime, None]:
+    """
+    Функция получения времени выполнения этапа из журнала.
+    Ключ этапа - направление, компания (если есть) и название этапа.
+    Возвращает None, если этап не выполнен.
+    """
+    with RUN_JOURNAL_LOCK:
+        stage_time = RUN_JOURNAL["stages"].get("/".join(keys))
+    if stage_time is None:
+        return None
+    return datetime.datetime.fromisoformat(stage_time)
+
+
+def journal_mark_stage(*keys: str) -> None:
+    """
+    Функция отметки выполненного этапа в журнале.
+    """
+    with RUN_JOURNAL_LOCK:
+        RUN_JOURNAL["stages"]["/".join(keys)] = datetime.datetime.now().isoformat(
+            timespec="seconds"
+        )
+        write_run_journal()
+
+
+def write_run_journal() -> None:
+    """
+    Функция записи журнала запуска в файл (если он есть).
+    Вызывается под RUN_JOURNAL_LOCK.
+    """
+    if RUN_JOURNAL["file"] is None:
+        return
+    write_json_atomic(
+        RUN_JOURNAL["file"],
+        {"stages": RUN_JOURNAL["stages"], "claims": RUN_JOURNAL["claims"]},
+    )
+
+
+def write_json_atomic(json_path: str, data: Dict, mode: int = None) -> None:
+    """
+    Функция записи json во временный файл с атомарной заменой
+    предыдущего, поэтому падение во время записи его не портит.
+    """
+    write_file_atomic(json_path, json.dumps(data, indent=1).encode("utf8"), mode)
+
+
 def select_certificate(x509id: str) -> Union[Any, None]:
     """
     Функция выбора сертификата из хранилища по серийному номеру.
@@ -713,6 +1710,43 @@ def select_certificate(x509id: str) -> Union[Any, None]:
         )
 
 
+def create_certificates_dict(list_of_companies: List[str]) -> Dict[str, Dict]:
+    """
+    Функция создания словаря сертификатов по компаниям.
+    Хранилище просматривается один раз, словарь общий для всех
+    направлений и для проверки отчетов с атс.
+    Вызывается из основного потока, т.к. объект хранилища COM
+    создан в нем.
+    """
+    certificates_index = {}
+    with wait_section("com"):
+        for i in range(1, CERTSTORE.Certificates.count + 1):
+            certificate_item = CERTSTORE.Certificates.Item(i)
+            certificates_index.setdefault(
+                certificate_item.SerialNumber, certificate_item
+            )
+    certificates_dict = {}
+    for company in list_of_companies:
+        company_settings = COMPANY_REGISTRY["companies"].get(str(company).upper())
+        if company_settings is None:
+            continue
+        # берем серийный номер сертификата для компании
+        x509id = company_settings["x509id"]
+        # находим сертификат в хранилище
+        certificate_item = certificates_index.get(x509id)
+        if certificate_item is None:
+            certificate_item = select_certificate(x509id)
+        if certificate_item is None:
+            continue
+        certificates_dict[company] = {
+            # инфо о владельце сертификата
+            "CERTIFICATE": certificate_item.GetInfo(0),
+            # отпечаток сертификата
+            "THUMBPRINT_CERT": certificate_item.Thumbprint,
+        }
+    return certificates_dict
+
+
 def ats_send_request(
     xmlhttp: Any,
     method: str,
@@ -720,9 +1754,11 @@ def ats_send_request(
     headers: Dict,
     option: Union[int, None],
     certificate: Union[str, None],
+    accepted_statuses: Tuple[int, ...] = (200,),
 ) -> Any:
     """
     Функция отправки запросов на сайт атс.
+    Запрос повторяется, пока статус ответа не из accepted_statuses.
     """
     while True:
         if option is not None:
@@ -732,8 +1768,9 @@ def ats_send_request(
             xmlhttp.SetClientCertificate(certificate)
         for header, value in headers.items():
             xmlhttp.SetRequestHeader(header, value)
-        xmlhttp.send
-        if xmlhttp.Status == 200:
+        with wait_section("com"):
+            xmlhttp.send
+        if xmlhttp.Status in accepted_statuses:
             return xmlhttp
         print(xmlhttp.Status)
         telegram(
@@ -743,7 +1780,8 @@ def ats_send_request(
         logging.info(
             (f"create_xml: Неуспешный запрос на {url}.\nСтатус: {xmlhttp.Status}"),
         )
-        sleep(5)
+        with wait_section("sleep"):
+            sleep(5)
 
 
 def ats_get_cookie(xmlhttp: Any) -> Tuple[str, Any]:
@@ -797,14 +1835,179 @@ def ats_authorization(certificate, cookie: str, xmlhttp: Any) -> Any:
     return response
 
 
+def ats_cookie_expires(cookie: str) -> datetime.datetime:
+    """
+    Функция определения срока действия cookie атс по атрибутам
+    max-age и expires. Без них срок ATS_SESSION_TTL,
+    в любом случае не позже конца суток.
+    """
+    now = datetime.datetime.now()
+    expires = min(
+        now + datetime.timedelta(seconds=ATS_SESSION_TTL),
+        datetime.datetime.combine(
+            now.date() + datetime.timedelta(days=1), datetime.time()
+        ),
+    )
+    try:
+        morsels = list(http.cookies.SimpleCookie(cookie).values())
+    except http.cookies.CookieError:
+        return expires
+    for morsel in morsels:
+        try:
+            if morsel["max-age"]:
+                cookie_expires = now + datetime.timedelta(
+                    seconds=int(morsel["max-age"])
+                )
+            elif morsel["expires"]:
+                cookie_expires = (
+                    email.utils.parsedate_to_datetime(morsel["expires"])
+                    .astimezone()
+                    .replace(tzinfo=None)
+                )
+            else:
+                continue
+        except (TypeError, ValueError):
+            continue
+        expires = min(expires, cookie_expires)
+    return expires
+
+
+def protect_ats_cookie(cookie: str) -> str:
+    """
+    Функция шифрования cookie атс для файла сессий: на windows
+    через DPAPI (расшифровать может только текущий пользователь),
+    на других платформах cookie защищен только правами файла.
+    """
+    if platform != "win32":
+        return cookie
+    return base64.b64encode(
+        win32crypt.CryptProtectData(cookie.encode("utf8"), None, None, None, None, 0)
+    ).decode("ascii")
+
+
+def unprotect_ats_cookie(protected_cookie: str) -> str:
+    """
+    Функция расшифровки cookie атс из файла сессий.
+    """
+    if platform != "win32":
+        return protected_cookie
+    return win32crypt.CryptUnprotectData(
+        base64.b64decode(protected_cookie), None, None, None, 0
+    )[1].decode("utf8")
+
+
+def open_ats_sessions(sessions_path: str) -> None:
+    """
+    Функция загрузки сохраненных сессий атс за текущие сутки.
+    Просроченные и нерасшифрованные сессии отбрасываются.
+    """
+    os.makedirs(sessions_path, exist_ok=True)
+    sessions_file = os.path.join(
+        sessions_path,
+        f"ats_sessions_{datetime.date.today().strftime('%Y%m%d')}.json",
+    )
+    sessions = {}
+    if os.path.exists(sessions_file):
+        try:
+            with open(sessions_file, "r", encoding="utf8") as json_file:
+                sessions = json.load(json_file)["sessions"]
+        except (OSError, ValueError, KeyError) as err:
+            logging.error(
+                f"create_xml: Файл сессий атс {sessions_file} не прочитан - {err}"
+            )
+    now = datetime.datetime.now().isoformat(timespec="seconds")
+    open_sessions = {}
+    for company, session in sessions.items():
+        if session.get("expires", "") <= now:
+            continue
+        try:
+            cookie = unprotect_ats_cookie(session["cookie"])
+        except Exception as err:
+            logging.error(f"create_xml: Сессия атс {company} не расшифрована - {err}")
+            continue
+        open_sessions[company] = {"cookie": cookie, "expires": session["expires"]}
+    with ATS_SESSIONS_LOCK:
+        ATS_SESSIONS["file"] = sessions_file
+        ATS_SESSIONS["sessions"] = open_sessions
+
+
+def write_ats_sessions() -> None:
+    """
+    Функция записи сессий атс в файл (если он есть), файл доступен
+    только владельцу. Вызывается под ATS_SESSIONS_LOCK.
+    """
+    if ATS_SESSIONS["file"] is None:
+        return
+    write_json_atomic(
+        ATS_SESSIONS["file"],
+        {
+            "sessions": {
+                company: {
+                    "cookie": protect_ats_cookie(session["cookie"]),
+                    "expires": session["expires"],
+                }
+                for company, session in ATS_SESSIONS["sessions"].items()
+            }
+        },
+        ATS_SESSIONS_FILE_MODE,
+    )
+
+
+def ats_cached_cookie(company: str) -> Union[str, None]:
+    """
+    Функция получения действующего cookie атс компании из кэша сессий.
+    """
+    now = datetime.datetime.now().isoformat(timespec="seconds")
+    with ATS_SESSIONS_LOCK:
+        session = ATS_SESSIONS["sessions"].get(company)
+    if session is None or session["expires"] <= now:
+        return None
+    logging.info(f"create_xml: Сессия атс {company} взята из кэша.")
+    return session["cookie"]
+
+
+def ats_session_cookie(company: str, certificate: str, xmlhttp: Any) -> str:
+    """
+    Функция входа на атс с авторизацией по сертификату компании.
+    Новый cookie сохраняется в кэш сессий.
+    """
+    # получаем первичное cookie при заходе на сайт атс
+    cookie, xmlhttp = ats_get_cookie(xmlhttp)
+    # авторизуемся по сертификату на сайте атс
+    ats_authorization(certificate, cookie, xmlhttp)
+    with ATS_SESSIONS_LOCK:
+        ATS_SESSIONS["sessions"][company] = {
+            "cookie": cookie,
+            "expires": ats_cookie_expires(cookie).isoformat(timespec="seconds"),
+        }
+        write_ats_sessions()
+    return cookie
+
+
+def ats_session_rejected(response: Any) -> bool:
+    """
+    Функция проверки, что атс не принял сессию: 401 или редирект,
+    либо (если WinHTTP сам прошел по редиректу) страница входа
+    вместо файла отчета.
+    """
+    if response.Status in ATS_SESSION_EXPIRED_STATUSES:
+        return True
+    body = bytes(response.ResponseBody[:64]).lstrip().lower()
+    return body.startswith((b"<!doctype html", b"<html"))
+
+
 def get_monitoring_report(
     company: str,
     target_date_for_ats: str,
     xmlhttp,
     cookie: str,
-) -> pd.DataFrame:
+    certificate: Union[str, None] = None,
+) -> Union[pd.DataFrame, None]:
     """
     Функция получения отчета с раздела мониторинга ценовых заявок.
+    Возвращает None, если атс не принял сессию или оборвал
+    соединение (cookie из кэша отправляется на новом объекте WinHTTP,
+    без соединения, на котором прошла авторизация).
     """
     telegram(
         1, f"create_xml: Старт функции получения отчета мониторинга {company} с атс."
@@ -831,7 +2034,22 @@ def get_monitoring_report(
             "(KHTML, like Gecko) Chrome/31.0.1650.57 Safari/537.36"
         ),
     }
-    response = ats_send_request(xmlhttp, "GET", url, headers_report, None, None)
+    try:
+        response = ats_send_request(
+            xmlhttp,
+            "GET",
+            url,
+            headers_report,
+            None,
+            certificate,
+            (200,) + ATS_SESSION_EXPIRED_STATUSES,
+        )
+    except pythoncom.com_error as err:
+        logging.info(f"create_xml: Ошибка запроса отчета мониторинга {company} - {err}")
+        return None
+    if ats_session_rejected(response):
+        logging.info(f"create_xml: Атс не принял сессию {company}.")
+        return None
 
     report_temp = pd.read_excel(io.BytesIO(response.ResponseBody))
     report_temp.columns = [
@@ -869,15 +2087,22 @@ def compare_day_volumes(
     company_dataframe: pd.DataFrame,
     company: str,
     operational_date: str,
-) -> None:
+) -> pd.DataFrame:
     """
     Функция сравнения суточных объемов по ГТП (отправленных и принятых).
+    Возвращает отчет мониторинга с прогнозными объемами.
     """
     telegram(1, f"create_xml: Старт функции сравнения объемов {company}.")
     logging.info(f"create_xml: Старт функции сравнения объемов {company}.")
     # company_dataframe получаем суммарный объем за сутки
     # company_dataframe["value"] = round(company_dataframe["value"] / 1000, 2)
-    company_dataframe = company_dataframe.groupby("gtp")["value"].sum().reset_index()
+    company_dataframe = (
+        company_dataframe.groupby("gtp", observed=True)["value"]
+        .sum()
+        .astype("float64")
+        .round(3)
+        .reset_index()
+    )
 
     report_temp = report_temp.merge(
         company_dataframe,
@@ -892,177 +2117,1708 @@ def compare_day_volumes(
     print(report_temp)
     # report_temp.to_csv(f"bids_monitoring_{company}_{operational_date}.csv")
     report_temp.to_excel(f"bids_monitoring_{company}_{operational_date}.xlsx")
+    report_temp["company"] = company
+    # компания нужна и для пустого отчета (заявок в мониторинге еще нет)
+    report_temp.attrs["company"] = company
     telegram(1, f"create_xml: Финиш функции сравнения объемов {company}.")
     logging.info(f"create_xml: Финиш функции сравнения объемов {company}.")
+    return report_temp
 
 
-if __name__ == "__main__":
-    # Замер времени выполнения начало
-    start_time = datetime.datetime.now()
-    print(start_time)
+def failed_monitoring_bids(
+    monitoring_report: pd.DataFrame, company_dataframe: pd.DataFrame
+) -> Dict[str, str]:
+    """
+    Функция поиска ГТП компании, заявки по которым нужно подать заново:
+    заявки нет в мониторинге, статус заявки из REJECTED_CZ_STATUSES
+    или принятый объем отличается от прогнозного. Заявка без объема
+    еще не рассчитана атс и не подается заново (pending_monitoring_bids).
+    Учитываются только ГТП из прогноза.
+    Возвращает словарь {код гтп: причина}.
+    """
+    forecast_volumes = (
+        company_dataframe.groupby("gtp", observed=True)["value"]
+        .sum()
+        .astype("float64")
+        .round(3)
+    )
+    # по гтп берем последнюю строку отчета
+    report_rows = (
+        monitoring_report.assign(gtp=monitoring_report["gtp"].astype(str).str.strip())
+        .drop_duplicates("gtp", keep="last")
+        .set_index("gtp")
+    )
+    failed_bids = {}
+    for gtp_code, forecast_volume in forecast_volumes.items():
+        gtp_code = str(gtp_code)
+        if gtp_code not in report_rows.index or pd.isna(
+            report_rows.at[gtp_code, "cz_status"]
+        ):
+            failed_bids[gtp_code] = "нет заявки"
+            continue
+        cz_status = str(report_rows.at[gtp_code, "cz_status"]).strip()
+        if cz_status.lower() in REJECTED_CZ_STATUSES:
+            failed_bids[gtp_code] = f"заявка {cz_status}"
+            continue
+        total_volume = pd.to_numeric(
+            report_rows.at[gtp_code, "total_volume"], errors="coerce"
+        )
+        if pd.isna(total_volume):
+            continue
+        if abs(float(total_volume) - forecast_volume) > RESUBMIT_VOLUME_TOLERANCE:
+            failed_bids[gtp_code] = (
+                f"объем {total_volume} вместо {round(forecast_volume, 3)}"
+            )
+    return failed_bids
 
-    # internet_is_on = check_internet(GOOGLE_HOST, GOOGLE_OPENPORT, GOOGLE_TIMEOUT)
-    work_smtp_available = check_smtp(basic_email_settings.config[0])
-    check_db_connection = connection(1)
 
-    if work_smtp_available:
-        MODE = "basic"
-        E_MAIL = str(basic_email_settings.e_mail[0])
-        E_MAIL_CONFIG = basic_email_settings.config[0]
+def pending_monitoring_bids(
+    monitoring_report: pd.DataFrame, company_dataframe: pd.DataFrame
+) -> List[str]:
+    """
+    Функция поиска ГТП компании, заявки по которым есть в мониторинге,
+    но суммарный объем атс еще не рассчитан: их нужно проверить позже.
+    Возвращает список кодов гтп.
+    """
+    failed_bids = failed_monitoring_bids(monitoring_report, company_dataframe)
+    report_rows = (
+        monitoring_report.assign(gtp=monitoring_report["gtp"].astype(str).str.strip())
+        .drop_duplicates("gtp", keep="last")
+        .set_index("gtp")
+    )
+    return [
+        str(gtp_code)
+        for gtp_code in company_dataframe["gtp"].astype(str).unique()
+        if gtp_code not in failed_bids
+        and gtp_code in report_rows.index
+        and pd.isna(
+            pd.to_numeric(report_rows.at[gtp_code, "total_volume"], errors="coerce")
+        )
+    ]
+
+
+def format_monitoring_changes(changes: pd.DataFrame) -> List[str]:
+    """
+    Функция формирования строк сообщения об изменениях мониторинга.
+    """
+    column_names = {
+        "cz_status": "статус заявки",
+        "gtp_status": "статус гтп",
+        "cz_number": "номер заявки",
+        "total_volume": "объем",
+    }
+    lines = []
+    for row in changes.to_dict("records"):
+        if row["is_new"]:
+            transitions = [
+                f"{column_names[column]} {row[column]}"
+                for column in TRACKED_COLUMNS
+                if not pd.isna(row[column])
+            ]
+        else:
+            transitions = [
+                (
+                    f"{column_names[column]} {row[f'{column}_previous']}"
+                    f" -> {row[column]}"
+                )
+                for column in TRACKED_COLUMNS
+                if row[f"{column}_changed"]
+            ]
+        lines.append(f"{row['company']} {row['gtp']}: {', '.join(transitions)}")
+    return lines
+
+
+def report_monitoring_changes(
+    monitoring_reports: List[pd.DataFrame], operational_date: str, check_time: str
+) -> pd.DataFrame:
+    """
+    Функция сохранения проверки мониторинга в историю и отправки
+    в телеграм только изменений с прошлой проверки (по всем компаниям).
+    Возвращает изменения.
+    """
+    if not monitoring_reports:
+        return pd.DataFrame()
+    current = pd.concat(monitoring_reports, ignore_index=True).rename(
+        columns={"value": "forecast_volume"}
+    )
+    changes = monitoring_changes(
+        previous_check(ARCHIVE_PATH, operational_date, check_time), current
+    )
+    record_check(ARCHIVE_PATH, operational_date, check_time, current)
+    if changes.empty:
+        telegram(1, "create_xml: Изменений в мониторинге нет.")
+        logging.info("create_xml: Изменений в мониторинге нет.")
+        return changes
+    message = "\n".join(format_monitoring_changes(changes))
+    telegram(1, f"create_xml: Изменения в мониторинге:\n{message}")
+    logging.info(f"create_xml: Изменения в мониторинге:\n{message}")
+    return changes
+
+
+def company_ready_settings(
+    company: str, certificates_dict: Dict[str, Dict]
+) -> Union[Dict[str, str], None]:
+    """
+    Функция проверки, что для компании есть настройки и сертификат.
+    Возвращает настройки компании или None.
+    """
+    company_settings = get_company_settings(company)
+    if company_settings is None:
+        return None
+    if company not in certificates_dict:
+        telegram(1, f"create_xml: Нет сертификата компании {company}.")
+        logging.error(f"create_xml: Нет сертификата компании {company}.")
+        return None
+    return company_settings
+
+
+def write_gtp_xml(
+    direction: str,
+    company: str,
+    company_settings: Dict[str, str],
+    gtp_code: str,
+    gtp_dataframe: pd.DataFrame,
+    e_mail: str,
+    path_to_xml: str,
+    target_date: str,
+) -> str:
+    """
+    Функция создания xml ценовой заявки по строкам прогноза одной ГТП
+    на target_date. Возвращает название файла.
+    """
+    # float32 приводится обратно к float64 с округлением,
+    # чтобы в xml не попадали хвосты вида 0,10000000149
+    tg_values = dict(
+        zip(
+            gtp_dataframe.hour,
+            gtp_dataframe.value.astype("float64").round(2),
+        )
+    )
+    return create_xml(
+        CLASS_TYPE,
+        VERSION,
+        direction,
+        MODIFICATION_CONSENT,
+        INTEGRAL_TYPE,
+        target_date,
+        company_settings["sender"],
+        company_settings["representator"],
+        PHONE,
+        e_mail,
+        company,
+        gtp_code,
+        BILATERAL_VOLUME,
+        RD_PRIORITY_VOLUME,
+        INTERVAL_NUMBER,
+        tg_values,
+        PRICE,
+        path_to_xml,
+    )
+
+
+def stream_forecast_to_xml(
+    direction: str,
+    gtp_type: str,
+    forecast_source_dict: Dict,
+    gtp_company_dataframe: Union[pd.DataFrame, None],
+    certificates_dict: Dict[str, Dict],
+    e_mail: str,
+    path_to_xml: str,
+    target_date: str,
+    companies: Union[Tuple[str, ...], None] = None,
+) -> Tuple[pd.DataFrame, Dict[str, Dict[str, str]]]:
+    """
+    Функция потокового создания xml на target_date: строки прогноза
+    читаются курсором на стороне сервера и xml по ГТП создается сразу,
+    как только пришли все ее строки. В памяти остаются только
+    суточные объемы по ГТП для сверки с мониторингом, полный прогноз
+    дописывается в снимок csv для загрузки из файла.
+    Если задан companies, то загружаются и создаются только гтп
+    этих компаний, а прогноз пишется в снимок задания.
+    Возвращает суточные объемы и словарь {компания: {гтп: файл}}.
+    """
+    telegram(1, "create_xml: Старт потокового создания xml.")
+    logging.info("create_xml: Старт потокового создания xml.")
+    if gtp_company_dataframe is None:
+        gtp_company_dataframe = load_gtp_company_mapping()
+    company_mapping = gtp_company_mapping(gtp_company_dataframe, gtp_type)
+    gtp_codes = company_gtp_codes(company_mapping, companies)
+    if gtp_codes == []:
+        logging.info(f"create_xml: Нет гтп {gtp_type} компаний {companies}.")
+        return (
+            compact_forecast_dataframe(
+                pd.DataFrame(columns=["gtp", "company", "value"])
+            ),
+            {},
+        )
+    forecast_file = forecast_snapshot_path(gtp_type, target_date, companies)
+    ensure_directory(os.path.dirname(forecast_file))
+    temp_file = f"{forecast_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+    companies_settings = {}
+    company_xml_files = {}
+    daily_volumes = []
+    for gtp_dataframe in stream_forecast_from_db(
+        "treid_03.weather_foreca",
+        ["gtp", "dt", "load_time", "value"],
+        1,
+        forecast_source_dict,
+        gtp_type,
+        company_mapping,
+        target_date,
+        gtp_codes,
+    ):
+        gtp_dataframe.to_csv(
+            temp_file,
+            mode="a" if daily_volumes else "w",
+            header=not daily_volumes,
+            index=False,
+        )
+        gtp_code = str(gtp_dataframe["gtp"].iloc[0])
+        company = gtp_dataframe["company"].iloc[0]
+        daily_volumes.append(
+            {
+                "gtp": gtp_code,
+                "company": company,
+                "value": gtp_dataframe["value"].astype("float64").sum(),
+            }
+        )
+        if pd.isna(company) or (companies is not None and company not in companies):
+            continue
+        if company not in companies_settings:
+            companies_settings[company] = company_ready_settings(
+                company, certificates_dict
+            )
+        if companies_settings[company] is None:
+            continue
+        company_xml_files.setdefault(company, {})[gtp_code] = write_gtp_xml(
+            direction,
+            company,
+            companies_settings[company],
+            gtp_code,
+            gtp_dataframe,
+            e_mail,
+            path_to_xml,
+            target_date,
+        )
+    os.replace(temp_file, forecast_file)
+    telegram(1, "create_xml: Финиш потокового создания xml.")
+    logging.info("create_xml: Финиш потокового создания xml.")
+    return (
+        compact_forecast_dataframe(
+            pd.DataFrame(daily_volumes, columns=["gtp", "company", "value"])
+        ),
+        company_xml_files,
+    )
+
+
+def company_work_path(company: str, prefix_cz_file: str) -> str:
+    """
+    Функция получения папки с ini и bat файлами компании по направлению.
+    У каждого направления своя папка, т.к. ini и bat файлы
+    направлений создаются и запускаются одновременно.
+    """
+    company_settings = get_company_settings(company) or {}
+    work_root = company_settings.get("work_path", f"{WORK_ROOT}/{company}")
+    return f"{work_root}/{prefix_cz_file}/"
+
+
+def start_company_bat(
+    company: str,
+    work_path: str,
+    prefix_cz_file: str,
+    gtp_list: Tuple[str, ...],
+    certificates_dict: Dict[str, Dict],
+    mode: str,
+    e_mail_config: Dict[str, str],
+    path_to_xml: str,
+    move_cz_path: str,
+    claim_path: str,
+    target_date: str,
+) -> None:
+    """
+    Функция создания ini и bat файлов компании и запуска отправки
+    ГТП из gtp_list на target_date в указанном порядке. claim_path - папка меток
+    отправки, общая для основного и резервного bat файлов.
+    """
+    bat_file_name = f"!Отправить_ценовые_заявки_{company}!.bat"
+    # добавляем отпечаток в конфиг для ini файла
+    # (копия конфига, т.к. он общий для всех потоков)
+    company_e_mail_config = dict(e_mail_config)
+    company_e_mail_config["CertSign"] = str(
+        certificates_dict[company]["THUMBPRINT_CERT"]
+    ).lower()
+    create_config_and_bat(
+        company,
+        work_path,
+        bat_file_name,
+        company_e_mail_config,
+        target_date,
+        prefix_cz_file,
+        move_cz_path,
+        gtp_list,
+        mode,
+        path_to_xml,
+        claim_path,
+    )
+    send_xml_cz_bat(work_path, bat_file_name, company)
+
+
+def company_claim_path(
+    company: str, prefix_cz_file: str, direction: str, fresh: bool = False
+) -> str:
+    """
+    Функция получения папки меток отправки компании по направлению.
+    Название папки хранится в журнале запуска, и при продолжении после
+    падения папка переиспользуется: bat файлы упавшего запуска могут
+    еще работать, и их метки должны остаться в силе. Новая папка
+    создается при первой отправке и при повторной подаче (fresh).
+    Папки прошлых отправок удаляются через CLAIMS_KEEP_SECONDS.
+    """
+    claims_root = os.path.join(company_work_path(company, prefix_cz_file), "claims")
+    with RUN_JOURNAL_LOCK:
+        claim_name = RUN_JOURNAL["claims"].get(f"{direction}/{company}")
+        if claim_name is None or fresh:
+            claim_name = uuid.uuid4().hex
+            RUN_JOURNAL["claims"][f"{direction}/{company}"] = claim_name
+            write_run_journal()
+        journal_claims = set(RUN_JOURNAL["claims"].values())
+    remove_stale_claims(claims_root, journal_claims)
+    claim_path = os.path.normpath(os.path.join(claims_root, claim_name))
+    os.makedirs(claim_path, exist_ok=True)
+    return claim_path
+
+
+def remove_stale_claims(claims_root: str, keep_names: set) -> None:
+    """
+    Функция удаления папок меток старше CLAIMS_KEEP_SECONDS,
+    кроме папок из журнала запуска.
+    """
+    if not os.path.isdir(claims_root):
+        return
+    stale_time = datetime.datetime.now().timestamp() - CLAIMS_KEEP_SECONDS
+    with os.scandir(claims_root) as iterator:
+        stale_paths = [
+            entry.path
+            for entry in iterator
+            if entry.name not in keep_names and entry.stat().st_mtime < stale_time
+        ]
+    for stale_path in stale_paths:
+        shutil.rmtree(stale_path, ignore_errors=True)
+
+
+def claimed_gtp_codes(
+    company: str,
+    prefix_cz_file: str,
+    direction: str,
+    move_cz_path: str,
+    target_date: str,
+) -> set:
+    """
+    Функция получения гтп, уже отмеченных bat файлами в папке меток
+    компании из журнала запуска: заявка отправлена (xml перенесен
+    в move_cz_path) или ее еще отправляет bat файл упавшего запуска
+    (метка моложе CLAIM_STALE_SECONDS). Старые метки без отправленной
+    заявки оставил завершившийся bat файл, они снимаются.
+    """
+    with RUN_JOURNAL_LOCK:
+        claim_name = RUN_JOURNAL["claims"].get(f"{direction}/{company}")
+    if claim_name is None:
+        return set()
+    claim_path = os.path.join(
+        company_work_path(company, prefix_cz_file), "claims", claim_name
+    )
+    if not os.path.isdir(claim_path):
+        return set()
+    stale_time = datetime.datetime.now().timestamp() - CLAIM_STALE_SECONDS
+    claimed = set()
+    with os.scandir(claim_path) as iterator:
+        for entry in iterator:
+            filename = xml_file_name(direction, company, entry.name, target_date)
+            if os.path.exists(os.path.join(move_cz_path, filename)):
+                claimed.add(entry.name)
+            elif entry.stat().st_mtime >= stale_time:
+                claimed.add(entry.name)
+            else:
+                os.rmdir(entry.path)
+    return claimed
+
+
+def send_company_xml(
+    company: str,
+    xml_files: Dict[str, str],
+    gtp_volumes: Dict[str, float],
+    direction: str,
+    prefix_cz_file: str,
+    certificates_dict: Dict[str, Dict],
+    mode: str,
+    e_mail_config: Dict[str, str],
+    path_to_xml: str,
+    move_cz_path: str,
+    target_date: str,
+    fresh_claim: bool = False,
+) -> List[Dict[str, Any]]:
+    """
+    Функция проверки xml компании, создания ini и bat
+    файлов и запуска отправки. ГТП отправляются по убыванию
+    суточного объема (gtp_volumes). ГТП, которые уже отметил
+    bat файл прошлого запуска, не отправляются повторно,
+    при повторной подаче (fresh_claim) берется новая папка меток.
+    Возвращает список отправляемых заявок для контроля отправки и архива.
+    """
+    # xml компании пишутся в пуле потоков, дожидаемся их записи,
+    # незаписанные гтп не отправляем
+    failed_paths = wait_xml_writes(
+        [os.path.join(path_to_xml, filename) for filename in xml_files.values()]
+    )
+    xml_files = {
+        gtp_code: filename
+        for gtp_code, filename in xml_files.items()
+        if os.path.join(path_to_xml, filename) not in failed_paths
+    }
+    # этап отмечается, только если записаны все xml, иначе
+    # продолжение по журналу создаст xml компании заново
+    if failed_paths:
+        telegram(
+            1,
+            f"create_xml: Не записано {len(failed_paths)} xml {company} ({direction}).",
+        )
+        logging.error(
+            f"create_xml: Не записано {len(failed_paths)} xml {company} ({direction})."
+        )
     else:
-        MODE = "reserve"
-        E_MAIL = str(reserve_email_settings.e_mail[0])
-        E_MAIL_CONFIG = reserve_email_settings.config[0]
+        journal_mark_stage(direction, company, "xml_written")
+    # проверяем xml до отправки,
+    # некорректные гтп не отправляем, остальные уходят как обычно
+    invalid_xml = validate_company_xml(company, path_to_xml, xml_files, BID_XSD_PATH)
+    if invalid_xml:
+        move_invalid_xml(path_to_xml, [xml_files[gtp_code] for gtp_code in invalid_xml])
+        # по журналу такие гтп исключаются из повторной подачи
+        for gtp_code in invalid_xml:
+            journal_mark_stage(direction, company, gtp_code, "invalid")
+    # гтп, отмеченные bat файлом прошлого запуска (прошлой попытки
+    # задания), уже отправлены или он отправит их сам
+    claimed = (
+        set()
+        if fresh_claim
+        else claimed_gtp_codes(
+            company, prefix_cz_file, direction, move_cz_path, target_date
+        )
+    )
+    for gtp_code in claimed & set(xml_files):
+        # xml отправленной заявки, созданный заново при повторе задания
+        filename = xml_file_name(direction, company, gtp_code, target_date)
+        if os.path.exists(os.path.join(move_cz_path, filename)) and os.path.exists(
+            os.path.join(path_to_xml, filename)
+        ):
+            os.remove(os.path.join(path_to_xml, filename))
+    # самые крупные по объему заявки уходят первыми
+    gtp_list = tuple(
+        sorted(
+            (
+                gtp_code
+                for gtp_code in xml_files
+                if gtp_code not in invalid_xml and gtp_code not in claimed
+            ),
+            key=lambda gtp_code: -gtp_volumes.get(gtp_code, 0.0),
+        )
+    )
+    if len(gtp_list) == 0:
+        if not failed_paths:
+            journal_mark_stage(direction, company, "sent")
+        return []
+
+    # задание очереди с потерянной арендой заявки не отправляет
+    check_job_lease()
+    claim_path = company_claim_path(company, prefix_cz_file, direction, fresh_claim)
+    start_company_bat(
+        company,
+        company_work_path(company, prefix_cz_file),
+        prefix_cz_file,
+        gtp_list,
+        certificates_dict,
+        mode,
+        e_mail_config,
+        path_to_xml,
+        move_cz_path,
+        claim_path,
+        target_date,
+    )
+    return [
+        {
+            "company": company,
+            "gtp": gtp_code,
+            "direction": direction,
+            "prefix": prefix_cz_file,
+            "volume": gtp_volumes.get(gtp_code, 0.0),
+            "filename": xml_files[gtp_code],
+            "path": os.path.join(move_cz_path, xml_files[gtp_code]),
+            "claim_path": claim_path,
+            "target_date": target_date,
+        }
+        for gtp_code in gtp_list
+    ]
+
+
+def gate_closure_deadline(target_date: str) -> datetime.datetime:
+    """
+    Функция получения времени закрытия приема заявок
+    на операционные сутки target_date.
+    """
+    return datetime.datetime.combine(
+        datetime.datetime.strptime(target_date, "%Y%m%d").date()
+        - datetime.timedelta(days=1),
+        GATE_CLOSURE_TIME,
+    )
+
+
+def escalate_to_reserve(
+    company: str,
+    prefix_cz_file: str,
+    pending_bids: List[Dict[str, Any]],
+    certificates_dict: Dict[str, Dict],
+    path_to_xml: str,
+    move_cz_path: str,
+) -> None:
+    """
+    Функция дополнительной отправки оставшихся заявок компании через
+    резервную почту. Резервный bat идет с конца списка (от меньших
+    объемов), навстречу основному, поэтому крупные заявки
+    по-прежнему уходят первыми. Оба bat файла отмечают гтп в общей
+    папке меток перед отправкой, поэтому где списки встретятся,
+    гтп отправит только один из них.
+    """
+    # pending_bids в порядке основного bat файла (по убыванию объема)
+    gtp_list = tuple(bid["gtp"] for bid in reversed(pending_bids))
+    telegram(
+        1,
+        (
+            f"create_xml: Отправка {company} не успевает до закрытия приема "
+            f"заявок, {len(gtp_list)} заявок дополнительно через резервную почту."
+        ),
+    )
+    logging.warning(
+        f"create_xml: Отправка {company} не успевает до закрытия приема "
+        f"заявок, {len(gtp_list)} заявок дополнительно через резервную почту."
+    )
+    start_company_bat(
+        company,
+        company_work_path(company, f"{prefix_cz_file}_reserve"),
+        prefix_cz_file,
+        gtp_list,
+        certificates_dict,
+        "reserve",
+        reserve_email_settings.config[0],
+        path_to_xml,
+        move_cz_path,
+        pending_bids[0]["claim_path"],
+        pending_bids[0]["target_date"],
+    )
 
-    # for cz_type in ("consumption", "generation"):
-    for cz_type in ("generation",):
+
+def wait_for_sending(
+    path_to_xml: str,
+    sent_bids: List[Dict[str, Any]],
+    mode: str,
+    certificates_dict: Dict[str, Dict],
+    move_cz_path: str,
+    target_date: str,
+    wait_all_files: bool = True,
+) -> None:
+    """
+    Функция ожидания отправки всех заявок с контролем темпа.
+    bat файл переносит отправленный xml из папки, поэтому по оставшимся
+    файлам считается темп отправки каждой компании и оценивается время
+    окончания. Если оно позже закрытия приема заявок, то оставшиеся
+    заявки компании дополнительно отправляются через резервную почту.
+    При wait_all_files=False ждем только заявки из sent_bids, а не
+    опустошения папки (папка общая с другими обработчиками очереди).
+    """
+    deadline = gate_closure_deadline(target_date)
+    start_time = datetime.datetime.now()
+    bat_groups = {}
+    for bid in sent_bids:
+        bat_groups.setdefault((bid["direction"], bid["company"]), []).append(bid)
+    # при работе через резервную почту ускорять уже нечем
+    escalated = set(bat_groups) if mode == "reserve" else set()
+    reserve_checked = False
+    late_reported = False
+    while (
+        dir_not_empty(path_to_xml)
+        if wait_all_files
+        else any(
+            os.path.exists(os.path.join(path_to_xml, bid["filename"]))
+            for bid in sent_bids
+        )
+    ):
+        check_job_lease()
+        now = datetime.datetime.now()
+        elapsed = (now - start_time).total_seconds()
+        for (direction, company), bids in bat_groups.items():
+            pending_bids = [
+                bid
+                for bid in bids
+                if os.path.exists(os.path.join(path_to_xml, bid["filename"]))
+            ]
+            sent_count = len(bids) - len(pending_bids)
+            if sent_count > 0:
+                seconds_per_bid = elapsed / sent_count
+            else:
+                seconds_per_bid = max(SEND_SECONDS_PER_BID, elapsed)
+            projected_finish = now + datetime.timedelta(
+                seconds=seconds_per_bid * len(pending_bids)
+            )
+            if (
+                not pending_bids
+                or projected_finish <= deadline
+                or (direction, company) in escalated
+            ):
+                continue
+            if not reserve_checked:
+                reserve_checked = True
+                if not check_smtp(reserve_email_settings.config[0]):
+                    escalated = set(bat_groups)
+            if (direction, company) in escalated:
+                if not late_reported:
+                    late_reported = True
+                    telegram(
+                        1,
+                        "create_xml: Отправка не успевает до закрытия "
+                        "приема заявок, резервная почта недоступна.",
+                    )
+                    logging.warning(
+                        "create_xml: Отправка не успевает до закрытия "
+                        "приема заявок, резервная почта недоступна."
+                    )
+                continue
+            escalated.add((direction, company))
+            escalate_to_reserve(
+                company,
+                pending_bids[0]["prefix"],
+                pending_bids,
+                certificates_dict,
+                path_to_xml,
+                move_cz_path,
+            )
+        with wait_section("sleep"):
+            sleep(SEND_POLL_SECONDS)
+
+
+def process_cz_type(
+    cz_type: str,
+    check_db_connection: bool,
+    gtp_company_dataframe: Union[pd.DataFrame, None],
+    certificates_dict: Dict[str, Dict],
+    mode: str,
+    e_mail: str,
+    e_mail_config: Dict[str, str],
+    path_to_xml: str,
+    move_cz_path: str,
+    target_date: str,
+    companies: Union[Tuple[str, ...], None] = None,
+) -> Tuple[pd.DataFrame, List[Dict[str, Any]]]:
+    """
+    Функция обработки одного направления ("generation" или "consumption"):
+    загрузка прогноза на target_date, создание xml, ini и bat файлов
+    и запуск отправки. Если задан companies, то прогноз загружается
+    и заявки подаются только по этим компаниям (задание очереди).
+    Выполняется в отдельном потоке, возвращает датафрейм прогноза для общей сверки с мониторингом и список
+    отправляемых заявок для архива.
+    """
+    sent_bids = []
+    company_xml_files = {}
+    pythoncom.CoInitialize()
+    try:
+        reload_company_registry()
         if cz_type == "generation":
-            GTP_TYPE = "GVIE"
-            DIRECTION = "ask"
-            PREFIX_CZ_FILE = "ASP"
-            FORECAST_SOURCE_DICT = FORECAST_SOURCE_DICT_GEN
+            gtp_type = "GVIE"
+            direction = "ask"
+            prefix_cz_file = "ASP"
+            forecast_source_dict = FORECAST_SOURCE_DICT_GEN
         if cz_type == "consumption":
-            GTP_TYPE = "PVIE"
-            DIRECTION = "bid"
-            PREFIX_CZ_FILE = "BSP"
-            FORECAST_SOURCE_DICT = FORECAST_SOURCE_DICT_CONS
-
-        CREATE_CZ_PATH = cz_path_settings.create_cz_path[0]
-        MOVE_CZ_PATH = cz_path_settings.move_cz_path[0]
-        PATH_TO_XML = f"{CREATE_CZ_PATH}{TARGET_DATE[0:4]}\{TARGET_DATE[4:6]}"
-
-        if check_db_connection is not False:
-            FORECAST_DATAFRAME = load_forecast_from_db(
-                "treid_03.weather_foreca",
-                ["gtp", "dt", "load_time", "value"],
-                1,
-                FORECAST_SOURCE_DICT,
-                GTP_TYPE,
+            gtp_type = "PVIE"
+            direction = "bid"
+            prefix_cz_file = "BSP"
+            forecast_source_dict = FORECAST_SOURCE_DICT_CONS
+        # метка потока направления в профиле
+        set_thread_tag(direction)
+        # папка xml создается один раз на направление (задание очереди)
+        ensure_directory(path_to_xml)
+
+        forecast_file = forecast_snapshot_path(gtp_type, target_date, companies)
+        streamed = False
+        if journal_stage_time(direction, "forecast_loaded") and os.path.exists(
+            forecast_file
+        ):
+            # прогноз уже загружен в прошлом запуске, берем его снимок
+            logging.info(
+                f"create_xml: Прогноз {gtp_type} уже загружен по журналу, "
+                "берется снимок."
             )
+            forecast_dataframe = load_forecast_from_file(
+                gtp_type, target_date, companies
+            )
+        elif check_db_connection is not False and STREAM_MODE:
+            try:
+                forecast_dataframe, company_xml_files = stream_forecast_to_xml(
+                    direction,
+                    gtp_type,
+                    forecast_source_dict,
+                    gtp_company_dataframe,
+                    certificates_dict,
+                    e_mail,
+                    path_to_xml,
+                    target_date,
+                    companies,
+                )
+                streamed = True
+            except ConnectionError:
+                # база пропала после проверки, берем снимок прогноза
+                forecast_dataframe = load_forecast_from_file(
+                    gtp_type, target_date, companies
+                )
+        elif check_db_connection is not False:
+            try:
+                forecast_dataframe = load_forecast_from_db(
+                    "treid_03.weather_foreca",
+                    ["gtp", "dt", "load_time", "value"],
+                    1,
+                    forecast_source_dict,
+                    gtp_type,
+                    target_date,
+                    gtp_company_dataframe,
+                    companies,
+                )
+            except ConnectionError:
+                forecast_dataframe = load_forecast_from_file(
+                    gtp_type, target_date, companies
+                )
         else:
-            FORECAST_DATAFRAME = load_forecast_from_file()
-        print(FORECAST_DATAFRAME)
-        # создаем список уникальных компаний из датафрейма
-        # чтобы каждый раз потом не перебирать датафрейм
-        LIST_OF_COMPANIES = FORECAST_DATAFRAME.company.unique().tolist()
-        # создание пустого словаря под сертификаты
-        CERTIFICATES_DICT = {}
-        for COMPANY in LIST_OF_COMPANIES:
-            # берем серийный номер сертификата для компании
-            X509ID = str(globals()[f"{COMPANY.lower()}_settings"].x509id[0])
-            # находим сертификат в хранилище
-            CERTIFICATE_ITEM = select_certificate(X509ID)
-            # получаем инфо о владельце сертификата из хранилища
-            CERTIFICATE = CERTIFICATE_ITEM.GetInfo(0)
-            # получаем отпечаток сертификата
-            THUMBPRINT_CERT = CERTIFICATE_ITEM.Thumbprint
-            # создаем словарь с сертификатами, чтобы при проверке
-            # отчетов с атс второй раз не искать сертификаты
-            CERTIFICATES_DICT.setdefault(
-                COMPANY,
-                {
-                    "CERTIFICATE": CERTIFICATE,
-                    "THUMBPRINT_CERT": THUMBPRINT_CERT,
-                },
+            forecast_dataframe = load_forecast_from_file(
+                gtp_type, target_date, companies
             )
-        print(CERTIFICATES_DICT)
+        journal_mark_stage(direction, "forecast_loaded")
+        print(forecast_dataframe)
+        # суточные объемы гтп для порядка отправки
+        gtp_volumes = (
+            forecast_dataframe.groupby("gtp", observed=True)["value"]
+            .sum()
+            .astype("float64")
+            .to_dict()
+        )
 
-        for COMPANY in LIST_OF_COMPANIES:
-            company_dataframe = pd.DataFrame(
-                FORECAST_DATAFRAME.loc[FORECAST_DATAFRAME.company == COMPANY]
+        for company, company_dataframe in forecast_dataframe.groupby(
+            "company", observed=True
+        ):
+            if streamed:
+                break
+            if companies is not None and company not in companies:
+                continue
+            if journal_stage_time(direction, company, "sent"):
+                logging.info(
+                    f"create_xml: Ценовые заявки {company} ({direction}) "
+                    "уже отправлены по журналу."
+                )
+                continue
+            company_settings = company_ready_settings(company, certificates_dict)
+            if company_settings is None:
+                continue
+            # если xml созданы в прошлом запуске, то заново не создаются,
+            # а отправляются только те, что bat файл еще не перенес
+            xml_written = journal_stage_time(direction, company, "xml_written")
+            if xml_written:
+                logging.info(
+                    f"create_xml: xml {company} ({direction}) уже созданы "
+                    "по журналу, отправляются оставшиеся в папке."
+                )
+            xml_files = {}
+            for gtp_code, gtp_dataframe in company_dataframe.groupby(
+                "gtp", observed=True
+            ):
+                if xml_written:
+                    filename = xml_file_name(direction, company, gtp_code, target_date)
+                    if os.path.exists(os.path.join(path_to_xml, filename)):
+                        xml_files[gtp_code] = filename
+                    continue
+                xml_files[gtp_code] = write_gtp_xml(
+                    direction,
+                    company,
+                    company_settings,
+                    gtp_code,
+                    gtp_dataframe,
+                    e_mail,
+                    path_to_xml,
+                    target_date,
+                )
+            company_xml_files[company] = xml_files
+
+        for company, xml_files in company_xml_files.items():
+            sent_bids.extend(
+                send_company_xml(
+                    company,
+                    xml_files,
+                    gtp_volumes,
+                    direction,
+                    prefix_cz_file,
+                    certificates_dict,
+                    mode,
+                    e_mail_config,
+                    path_to_xml,
+                    move_cz_path,
+                    target_date,
+                )
             )
-            GTP_LIST = company_dataframe.gtp.unique()
+    finally:
+        pythoncom.CoUninitialize()
+    return forecast_dataframe, sent_bids
 
-            WORK_PATH = f"{pathlib.Path(__file__).parent.absolute()}/CZ/{COMPANY}/"
-            BAT_FILE_NAME = f"!Отправить_ценовые_заявки_{COMPANY}!.bat"
 
-            LOGIN = str(globals()[f"{COMPANY.lower()}_settings"].login[0])
-            PASSWORD = str(globals()[f"{COMPANY.lower()}_settings"].password[0])
-            SENDER = str(globals()[f"{COMPANY.lower()}_settings"].sender[0])
-            REPRESENTATOR = str(globals()[f"{COMPANY.lower()}_settings"].sender[0])
+def select_email_route() -> Tuple[str, str, Dict[str, str]]:
+    """
+    Функция выбора почты: основная, если ее smtp сервер доступен,
+    иначе резервная. Возвращает режим, адрес и конфиг почты.
+    """
+    if check_smtp(basic_email_settings.config[0]):
+        return (
+            "basic",
+            str(basic_email_settings.e_mail[0]),
+            basic_email_settings.config[0],
+        )
+    return (
+        "reserve",
+        str(reserve_email_settings.e_mail[0]),
+        reserve_email_settings.config[0],
+    )
 
-            for GTP_CODE in company_dataframe.gtp.value_counts().index:
-                gtp_dataframe = pd.DataFrame(
-                    company_dataframe.loc[company_dataframe.gtp == GTP_CODE]
-                )
-                TG_VALUES = dict(zip(gtp_dataframe.hour, gtp_dataframe.value))
-
-                create_xml(
-                    CLASS_TYPE,
-                    VERSION,
-                    DIRECTION,
-                    MODIFICATION_CONSENT,
-                    INTEGRAL_TYPE,
-                    TARGET_DATE,
-                    SENDER,
-                    REPRESENTATOR,
-                    PHONE,
-                    E_MAIL,
-                    COMPANY,
-                    GTP_CODE,
-                    BILATERAL_VOLUME,
-                    RD_PRIORITY_VOLUME,
-                    INTERVAL_NUMBER,
-                    TG_VALUES,
-                    PRICE,
-                    PATH_TO_XML,
-                )
 
-            # добавляем отпечаток в конфиг для ini файла
-            E_MAIL_CONFIG["CertSign"] = str(
-                CERTIFICATES_DICT[COMPANY]["THUMBPRINT_CERT"]
-            ).lower()
-            create_config_and_bat(
-                COMPANY,
-                WORK_PATH,
-                BAT_FILE_NAME,
-                E_MAIL_CONFIG,
-                TARGET_DATE,
-                PREFIX_CZ_FILE,
-                MOVE_CZ_PATH,
-                GTP_LIST,
-                MODE,
-                PATH_TO_XML,
+def bid_paths(target_date: str) -> Tuple[str, str]:
+    """
+    Функция получения папки создания ценовых заявок на target_date
+    и папки отправленных заявок.
+    """
+    create_cz_path = cz_path_settings.create_cz_path[0]
+    move_cz_path = cz_path_settings.move_cz_path[0]
+    path_to_xml = f"{create_cz_path}{target_date[0:4]}{os.sep}{target_date[4:6]}"
+    return path_to_xml, move_cz_path
+
+
+def verify_company_monitoring(
+    company: str,
+    company_dataframe: pd.DataFrame,
+    certificates_dict: Dict[str, Dict],
+    target_date: str,
+) -> Union[pd.DataFrame, None]:
+    """
+    Функция получения отчета мониторинга компании на target_date с атс
+    и сверки с прогнозными объемами. Возвращает отчет со сверкой или None,
+    если авторизоваться на атс не удалось.
+    """
+    target_date_for_ats = datetime.datetime.strptime(target_date, "%Y%m%d").strftime(
+        "%d.%m.%Y"
+    )
+    # создание нового экземпляра WinHTTP.WinHTTPRequest.5.1
+    xmlhttp = win32com.client.Dispatch("WinHTTP.WinHTTPRequest.5.1")
+    # получаем инфо о владельце сертификата из словаря
+    certificate = certificates_dict[company]["CERTIFICATE"]
+    # по авторизованному cookie из кэша сессий отчет запрашиваем
+    # без сертификата клиента (без рукопожатия tls с сертификатом)
+    report_temp = None
+    cookie = ats_cached_cookie(company)
+    if cookie is not None:
+        report_temp = get_monitoring_report(
+            company, target_date_for_ats, xmlhttp, cookie
+        )
+    if report_temp is None:
+        # сессии нет, она истекла на стороне атс или соединение оборвано,
+        # авторизуемся по сертификату и запрашиваем отчет с ним
+        cookie = ats_session_cookie(company, certificate, xmlhttp)
+        report_temp = get_monitoring_report(
+            company, target_date_for_ats, xmlhttp, cookie, certificate
+        )
+    if report_temp is None:
+        telegram(1, f"create_xml: Не удалось авторизоваться на атс {company}.")
+        logging.error(f"create_xml: Не удалось авторизоваться на атс {company}.")
+        return None
+    # и сверяем его с нашими прогнозными объемами
+    return compare_day_volumes(
+        report_temp, company_dataframe, company, target_date_for_ats
+    )
+
+
+def resubmit_company_bids(
+    company: str,
+    failed_bids: Dict[str, str],
+    forecast_by_direction: Dict[str, pd.DataFrame],
+    certificates_dict: Dict[str, Dict],
+    mode: str,
+    e_mail: str,
+    e_mail_config: Dict[str, str],
+    path_to_xml: str,
+    move_cz_path: str,
+    target_date: str,
+) -> List[Dict[str, Any]]:
+    """
+    Функция повторного создания и отправки заявок компании только
+    по ГТП из failed_bids. Направление ГТП берется по прогнозу
+    направления, в котором она есть. Возвращает отправляемые заявки.
+    """
+    company_settings = company_ready_settings(company, certificates_dict)
+    if company_settings is None:
+        return []
+    sent_bids = []
+    for direction, forecast_dataframe in forecast_by_direction.items():
+        prefix_cz_file = "ASP" if direction == "ask" else "BSP"
+        gtp_dataframe_all = forecast_dataframe[
+            (forecast_dataframe["company"] == company)
+            & forecast_dataframe["gtp"].isin(list(failed_bids))
+        ]
+        xml_files = {}
+        gtp_volumes = {}
+        for gtp_code, gtp_dataframe in gtp_dataframe_all.groupby("gtp", observed=True):
+            xml_files[gtp_code] = write_gtp_xml(
+                direction,
+                company,
+                company_settings,
+                gtp_code,
+                gtp_dataframe,
+                e_mail,
+                path_to_xml,
+                target_date,
+            )
+            gtp_volumes[gtp_code] = float(gtp_dataframe["value"].sum())
+        if not xml_files:
+            continue
+        sent_bids.extend(
+            send_company_xml(
+                company,
+                xml_files,
+                gtp_volumes,
+                direction,
+                prefix_cz_file,
+                certificates_dict,
+                mode,
+                e_mail_config,
+                path_to_xml,
+                move_cz_path,
+                target_date,
+                fresh_claim=True,
             )
+        )
+    return sent_bids
 
-            send_xml_cz_bat(WORK_PATH, BAT_FILE_NAME, COMPANY)
 
-        # проверка на наличие файлов в папке с ценовыми заявками
-        # необходима чтобы batники не закрывались пока не отправятся все ценовые
-        # иначе python запускает функцию и идет дальше и скрипт полностью
-        # завершается ещё до полной отправки.
-        while dir_not_empty(PATH_TO_XML):
-            sleep(5)
-        telegram(1, f"create_xml: Ценовые заявки отправлены.")
-        logging.info(f"create_xml: Ценовые заявки отправлены.")
+def exclude_invalid_bids(
+    company: str, failed_bids: Dict[str, str], directions: Tuple[str, ...]
+) -> Dict[str, str]:
+    """
+    Функция исключения из повторной подачи ГТП, xml которых в этом
+    запуске не прошли проверку и перенесены в *_invalid:
+    созданный заново xml не пройдет проверку так же.
+    """
+    invalid_bids = sorted(
+        gtp_code
+        for gtp_code in failed_bids
+        if any(
+            journal_stage_time(direction, company, gtp_code, "invalid")
+            for direction in directions
+        )
+    )
+    if invalid_bids:
+        logging.warning(
+            f"create_xml: {company} {', '.join(invalid_bids)} повторно не подаются, "
+            "xml не прошли проверку."
+        )
+    return {
+        gtp_code: reason
+        for gtp_code, reason in failed_bids.items()
+        if gtp_code not in invalid_bids
+    }
 
-    # ждем 5 минут после отправки ценовых
-    # чтобы они успели приняться и появиться в мониторинге на сайте атс
-    sleep(TIMEOUT_BEFORE_CHECK_CZ)
-    for COMPANY in LIST_OF_COMPANIES:
-        # создание нового экземпляра WinHTTP.WinHTTPRequest.5.1
-        XMLHTTP = win32com.client.Dispatch("WinHTTP.WinHTTPRequest.5.1")
-        COMPANY_DATAFRAME = pd.DataFrame(
-            FORECAST_DATAFRAME.loc[FORECAST_DATAFRAME.company == COMPANY]
+
+def check_company_bids(
+    monitoring_report: pd.DataFrame,
+    company_dataframe: pd.DataFrame,
+    directions: Tuple[str, ...],
+) -> Tuple[Dict[str, str], List[str]]:
+    """
+    Функция разбора мониторинга компании: ГТП для повторной подачи
+    (кроме не прошедших проверку в этом запуске) и ГТП, объем которых
+    атс еще не рассчитал.
+    """
+    company = monitoring_report.attrs["company"]
+    failed_bids = exclude_invalid_bids(
+        company,
+        failed_monitoring_bids(monitoring_report, company_dataframe),
+        directions,
+    )
+    pending_bids = pending_monitoring_bids(monitoring_report, company_dataframe)
+    return failed_bids, pending_bids
+
+
+def resubmit_failed_bids(
+    monitoring_reports: List[pd.DataFrame],
+    forecast_dataframe: pd.DataFrame,
+    certificates_dict: Dict[str, Dict],
+    mode: str,
+    e_mail: str,
+    e_mail_config: Dict[str, str],
+    path_to_xml: str,
+    move_cz_path: str,
+    target_date: str,
+    directions: Union[Tuple[str, ...], None] = None,
+    companies: Union[Tuple[str, ...], None] = None,
+) -> Tuple[Dict[str, Dict[str, str]], Dict[str, List[str]]]:
+    """
+    Функция повторной подачи заявок по результатам мониторинга:
+    ГТП без заявки, с отклоненной заявкой или с другим объемом
+    (кроме не прошедших проверку в этом запуске)
+    создаются и отправляются заново, затем мониторинг компании
+    проверяется снова. Мониторинг компаний, объем заявок которых атс
+    еще не рассчитал, проверяется снова без повторной подачи.
+    Не более RESUBMIT_ATTEMPTS попыток и только до закрытия приема
+    заявок. directions - направления, по которым можно подавать,
+    companies - компании задания очереди, прогноз которых в снимке
+    задания. Прогноз по часам читается из снимков только
+    при необходимости.
+    Возвращает оставшиеся ошибки {компания: {код гтп: причина}}
+    и непроверенные заявки {компания: [коды гтп]}.
+    """
+    directions = directions or tuple(DIRECTIONS[cz_type] for cz_type in CZ_TYPES)
+    failed_companies = {}
+    pending_companies = {}
+    for monitoring_report in monitoring_reports:
+        company = monitoring_report.attrs["company"]
+        failed_bids, pending_bids = check_company_bids(
+            monitoring_report,
+            forecast_dataframe[forecast_dataframe["company"] == company],
+            directions,
         )
-        # получаем инфо о владельце сертификата из словаря
-        CERTIFICATE = CERTIFICATES_DICT[COMPANY]["CERTIFICATE"]
-        # получаем первичное cookie при заходе на сайт атс
-        COOKIE, XMLHTTP = ats_get_cookie(XMLHTTP)
-        # авторизуемся по сертификату на сайте атс
-        XMLHTTP = ats_authorization(CERTIFICATE, COOKIE, XMLHTTP)
-        # получаем отчет из мониторинга ценовых заявок с сайта атс
-        REPORT_TEMP = get_monitoring_report(
-            COMPANY, TARGET_DATE_FOR_ATS, XMLHTTP, COOKIE
+        if failed_bids:
+            failed_companies[company] = failed_bids
+        if pending_bids:
+            pending_companies[company] = pending_bids
+    if not failed_companies and not pending_companies:
+        return {}, {}
+
+    gtp_types = {"ask": "GVIE", "bid": "PVIE"}
+    forecast_by_direction = {}
+    for direction in directions if failed_companies else ():
+        try:
+            forecast_by_direction[direction] = load_forecast_from_file(
+                gtp_types[direction], target_date, companies
+            )
+        except OSError as err:
+            logging.error(
+                f"create_xml: Нет снимка прогноза {gtp_types[direction]} - {err}"
+            )
+    for attempt in range(1, RESUBMIT_ATTEMPTS + 1):
+        check_job_lease()
+        if datetime.datetime.now() >= gate_closure_deadline(target_date):
+            telegram(
+                1,
+                "create_xml: Прием заявок закрыт, повторная подача не выполняется.",
+            )
+            logging.warning(
+                "create_xml: Прием заявок закрыт, повторная подача не выполняется."
+            )
+            break
+        sent_bids = []
+        for company, failed_bids in failed_companies.items():
+            reasons = ", ".join(
+                f"{gtp_code} ({reason})" for gtp_code, reason in failed_bids.items()
+            )
+            telegram(
+                1,
+                f"create_xml: Повторная подача {company}, попытка {attempt}: {reasons}",
+            )
+            logging.warning(
+                f"create_xml: Повторная подача {company}, попытка {attempt}: {reasons}"
+            )
+            sent_bids.extend(
+                resubmit_company_bids(
+                    company,
+                    failed_bids,
+                    forecast_by_direction,
+                    certificates_dict,
+                    mode,
+                    e_mail,
+                    e_mail_config,
+                    path_to_xml,
+                    move_cz_path,
+                    target_date,
+                )
+            )
+        if not sent_bids and not pending_companies:
+            break
+        if sent_bids:
+            wait_for_sending(
+                path_to_xml,
+                sent_bids,
+                mode,
+                certificates_dict,
+                move_cz_path,
+                target_date,
+                wait_all_files=False,
+            )
+            try:
+                archive_sent_bids(ARCHIVE_PATH, target_date, sent_bids)
+            except Exception as err:
+                logging.error(f"create_xml: Ошибка записи в архив заявок - {err}")
+        with wait_section("sleep"):
+            sleep(RESUBMIT_CHECK_SECONDS)
+
+        # проверяем снова только компании с повторной подачей
+        # и с нерассчитанным объемом
+        check_time = datetime.datetime.now().isoformat(timespec="seconds")
+        monitoring_reports = []
+        for company in {bid["company"] for bid in sent_bids} | set(pending_companies):
+            monitoring_report = verify_company_monitoring(
+                company,
+                forecast_dataframe[forecast_dataframe["company"] == company],
+                certificates_dict,
+                target_date,
+            )
+            if monitoring_report is None:
+                continue
+            monitoring_reports.append(monitoring_report)
+            failed_bids, pending_bids = check_company_bids(
+                monitoring_report,
+                forecast_dataframe[forecast_dataframe["company"] == company],
+                directions,
+            )
+            if failed_bids:
+                failed_companies[company] = failed_bids
+            else:
+                failed_companies.pop(company, None)
+            if pending_bids:
+                pending_companies[company] = pending_bids
+            else:
+                pending_companies.pop(company, None)
+        try:
+            report_monitoring_changes(monitoring_reports, target_date, check_time)
+        except Exception as err:
+            logging.error(f"create_xml: Ошибка записи истории мониторинга - {err}")
+        if not failed_companies and not pending_companies:
+            telegram(1, "create_xml: Повторно проверенные заявки приняты.")
+            logging.info("create_xml: Повторно проверенные заявки приняты.")
+            return {}, {}
+
+    for company, failed_bids in failed_companies.items():
+        reasons = ", ".join(
+            f"{gtp_code} ({reason})" for gtp_code, reason in failed_bids.items()
         )
-        # и сверяем его с нашими прогнозными объемами
-        compare_day_volumes(
-            REPORT_TEMP, COMPANY_DATAFRAME, COMPANY, TARGET_DATE_FOR_ATS
+        telegram(1, f"create_xml: Заявки {company} не приняты: {reasons}")
+        logging.error(f"create_xml: Заявки {company} не приняты: {reasons}")
+    for company, pending_bids in pending_companies.items():
+        telegram(
+            1,
+            f"create_xml: Объем заявок {company} атс еще не рассчитан: "
+            f"{', '.join(pending_bids)}, проверить позже.",
         )
+        logging.warning(
+            f"create_xml: Объем заявок {company} атс еще не рассчитан: "
+            f"{', '.join(pending_bids)}, проверить позже."
+        )
+    return failed_companies, pending_companies
+
+
+def main() -> None:
+    """
+    Основной сценарий: выбор почты, загрузка прогноза, создание
+    и отправка ценовых заявок по всем направлениям и сверка
+    с мониторингом атс.
+    """
+    # Замер времени выполнения начало
+    start_time = datetime.datetime.now()
+    print(start_time)
+    if MEMORY_REPORT:
+        tracemalloc.start()
+    set_thread_tag("main")
+    open_run_journal(JOURNAL_PATH, TARGET_DATE)
+    open_ats_sessions(JOURNAL_PATH)
+    reload_company_registry()
 
+    # internet_is_on = check_internet(GOOGLE_HOST, GOOGLE_OPENPORT, GOOGLE_TIMEOUT)
+    mode, e_mail, e_mail_config = select_email_route()
+    check_db_connection = check_connection(1)
+    path_to_xml, move_cz_path = bid_paths(TARGET_DATE)
+
+    # общие для всех направлений ресурсы: соответствие ГТП и компаний
+    # и словарь сертификатов (хранилище просматривается один раз)
+    gtp_company_dataframe = None
+    if check_db_connection is not False:
+        gtp_company_dataframe = try_load_gtp_company_mapping()
+        if gtp_company_dataframe is None:
+            # прогноз из базы не сопоставить с компаниями
+            check_db_connection = False
+    if gtp_company_dataframe is not None:
+        list_of_all_companies = gtp_company_dataframe.company.unique().tolist()
+    else:
+        list_of_all_companies = list(COMPANY_REGISTRY["companies"])
+    certificates_dict = create_certificates_dict(list_of_all_companies)
+    print(certificates_dict)
+
+    # генерация и потребление обрабатываются одновременно
+    with ThreadPoolExecutor(
+        max_workers=len(CZ_TYPES), thread_name_prefix="cz_type"
+    ) as executor:
+        futures = [
+            executor.submit(
+                process_cz_type,
+                cz_type,
+                check_db_connection,
+                gtp_company_dataframe,
+                certificates_dict,
+                mode,
+                e_mail,
+                e_mail_config,
+                path_to_xml,
+                move_cz_path,
+                TARGET_DATE,
+            )
+            for cz_type in CZ_TYPES
+        ]
+        results = [future.result() for future in futures]
+    # для сверки с мониторингом нужны только гтп, компания и объем
+    forecast_dataframe = compact_forecast_dataframe(
+        pd.concat(
+            [result[0][["gtp", "company", "value"]] for result in results],
+            ignore_index=True,
+        )
+    )
+    sent_bids = [bid for result in results for bid in result[1]]
+    memory_report("прогноз всех направлений", forecast_dataframe)
+
+    # проверка на наличие файлов в папке с ценовыми заявками
+    # необходима чтобы batники не закрывались пока не отправятся все ценовые
+    # иначе python запускает функцию и идет дальше и скрипт полностью
+    # завершается ещё до полной отправки.
+    wait_for_sending(
+        path_to_xml, sent_bids, mode, certificates_dict, move_cz_path, TARGET_DATE
+    )
+    telegram(1, f"create_xml: Ценовые заявки отправлены.")
+    logging.info(f"create_xml: Ценовые заявки отправлены.")
+    for direction, company in {(bid["direction"], bid["company"]) for bid in sent_bids}:
+        # компании с незаписанными xml отправляются заново при продолжении
+        if journal_stage_time(direction, company, "xml_written"):
+            journal_mark_stage(direction, company, "sent")
+    # сохраняем отправленные заявки в архив (сжатые суточные сегменты
+    # с индексом), ошибка архива не должна мешать проверке мониторинга
+    try:
+        archive_sent_bids(ARCHIVE_PATH, TARGET_DATE, sent_bids)
+    except Exception as err:
+        logging.error(f"create_xml: Ошибка записи в архив заявок - {err}")
+
+    # ждем 5 минут после отправки ценовых
+    # чтобы они успели приняться и появиться в мониторинге на сайте атс,
+    # при продолжении по журналу ждем только оставшееся время
+    sent_times = [
+        datetime.datetime.fromisoformat(stage_time)
+        for key, stage_time in RUN_JOURNAL["stages"].items()
+        if key.endswith("/sent")
+    ]
+    timeout = TIMEOUT_BEFORE_CHECK_CZ
+    if sent_times:
+        timeout = max(
+            0,
+            TIMEOUT_BEFORE_CHECK_CZ
+            - (datetime.datetime.now() - max(sent_times)).total_seconds(),
+        )
+    with wait_section("sleep"):
+        sleep(timeout)
+    # в мониторинге сразу и генерация, и потребление, поэтому сверка
+    # одна на компанию по объединенному прогнозу всех направлений
+    reload_company_registry()
+    check_time = datetime.datetime.now().isoformat(timespec="seconds")
+    monitoring_reports = []
+    for company, company_dataframe in forecast_dataframe.groupby(
+        "company", observed=True
+    ):
+        if journal_stage_time(company, "verified"):
+            logging.info(f"create_xml: Мониторинг {company} уже проверен по журналу.")
+            continue
+        monitoring_report = verify_company_monitoring(
+            company, company_dataframe, certificates_dict, TARGET_DATE
+        )
+        if monitoring_report is None:
+            continue
+        monitoring_reports.append(monitoring_report)
+    try:
+        report_monitoring_changes(monitoring_reports, TARGET_DATE, check_time)
+    except Exception as err:
+        logging.error(f"create_xml: Ошибка записи истории мониторинга - {err}")
+    # непринятые заявки подаем повторно только по проблемным гтп
+    _, pending_companies = resubmit_failed_bids(
+        monitoring_reports,
+        forecast_dataframe,
+        certificates_dict,
+        mode,
+        e_mail,
+        e_mail_config,
+        path_to_xml,
+        move_cz_path,
+        TARGET_DATE,
+    )
+    # компания проверена, только когда закончена и повторная подача
+    # и атс рассчитал объем всех заявок, иначе продолжение по журналу
+    # ее пропустит
+    for monitoring_report in monitoring_reports:
+        if monitoring_report.attrs["company"] not in pending_companies:
+            journal_mark_stage(monitoring_report.attrs["company"], "verified")
+
+    memory_report("конец работы")
     # Замер времени выполнения конец
     end_time = datetime.datetime.now()
     delta = end_time - start_time
     print(end_time)
     print(delta)
 
+
+def enqueue_run_jobs() -> int:
+    """
+    Функция координатора: постановка в очередь заданий
+    (компания, направление, TARGET_DATE) по всем компаниям
+    из соответствия ГТП и реестра. Возвращает количество новых заданий.
+    """
+    reload_company_registry()
+    gtp_company_dataframe = (
+        try_load_gtp_company_mapping() if check_connection(1) else None
+    )
+    if gtp_company_dataframe is not None:
+        companies = gtp_company_dataframe.company.dropna().unique().tolist()
+    else:
+        companies = list(COMPANY_REGISTRY["companies"])
+    jobs = [
+        (str(company), DIRECTIONS[cz_type], TARGET_DATE)
+        for cz_type in CZ_TYPES
+        for company in companies
+        if str(company).upper() in COMPANY_REGISTRY["companies"]
+    ]
+    added = enqueue_jobs(QUEUE_PATH, jobs)
+    telegram(1, f"create_xml: В очередь поставлено заданий: {added}.")
+    logging.info(f"create_xml: В очередь поставлено заданий: {added}.")
+    return added
+
+
+def reset_job_journal() -> None:
+    """
+    Функция сброса журнала запуска перед этапом задания очереди:
+    состояние заданий хранит очередь, поэтому журнал только
+    в памяти и каждый этап начинается с чистого журнала.
+    """
+    with RUN_JOURNAL_LOCK:
+        RUN_JOURNAL["file"] = None
+        RUN_JOURNAL["stages"] = {}
+        RUN_JOURNAL["claims"] = {}
+
+
+def check_job_lease() -> None:
+    """
+    Функция прерывания задания очереди, аренда которого потеряна:
+    задание уже может выполнять другой обработчик.
+    Вне обработчика очереди ничего не делает.
+    """
+    if JOB_LEASE_LOST.is_set():
+        raise LeaseLost("аренда задания потеряна")
+
+
+def run_company_job(job: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Функция этапа отправки задания очереди: создание и отправка
+    заявок одной компании по одному направлению. Ошибка выполнения
+    передается в очередь для повтора. Дата задания передается
+    в функции явно, прогноз загружается только по гтп компании.
+    Возвращает результат этапа.
+    """
+    target_date = job["target_date"]
+    company = job["company"]
+    cz_type = {direction: cz_type for cz_type, direction in DIRECTIONS.items()}[
+        job["direction"]
+    ]
+    reset_job_journal()
+    # папка меток задания одна на все попытки: при повторе после
+    # падения обработчика bat файлы прошлой попытки могут еще работать
+    with RUN_JOURNAL_LOCK:
+        RUN_JOURNAL["claims"][f"{job['direction']}/{company}"] = f"job_{job['job_id']}"
+    reload_company_registry()
+    mode, e_mail, e_mail_config = select_email_route()
+    check_db_connection = check_connection(1)
+    path_to_xml, move_cz_path = bid_paths(target_date)
+    certificates_dict = create_certificates_dict([company])
+    if company not in certificates_dict:
+        raise ValueError(f"нет сертификата или настроек компании {company}")
+    gtp_company_dataframe = None
+    if check_db_connection is not False:
+        gtp_company_dataframe = try_load_gtp_company_mapping()
+        if gtp_company_dataframe is None:
+            check_db_connection = False
+    _, sent_bids = process_cz_type(
+        cz_type,
+        check_db_connection,
+        gtp_company_dataframe,
+        certificates_dict,
+        mode,
+        e_mail,
+        e_mail_config,
+        path_to_xml,
+        move_cz_path,
+        target_date,
+        (company,),
+    )
+    wait_for_sending(
+        path_to_xml,
+        sent_bids,
+        mode,
+        certificates_dict,
+        move_cz_path,
+        target_date,
+        wait_all_files=False,
+    )
+    try:
+        archive_sent_bids(ARCHIVE_PATH, target_date, sent_bids)
+    except Exception as err:
+        logging.error(f"create_xml: Ошибка записи в архив заявок - {err}")
+    # гтп с некорректными xml передаются этапу проверки через результат,
+    # т.к. журнал этапа только в памяти
+    with RUN_JOURNAL_LOCK:
+        invalid_gtps = [
+            key.split("/")[-2]
+            for key in RUN_JOURNAL["stages"]
+            if key.endswith("/invalid")
+        ]
+    return {"sent": len(sent_bids), "invalid": invalid_gtps}
+
+
+def verify_company_job(job: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Функция этапа проверки задания очереди: сверка заявок компании
+    с мониторингом атс и повторная подача непринятых по направлению
+    задания. Прогноз компании берется из снимка этапа отправки.
+    Возвращает результат задания вместе с результатом отправки.
+    """
+    target_date = job["target_date"]
+    company = job["company"]
+    gtp_type = {"ask": "GVIE", "bid": "PVIE"}[job["direction"]]
+    send_result = json.loads(job["result"] or "{}")
+    reset_job_journal()
+    for gtp_code in send_result.get("invalid", []):
+        journal_mark_stage(job["direction"], company, gtp_code, "invalid")
+    reload_company_registry()
+    mode, e_mail, e_mail_config = select_email_route()
+    path_to_xml, move_cz_path = bid_paths(target_date)
+    certificates_dict = create_certificates_dict([company])
+    if company not in certificates_dict:
+        raise ValueError(f"нет сертификата или настроек компании {company}")
+    company_forecast = compact_forecast_dataframe(
+        load_forecast_from_file(gtp_type, target_date, (company,))[
+            ["gtp", "company", "value"]
+        ]
+    )
+    check_time = datetime.datetime.now().isoformat(timespec="seconds")
+    monitoring_report = verify_company_monitoring(
+        company, company_forecast, certificates_dict, target_date
+    )
+    changes = report_monitoring_changes(
+        [] if monitoring_report is None else [monitoring_report],
+        target_date,
+        check_time,
+    )
+    # повторно подаем только гтп направления задания
+    failed_companies, pending_companies = resubmit_failed_bids(
+        [] if monitoring_report is None else [monitoring_report],
+        company_forecast,
+        certificates_dict,
+        mode,
+        e_mail,
+        e_mail_config,
+        path_to_xml,
+        move_cz_path,
+        target_date,
+        (job["direction"],),
+        (company,),
+    )
+    return {
+        **send_result,
+        "verified": monitoring_report is not None,
+        "changes": len(changes),
+        "not_accepted": len(failed_companies.get(company, {})),
+        "pending": len(pending_companies.get(company, [])),
+    }
+
+
+def run_worker(worker_id: str, forever: bool = False) -> None:
+    """
+    Функция обработчика очереди: берет задания в аренду и выполняет
+    их по одному, продлевая аренду в отдельном потоке. Без forever
+    завершается, когда в очереди не осталось незавершенных заданий.
+    """
+    pythoncom.CoInitialize()
+    set_thread_tag(f"worker {worker_id}")
+    open_ats_sessions(JOURNAL_PATH)
+    while True:
+        job = claim_job(QUEUE_PATH, worker_id)
+        if job is None:
+            if not forever and unfinished_jobs(QUEUE_PATH) == 0:
+                break
+            with wait_section("sleep"):
+                sleep(QUEUE_POLL_SECONDS)
+            continue
+        telegram(
+            1,
+            (
+                f"create_xml: {worker_id} взял задание {job['company']} "
+                f"{job['direction']} {job['target_date']} ({job['stage']}), "
+                f"попытка {job['attempts']}."
+            ),
+        )
+        logging.info(
+            f"create_xml: {worker_id} взял задание {job['company']} "
+            f"{job['direction']} {job['target_date']} ({job['stage']}), "
+            f"попытка {job['attempts']}."
+        )
+        # продление аренды, пока задание выполняется, при потере аренды
+        # задание прерывается (check_job_lease) и результат не пишется
+        job_finished = threading.Event()
+        JOB_LEASE_LOST.clear()
+
+        def renew_job_lease() -> None:
+            while not job_finished.wait(LEASE_SECONDS / 3):
+                if not renew_lease(QUEUE_PATH, job["job_id"], worker_id):
+                    JOB_LEASE_LOST.set()
+                    return
+
+        lease_thread = threading.Thread(target=renew_job_lease, daemon=True)
+        lease_thread.start()
+        try:
+            if job["stage"] == "verify":
+                result = verify_company_job(job)
+            else:
+                result = run_company_job(job)
+        except LeaseLost:
+            job_finished.set()
+            telegram(
+                1,
+                f"create_xml: {worker_id} потерял аренду задания {job['company']} "
+                f"{job['direction']}, задание прервано.",
+            )
+            logging.error(
+                f"create_xml: {worker_id} потерял аренду задания {job['company']} "
+                f"{job['direction']}, задание прервано."
+            )
+        except Exception as err:
+            job_finished.set()
+            telegram(
+                1,
+                f"create_xml: Ошибка задания {job['company']} {job['direction']}"
+                f" - {err}",
+            )
+            logging.exception(
+                f"create_xml: Ошибка задания {job['company']} {job['direction']}"
+                f" - {err}"
+            )
+            fail_job(QUEUE_PATH, job, worker_id, str(err))
+        else:
+            job_finished.set()
+            lease_thread.join()
+            if JOB_LEASE_LOST.is_set():
+                # задание уже может выполнять другой обработчик
+                logging.error(
+                    f"create_xml: {worker_id} потерял аренду задания "
+                    f"{job['company']} {job['direction']}, результат не записан."
+                )
+            elif job["stage"] == "send" and result["sent"]:
+                # проверка в мониторинге через TIMEOUT_BEFORE_CHECK_CZ
+                # отдельным этапом, обработчик тем временем свободен
+                defer_job(
+                    QUEUE_PATH,
+                    job,
+                    worker_id,
+                    "verify",
+                    TIMEOUT_BEFORE_CHECK_CZ,
+                    result,
+                )
+            else:
+                complete_job(QUEUE_PATH, job["job_id"], worker_id, result)
+        lease_thread.join()
+    pythoncom.CoUninitialize()
+
+
+def profile_file_path(run_name: str) -> str:
+    """
+    Функция получения пути файла профиля с датой заявок, названием
+    запуска (направления или обработчик очереди) и временем запуска
+    в названии, параллельные запуски пишут профили в разные файлы.
+    """
+    run_name = re.sub(r"[^\w.-]", "_", run_name)
+    return os.path.join(
+        PROFILE_PATH,
+        (
+            f"create_xml_profile_{TARGET_DATE}_{run_name}_"
+            f"{datetime.datetime.now().strftime('%H%M%S')}.folded"
+        ),
+    )
+
+
+def main_profiled() -> None:
+    """
+    Запуск main() под выборочным профилировщиком, профиль в свернутом
+    формате (для flame graph), в названии направления и pid процесса.
+    """
+    profile_file = profile_file_path(
+        "_".join(DIRECTIONS[cz_type] for cz_type in CZ_TYPES) + f"_{os.getpid()}"
+    )
+    with sampling_profile(profile_file):
+        main()
+    telegram(1, f"create_xml: Профиль запуска записан в {profile_file}")
+
+
+def run_worker_profiled(worker_id: str, forever: bool = False) -> None:
+    """
+    Запуск обработчика очереди под выборочным профилировщиком,
+    профиль всех заданий обработчика с его номером в названии.
+    """
+    profile_file = profile_file_path(f"worker_{worker_id}")
+    with sampling_profile(profile_file):
+        run_worker(worker_id, forever)
+    telegram(1, f"create_xml: Профиль обработчика записан в {profile_file}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Создание и отправка ценовых заявок.")
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="записать профиль запуска (то же, что CREATE_XML_PROFILE=1)",
+    )
+    parser.add_argument(
+        "--enqueue",
+        action="store_true",
+        help="поставить задания по компаниям в очередь (координатор)",
+    )
+    parser.add_argument(
+        "--worker",
+        action="store_true",
+        help="выполнять задания из очереди (можно запускать несколько на хосте)",
+    )
+    parser.add_argument(
+        "--forever",
+        action="store_true",
+        help="обработчик не завершается при пустой очереди",
+    )
+    parser.add_argument(
+        "--queue-status", action="store_true", help="вывести задания очереди"
+    )
+    args = parser.parse_args()
+    if args.enqueue:
+        enqueue_run_jobs()
+    if args.worker:
+        if args.profile or PROFILE:
+            run_worker_profiled(f"{socket.gethostname()}:{os.getpid()}", args.forever)
+        else:
+            run_worker(f"{socket.gethostname()}:{os.getpid()}", args.forever)
+    if args.queue_status:
+        print(queue_status(QUEUE_PATH, TARGET_DATE).to_string())
+    if not (args.enqueue or args.worker or args.queue_status):
+        if args.profile or PROFILE:
+            main_profiled()
+        else:
+            main()
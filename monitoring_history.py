@@ -0,0 +1,246 @@
+"""
+История проверок мониторинга ценовых заявок.
+
+Строки отчета мониторинга атс по каждой проверке сохраняются в sqlite
+с ключом (дата, гтп, время проверки). Сравнение с предыдущей проверкой
+выполняется сразу по всем компаниям и возвращает только изменения
+статусов, номера заявки и объемов.
+
+Пример запроса из командной строки:
+    python monitoring_history.py archive 20261020 --company AVSOLTEK
+"""
+
+import argparse
+import os
+import sqlite3
+from typing import Any, List, Tuple, Union
+
+import pandas as pd
+
+HISTORY_FILE_NAME = "monitoring_history.sqlite"
+# отслеживаемые столбцы отчета мониторинга
+TRACKED_COLUMNS = ("cz_status", "gtp_status", "cz_number", "total_volume")
+HISTORY_COLUMNS = (
+    "company",
+    "gtp",
+    "cz_status",
+    "gtp_status",
+    "cz_number",
+    "total_volume",
+    "forecast_volume",
+)
+
+
+def open_history(history_path: str) -> sqlite3.Connection:
+    """
+    Функция открытия истории мониторинга, при первом вызове
+    создает папку и таблицу истории.
+    """
+    os.makedirs(history_path, exist_ok=True)
+    connection = sqlite3.connect(
+        os.path.join(history_path, HISTORY_FILE_NAME),
+        timeout=30,
+        isolation_level=None,
+    )
+    connection.executescript("""
+        CREATE TABLE IF NOT EXISTS checks (
+            operational_date TEXT NOT NULL,
+            company TEXT NOT NULL,
+            gtp TEXT NOT NULL,
+            check_time TEXT NOT NULL,
+            cz_status TEXT,
+            gtp_status TEXT,
+            cz_number TEXT,
+            total_volume REAL,
+            forecast_volume REAL,
+            PRIMARY KEY (operational_date, gtp, check_time)
+        );
+        """)
+    return connection
+
+
+def normalize_report(report: pd.DataFrame) -> pd.DataFrame:
+    """
+    Функция приведения строк отчета мониторинга к типам истории:
+    статусы и номер заявки - строки, объемы - числа с округлением.
+    """
+    report = report.reindex(columns=list(HISTORY_COLUMNS)).copy()
+    for column in ("company", "gtp", "cz_status", "gtp_status", "cz_number"):
+        report[column] = report[column].where(
+            report[column].isna(), report[column].astype(str).str.strip()
+        )
+    # номер заявки из excel может прийти числом с плавающей точкой
+    report["cz_number"] = report["cz_number"].str.replace(r"\.0$", "", regex=True)
+    for column in ("total_volume", "forecast_volume"):
+        report[column] = pd.to_numeric(report[column], errors="coerce").round(3)
+    return report
+
+
+def previous_check(
+    history_path: str, operational_date: str, check_time: str
+) -> pd.DataFrame:
+    """
+    Функция получения последнего состояния каждой гтп
+    до проверки check_time.
+    """
+    connection = open_history(history_path)
+    try:
+        return pd.read_sql(
+            "SELECT * FROM checks WHERE operational_date = ? AND check_time = ("
+            "SELECT MAX(latest.check_time) FROM checks AS latest "
+            "WHERE latest.operational_date = checks.operational_date "
+            "AND latest.gtp = checks.gtp AND latest.check_time < ?)",
+            connection,
+            params=[operational_date, check_time],
+        )
+    finally:
+        connection.close()
+
+
+def record_check(
+    history_path: str,
+    operational_date: str,
+    check_time: str,
+    report: pd.DataFrame,
+) -> int:
+    """
+    Функция сохранения строк отчета мониторинга одной проверки.
+    report - столбцы HISTORY_COLUMNS, повторная запись той же
+    проверки заменяет строки. Возвращает количество строк.
+    """
+    report = normalize_report(report)
+    rows = [
+        (
+            operational_date,
+            row.company,
+            row.gtp,
+            check_time,
+            row.cz_status,
+            row.gtp_status,
+            row.cz_number,
+            row.total_volume,
+            row.forecast_volume,
+        )
+        for row in report.astype(object)
+        .where(report.notna(), None)
+        .itertuples(index=False)
+    ]
+    connection = open_history(history_path)
+    try:
+        connection.execute("BEGIN IMMEDIATE")
+        connection.executemany(
+            "INSERT OR REPLACE INTO checks (operational_date, company, gtp, "
+            "check_time, cz_status, gtp_status, cz_number, total_volume, "
+            "forecast_volume) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+        connection.execute("COMMIT")
+    except Exception:
+        connection.execute("ROLLBACK")
+        raise
+    finally:
+        connection.close()
+    return len(rows)
+
+
+def monitoring_changes(previous: pd.DataFrame, current: pd.DataFrame) -> pd.DataFrame:
+    """
+    Функция сравнения проверки с предыдущей по всем гтп сразу.
+    Возвращает только гтп с изменениями: значения до (столбцы *_previous),
+    после и признаки изменения по каждому отслеживаемому столбцу
+    (*_changed). Гтп без предыдущей проверки считаются новыми (is_new).
+    """
+    current = normalize_report(current)
+    previous = normalize_report(previous)
+    changes = current.merge(
+        previous[["gtp", *TRACKED_COLUMNS]],
+        on="gtp",
+        how="left",
+        suffixes=("", "_previous"),
+        indicator=True,
+    )
+    changes["is_new"] = changes.pop("_merge") == "left_only"
+    changed = changes["is_new"].copy()
+    for column in TRACKED_COLUMNS:
+        after = changes[column]
+        before = changes[f"{column}_previous"]
+        column_changed = ~((after == before) | (after.isna() & before.isna()))
+        changes[f"{column}_changed"] = column_changed & ~changes["is_new"]
+        changed |= changes[f"{column}_changed"]
+    return changes[changed].reset_index(drop=True)
+
+
+def find_checks(
+    history_path: str,
+    operational_date: Union[str, None] = None,
+    company: Union[str, None] = None,
+    gtp: Union[str, None] = None,
+) -> pd.DataFrame:
+    """
+    Функция поиска проверок в истории.
+    Дата в формате ГГГГММДД.
+    """
+    conditions: List[str] = []
+    parameters: List[Any] = []
+    for column, value in (
+        ("operational_date", operational_date),
+        ("company", company),
+        ("gtp", gtp),
+    ):
+        if value is not None:
+            conditions.append(f"{column} = ?")
+            parameters.append(value)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    connection = open_history(history_path)
+    try:
+        return pd.read_sql(
+            f"SELECT * FROM checks {where} ORDER BY check_time, company, gtp",
+            connection,
+            params=parameters,
+        )
+    finally:
+        connection.close()
+
+
+def check_transitions(checks: pd.DataFrame) -> pd.DataFrame:
+    """
+    Функция получения изменений между всеми соседними проверками
+    из истории (для просмотра хода приема заявок за сутки).
+    """
+    transitions: List[pd.DataFrame] = []
+    check_times: Tuple[str, ...] = tuple(sorted(checks["check_time"].unique()))
+    for previous_time, check_time in zip(check_times, check_times[1:]):
+        previous = checks[checks["check_time"] <= previous_time]
+        previous = previous[
+            previous["check_time"]
+            == previous.groupby("gtp")["check_time"].transform("max")
+        ]
+        changes = monitoring_changes(
+            previous, checks[checks["check_time"] == check_time]
+        )
+        changes.insert(0, "check_time", check_time)
+        transitions.append(changes)
+    if not transitions:
+        return pd.DataFrame()
+    return pd.concat(transitions, ignore_index=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Просмотр истории проверок мониторинга ценовых заявок."
+    )
+    parser.add_argument("history_path", help="папка истории")
+    parser.add_argument("operational_date", help="операционные сутки, ГГГГММДД")
+    parser.add_argument("--company", default=None)
+    parser.add_argument("--gtp", default=None)
+    parser.add_argument(
+        "--changes", action="store_true", help="вывести только изменения"
+    )
+    args = parser.parse_args()
+    checks = find_checks(
+        args.history_path, args.operational_date, args.company, args.gtp
+    )
+    if args.changes:
+        print(check_transitions(checks).to_string())
+    else:
+        print(checks.to_string())
@@ -0,0 +1,839 @@
+"""
+Прогон create_xml.py на записанных данных без рабочей сети.
+
+Весь сценарий main() выполняется на Linux с локальными заменами:
+- БД MySQL - sqlite с базами treid_03 и visualcrossing из записанных csv,
+  запросы переводятся на диалект sqlite;
+- почта - локальный smtp приемник, письма сохраняются в .eml;
+- сайт атс - локальная https заглушка с записанными отчетами мониторинга,
+  вход на protected только с сертификатом клиента (тестовые сертификаты
+  сервера и клиента создаются в папке результатов);
+- хранилище сертификатов CAdESCOM и WinHTTP - объекты на файлах и requests;
+- bat файлы CryptoSendMail - эмуляция отправки по созданному bat файлу.
+В конце выводится общее время выполнения и сравнение с бюджетом времени.
+
+Структура папки с записью (--replay-dir):
+    settings.yaml               - настройки как в корне (пути, почта и атс
+                                  переопределяются на локальные)
+    weather_foreca.csv          - строки прогноза (id_foreca, gtp, dt,
+                                  load_time, value)
+    ses_gtp.csv                 - соответствие гтп и компаний (gtp, company)
+    monitoring/<компания>.xlsx  - отчеты мониторинга атс (если отчета нет,
+                                  он строится по принятым приемником письмам)
+    certificates.json           - необязательно, сертификаты хранилища
+                                  [{"serial": ..., "thumbprint": ..., "subject": ...}]
+    bid_schema.xsd              - необязательно, xsd схема ценовой заявки
+
+Записанный прогон для тестов лежит в tests/replay/20261020.
+Пример запуска:
+    python replay_create_xml.py --replay-dir tests/replay/20261020 --date 2026-10-20
+"""
+
+import argparse
+import datetime
+import email
+import email.policy
+import hashlib
+import importlib
+import io
+import json
+import logging
+import os
+import pathlib
+import re
+import shutil
+import smtplib
+import socketserver
+import sqlite3
+import ssl
+import sys
+import tempfile
+import threading
+import time
+import types
+import urllib.parse
+import uuid
+import zlib
+from email.message import EmailMessage
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Tuple, Union
+from xml.dom import minidom
+
+import pandas as pd
+import requests
+import yaml
+from sqlalchemy import create_engine, event
+
+ATS_HOSTS = ("https://www.atsenergo.ru", "https://protected.atsenergo.ru")
+MONITORING_COLUMNS = [
+    "Код ГТП",
+    "Наименование ГТП",
+    "Дата",
+    "Статус заявки",
+    "Статус ГТП",
+    "Номер заявки",
+    "Суммарный объем, МВт*ч",
+]
+
+
+class SmtpSinkHandler(socketserver.StreamRequestHandler):
+    """
+    Обработчик smtp сессии: принимает любую авторизацию
+    и сохраняет полученные письма в приемник.
+    """
+
+    def reply(self, line: str) -> None:
+        self.wfile.write(f"{line}\r\n".encode("utf8"))
+
+    def handle(self) -> None:
+        self.reply("220 replay smtp sink")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode("utf8", "replace").strip()
+            parts = command.split()
+            verb = parts[0].upper() if parts else ""
+            if verb == "EHLO":
+                self.wfile.write(
+                    b"250-replay\r\n250-AUTH PLAIN LOGIN\r\n250 8BITMIME\r\n"
+                )
+            elif verb == "AUTH":
+                mechanism = parts[1].upper() if len(parts) > 1 else ""
+                if mechanism == "LOGIN":
+                    if len(parts) == 2:
+                        self.reply("334 VXNlcm5hbWU6")
+                        self.rfile.readline()
+                    self.reply("334 UGFzc3dvcmQ6")
+                    self.rfile.readline()
+                elif len(parts) == 2:
+                    self.reply("334 ")
+                    self.rfile.readline()
+                self.reply("235 2.7.0 Authentication successful")
+            elif verb == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                lines = []
+                while True:
+                    data_line = self.rfile.readline()
+                    if data_line in (b".\r\n", b".\n", b""):
+                        break
+                    if data_line.startswith(b".."):
+                        data_line = data_line[1:]
+                    lines.append(data_line)
+                self.server.store(b"".join(lines))
+                self.reply("250 OK")
+            elif verb == "QUIT":
+                self.reply("221 Bye")
+                return
+            elif verb in ("HELO", "MAIL", "RCPT", "RSET", "NOOP"):
+                self.reply("250 OK")
+            else:
+                self.reply("502 Command not implemented")
+
+
+class SmtpSink(socketserver.ThreadingTCPServer):
+    """
+    Локальный smtp приемник, письма сохраняются в папку out_dir.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, out_dir: pathlib.Path) -> None:
+        super().__init__(("127.0.0.1", 0), SmtpSinkHandler)
+        self.out_dir = out_dir
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        self.messages = []
+        self.lock = threading.Lock()
+
+    def store(self, raw_message: bytes) -> None:
+        message = email.message_from_bytes(raw_message, policy=email.policy.default)
+        with self.lock:
+            self.messages.append(message)
+            number = len(self.messages)
+        (self.out_dir / f"{number:05d}.eml").write_bytes(raw_message)
+
+
+class AtsStubHandler(BaseHTTPRequestHandler):
+    """
+    Обработчик запросов к заглушке сайта атс.
+    """
+
+    def send_body(self, status: int, body: bytes, headers: Dict[str, str]) -> None:
+        self.send_response(status)
+        for header, value in headers.items():
+            self.send_header(header, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        url = urllib.parse.urlsplit(self.path)
+        if url.path == "/auth":
+            self.send_body(
+                200,
+                b"<html></html>",
+                {"Set-Cookie": f"{self.server.new_session()}; path=/"},
+            )
+        elif url.path.endswith(
+            "zxweb.report.gtp_status.form.do"
+        ) and not self.server.is_authorized(self.headers.get("Cookie")):
+            # как атс: без авторизованной сессии редирект на страницу входа
+            self.send_body(302, b"", {"Location": "/auth"})
+        elif url.path.endswith("zxweb.report.gtp_status.form.do"):
+            query = urllib.parse.parse_qs(url.query)
+            company = query["str_trader_code"][0]
+            operational_date = query["dt_begin_date"][0]
+            self.send_body(
+                200, self.server.monitoring_report(company, operational_date), {}
+            )
+        else:
+            self.send_body(404, b"", {})
+
+    def setup(self) -> None:
+        super().setup()
+        # рукопожатие tls уже прошло, считаем соединения с сертификатом клиента
+        self.client_certificate = self.connection.getpeercert(binary_form=True)
+        if self.client_certificate is not None:
+            self.server.count_client_handshake()
+
+    def do_POST(self) -> None:
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path.startswith("/f800xx_reports") and self.client_certificate is None:
+            # как protected.atsenergo.ru: вход только по сертификату клиента
+            self.send_body(403, b"", {})
+        elif self.path.startswith("/f800xx_reports"):
+            self.server.authorize(self.headers.get("Cookie"))
+            self.send_body(200, b"<html></html>", {})
+        else:
+            self.send_body(404, b"", {})
+
+    def log_message(self, format: str, *args: Any) -> None:
+        logging.debug(f"replay: ats stub - {format % args}")
+
+
+class AtsStub(ThreadingHTTPServer):
+    """
+    Локальная https заглушка сайта атс: авторизация успешна
+    с любым сертификатом клиента из client_ca, без сертификата - 403,
+    сессии живут только пока работает заглушка,
+    отчеты мониторинга берутся из записи или строятся по письмам,
+    принятым smtp приемником (последняя заявка по каждой гтп, первая
+    заявка гтп из rejected_gtps отклоняется).
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        monitoring_dir: pathlib.Path,
+        smtp_sink: SmtpSink,
+        tls_cert: str,
+        tls_key: str,
+        client_ca: str,
+        rejected_gtps: Tuple[str, ...] = (),
+    ) -> None:
+        super().__init__(("127.0.0.1", 0), AtsStubHandler)
+        self.monitoring_dir = monitoring_dir
+        self.smtp_sink = smtp_sink
+        self.rejected_gtps = rejected_gtps
+        self.sessions_lock = threading.Lock()
+        self.sessions = {}
+        self.authorizations = 0
+        self.client_handshakes = 0
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(tls_cert, tls_key)
+        # сертификат клиента запрашивается, но не обязателен (как у www)
+        context.verify_mode = ssl.CERT_OPTIONAL
+        context.load_verify_locations(client_ca)
+        self.socket = context.wrap_socket(self.socket, server_side=True)
+
+    @staticmethod
+    def session_id(cookie: Union[str, None]) -> str:
+        return (cookie or "").split(";")[0].strip()
+
+    def new_session(self) -> str:
+        with self.sessions_lock:
+            session_id = f"ASP.NET_SessionId={uuid.uuid4().hex}"
+            self.sessions[session_id] = False
+        return session_id
+
+    def authorize(self, cookie: Union[str, None]) -> None:
+        with self.sessions_lock:
+            if self.session_id(cookie) in self.sessions:
+                self.sessions[self.session_id(cookie)] = True
+                self.authorizations += 1
+
+    def count_client_handshake(self) -> None:
+        with self.sessions_lock:
+            self.client_handshakes += 1
+
+    def is_authorized(self, cookie: Union[str, None]) -> bool:
+        with self.sessions_lock:
+            return self.sessions.get(self.session_id(cookie), False)
+
+    @property
+    def base_url(self) -> str:
+        return f"https://127.0.0.1:{self.server_address[1]}"
+
+    def monitoring_report(self, company: str, operational_date: str) -> bytes:
+        recorded_report = self.monitoring_dir / f"{company}.xlsx"
+        if recorded_report.exists():
+            return recorded_report.read_bytes()
+        gtp_rows = {}
+        with self.smtp_sink.lock:
+            messages = list(self.smtp_sink.messages)
+        for number, message in enumerate(messages, start=1):
+            if f"_{company}_" not in str(message["Subject"]):
+                continue
+            for part in message.iter_attachments():
+                document = minidom.parseString(part.get_payload(decode=True))
+                gtp_code = document.getElementsByTagName("code3")[0].firstChild.data
+                total_volume = sum(
+                    float(node.firstChild.data.replace(",", "."))
+                    for node in document.getElementsByTagName("high-value")
+                )
+                rejected = gtp_code in self.rejected_gtps and gtp_code not in gtp_rows
+                gtp_rows[gtp_code] = [
+                    gtp_code,
+                    gtp_code,
+                    operational_date,
+                    "Отклонена" if rejected else "Принята",
+                    "Активна",
+                    str(number),
+                    round(total_volume, 3),
+                ]
+        rows = [MONITORING_COLUMNS, *gtp_rows.values()]
+        buffer = io.BytesIO()
+        pd.DataFrame(rows, columns=["Мониторинг"] + [""] * 6).to_excel(
+            buffer, index=False
+        )
+        return buffer.getvalue()
+
+
+class FileCertificate:
+    """
+    Сертификат хранилища на файлах (аналог CAdESCOM.Certificate).
+    """
+
+    def __init__(self, serial: str, thumbprint: str, subject: str) -> None:
+        self.SerialNumber = serial
+        self.Thumbprint = thumbprint
+        self.subject = subject
+
+    def GetInfo(self, info_type: int) -> str:
+        return self.subject
+
+
+class FileCertificates:
+    """
+    Коллекция сертификатов с нумерацией с 1, как в COM.
+    """
+
+    def __init__(self, certificates: List[FileCertificate]) -> None:
+        self.certificates = certificates
+
+    @property
+    def count(self) -> int:
+        return len(self.certificates)
+
+    def Item(self, i: int) -> FileCertificate:
+        return self.certificates[i - 1]
+
+
+class FileCertStore:
+    """
+    Хранилище сертификатов на json файле (аналог CAdESCOM.Store).
+    """
+
+    def __init__(self, certificates_path: pathlib.Path) -> None:
+        self.certificates_path = certificates_path
+        self.Certificates = FileCertificates([])
+
+    def Open(self, location: int, name: str, mode: int) -> None:
+        with open(self.certificates_path, "r", encoding="utf8") as json_file:
+            self.Certificates = FileCertificates(
+                [
+                    FileCertificate(item["serial"], item["thumbprint"], item["subject"])
+                    for item in json.load(json_file)
+                ]
+            )
+
+
+class ReplayComError(Exception):
+    """
+    Аналог pythoncom.com_error.
+    """
+
+
+class ReplayWinHttpRequest:
+    """
+    Аналог WinHTTP.WinHTTPRequest.5.1 поверх requests,
+    запросы к сайтам атс перенаправляются на заглушку.
+    Сертификат клиента (SetClientCertificate) действует до следующего Open,
+    вместо сертификата из хранилища предъявляется client_cert.
+    """
+
+    def __init__(self, ats_base_url: str, client_cert: Tuple[str, str]) -> None:
+        self.ats_base_url = ats_base_url
+        self.client_cert = client_cert
+        self.certificate = None
+        self.session = requests.Session()
+        self.Status = 0
+        self.ResponseBody = b""
+        self.response_headers = {}
+
+    def Option(self, option: int) -> None:
+        pass
+
+    def Open(self, method: str, url: str, asynchronous: bool) -> None:
+        for host in ATS_HOSTS:
+            if url.startswith(host):
+                url = f"{self.ats_base_url}{url[len(host):]}"
+        self.method = method
+        self.url = url
+        self.request_headers = {}
+        self.certificate = None
+
+    def SetClientCertificate(self, certificate: str) -> None:
+        self.certificate = certificate
+
+    def SetRequestHeader(self, header: str, value: str) -> None:
+        self.request_headers[header] = value
+
+    @property
+    def send(self) -> None:
+        # в create_xml send вызывается без скобок (как свойство COM),
+        # ошибки соединения приходят как com_error, как у WinHTTP
+        try:
+            response = self.session.request(
+                self.method,
+                self.url,
+                headers=self.request_headers,
+                cert=self.client_cert if self.certificate is not None else None,
+                verify=False,
+                timeout=30,
+            )
+        except requests.RequestException as err:
+            raise ReplayComError(str(err)) from err
+        self.Status = response.status_code
+        self.ResponseBody = response.content
+        self.response_headers = response.headers
+
+    def GetResponseHeader(self, header: str) -> str:
+        return self.response_headers.get(header, "")
+
+
+def install_com_stand_ins(
+    certificates_path: pathlib.Path, ats_base_url: str, client_cert: Tuple[str, str]
+) -> None:
+    """
+    Функция подмены модулей win32com и pythoncom локальными аналогами.
+    Вызывается до импорта create_xml.
+    """
+
+    def dispatch(prog_id: str) -> Any:
+        if prog_id == "CAdESCOM.Store":
+            return FileCertStore(certificates_path)
+        if prog_id == "WinHTTP.WinHTTPRequest.5.1":
+            return ReplayWinHttpRequest(ats_base_url, client_cert)
+        raise ValueError(f"replay: нет замены для {prog_id}")
+
+    win32com_module = types.ModuleType("win32com")
+    win32com_client_module = types.ModuleType("win32com.client")
+    win32com_client_module.Dispatch = dispatch
+    win32com_module.client = win32com_client_module
+    pythoncom_module = types.ModuleType("pythoncom")
+    pythoncom_module.CoInitialize = lambda: None
+    pythoncom_module.CoUninitialize = lambda: None
+    pythoncom_module.com_error = ReplayComError
+    sys.modules["win32com"] = win32com_module
+    sys.modules["win32com.client"] = win32com_client_module
+    sys.modules["pythoncom"] = pythoncom_module
+
+
+def translate_mysql(statement: str) -> str:
+    """
+    Функция перевода запросов create_xml с диалекта MySQL на sqlite.
+    """
+    statement = re.sub(
+        r"DATE_ADD\((.+?), INTERVAL (-?\d+) DAY\)",
+        r"date(\1, '\2 day')",
+        statement,
+    )
+    return statement.replace("%%", "%")
+
+
+def create_replay_engine(db_dir: pathlib.Path) -> Any:
+    """
+    Функция создания sqlite engine с базами treid_03 и visualcrossing.
+    HOUR() - час из строки даты, CRC32() и CONCAT() - как в MySQL.
+    """
+    engine = create_engine(f"sqlite:///{db_dir / 'replay.db'}")
+
+    @event.listens_for(engine, "connect")
+    def on_connect(dbapi_connection: Any, connection_record: Any) -> None:
+        dbapi_connection.create_function(
+            "HOUR",
+            1,
+            lambda value: (
+                None if value is None else datetime.datetime.fromisoformat(value).hour
+            ),
+        )
+        dbapi_connection.create_function(
+            "CRC32",
+            1,
+            lambda value: (
+                None if value is None else zlib.crc32(str(value).encode("utf8"))
+            ),
+        )
+        dbapi_connection.create_function(
+            "CONCAT",
+            -1,
+            lambda *values: (
+                None if None in values else "".join(str(value) for value in values)
+            ),
+        )
+        for schema in ("treid_03", "visualcrossing"):
+            dbapi_connection.execute(
+                f"ATTACH DATABASE '{db_dir / schema}.db' AS {schema}"
+            )
+
+    @event.listens_for(engine, "before_cursor_execute", retval=True)
+    def on_execute(
+        conn: Any,
+        cursor: Any,
+        statement: str,
+        parameters: Any,
+        context: Any,
+        executemany: bool,
+    ) -> Any:
+        return translate_mysql(statement), parameters
+
+    return engine
+
+
+def load_recorded_tables(replay_dir: pathlib.Path, db_dir: pathlib.Path) -> None:
+    """
+    Функция загрузки записанных csv в базы sqlite.
+    """
+    tables = (
+        ("treid_03", "weather_foreca", "weather_foreca.csv"),
+        ("visualcrossing", "ses_gtp", "ses_gtp.csv"),
+    )
+    for schema, table, csv_name in tables:
+        with sqlite3.connect(db_dir / f"{schema}.db") as sqlite_connection:
+            pd.read_csv(replay_dir / csv_name).to_sql(
+                table, sqlite_connection, if_exists="replace", index=False
+            )
+
+
+def company_x509ids(settings: Dict) -> Dict[str, str]:
+    """
+    Функция получения x509id по компаниям из раздела companies
+    или старых разделов юр.лиц (с x509id).
+    """
+    sections = settings.get("companies") or {
+        key: value
+        for key, value in settings.items()
+        if isinstance(value, (list, dict)) and "x509id" in pd.DataFrame(value).columns
+    }
+    x509ids = {}
+    for company, section in sections.items():
+        if isinstance(section, list):
+            section = section[0]
+        x509id = section["x509id"]
+        x509ids[str(company).upper()] = str(
+            x509id[0] if isinstance(x509id, list) else x509id
+        )
+    return x509ids
+
+
+def write_replay_settings(
+    replay_dir: pathlib.Path, out_dir: pathlib.Path, smtp_port: int
+) -> pathlib.Path:
+    """
+    Функция подготовки settings.yaml для прогона: папки ценовых заявок
+    в out_dir, почта на локальный smtp приемник.
+    """
+    with open(replay_dir / "settings.yaml", "r", encoding="utf8") as yaml_file:
+        settings = yaml.safe_load(yaml_file)
+    settings["cz_path"] = [
+        {
+            "create_cz_path": f"{out_dir / 'cz'}{os.sep}",
+            "move_cz_path": f"{out_dir / 'sent'}{os.sep}",
+        }
+    ]
+    for key in ("basic_email_settings", "reserve_email_settings"):
+        email_settings = pd.DataFrame(settings[key]).to_dict("records")
+        for record in email_settings:
+            record["config"] = dict(
+                record["config"], SMTPHost="127.0.0.1", SMTPPort=smtp_port
+            )
+        settings[key] = email_settings
+    settings.setdefault("telegram", [{"bot_token": "", "channel_id": ""}])
+    settings.setdefault("sql_db", [{}])
+    (out_dir / "sent").mkdir(parents=True, exist_ok=True)
+    settings_path = out_dir / "settings.yaml"
+    with open(settings_path, "w", encoding="utf8") as yaml_file:
+        yaml.safe_dump(settings, yaml_file, allow_unicode=True)
+
+    certificates_path = replay_dir / "certificates.json"
+    if not certificates_path.exists():
+        certificates_path = out_dir / "certificates.json"
+        certificates = [
+            {
+                "serial": x509id,
+                "thumbprint": hashlib.sha1(company.encode("utf8")).hexdigest().upper(),
+                "subject": f"CN={company}",
+            }
+            for company, x509id in company_x509ids(settings).items()
+        ]
+        with open(certificates_path, "w", encoding="utf8") as json_file:
+            json.dump(certificates, json_file)
+    return certificates_path
+
+
+def emulate_bat(
+    work_path: str, bat_file_name: str, company: str, bid_delay: float
+) -> None:
+    """
+    Функция эмуляции bat файла CryptoSendMail: каждый xml из списка
+    гтп отправляется письмом на smtp из bat файла и переносится
+    в папку отправленных. Как и bat файл, работает параллельно со скриптом,
+    с паузой bid_delay секунд перед каждой заявкой, уже перенесенные
+    другим bat файлом xml пропускает.
+    """
+    variables = {}
+    with open(f"{work_path}{bat_file_name}", "r") as bat_file:
+        for line in bat_file:
+            match = re.match(r"set (\w+)=(.*)$", line.rstrip("\n"))
+            if match is not None:
+                variables[match[1]] = match[2]
+    gtp_codes = [
+        value for key, value in variables.items() if re.fullmatch(r"p\d+", key)
+    ]
+    path = variables["pPath"].replace("\\", os.sep)
+    sent_count = 0
+    with smtplib.SMTP(variables["pMail"], int(variables["pPort"])) as smtp:
+        smtp.login(variables["pUser"], variables["pPassword"])
+        claim_path = variables["pClaim"].replace("\\", os.sep)
+        for gtp_code in gtp_codes:
+            time.sleep(bid_delay)
+            # метка гтп, как mkdir в bat файле: гтп уже взял встречный bat
+            try:
+                os.mkdir(os.path.join(claim_path, gtp_code))
+            except FileExistsError:
+                continue
+            xml_file = f"{path}_{gtp_code}_{variables['sentdate']}.xml"
+            if not os.path.exists(xml_file):
+                os.rmdir(os.path.join(claim_path, gtp_code))
+                continue
+            message = EmailMessage()
+            message["Subject"] = (
+                f"{variables['pSubj']}_{gtp_code}_{variables['sentdate']}"
+            )
+            message["From"] = variables["pUser"]
+            message["To"] = "ats@replay.local"
+            with open(xml_file, "rb") as xml:
+                message.add_attachment(
+                    xml.read(),
+                    maintype="application",
+                    subtype="xml",
+                    filename=os.path.basename(xml_file),
+                )
+            smtp.send_message(message)
+            # move в bat файле перезаписывает файл в папке назначения
+            shutil.move(
+                xml_file,
+                os.path.join(
+                    variables["pPathMove"].replace("\\", os.sep),
+                    os.path.basename(xml_file),
+                ),
+            )
+            sent_count += 1
+    logging.info(
+        f"replay: отправлено {sent_count} ценовых заявок {company} ({work_path})."
+    )
+
+
+def run_replay(args: argparse.Namespace) -> int:
+    """
+    Функция прогона main() create_xml на записанных данных.
+    Возвращает 0, если прогон уложился в бюджет времени.
+    """
+    replay_dir = pathlib.Path(args.replay_dir).absolute()
+    out_dir = pathlib.Path(
+        args.out_dir or tempfile.mkdtemp(prefix="replay_create_xml_")
+    ).absolute()
+    out_dir.mkdir(parents=True, exist_ok=True)
+    target_date = datetime.datetime.strptime(args.date, "%Y-%m-%d")
+
+    logging.basicConfig(
+        filename=out_dir / "replay.log",
+        level=logging.INFO,
+        format=(
+            "%(asctime)s - %(levelname)s - " "%(funcName)s: %(lineno)d - %(message)s"
+        ),
+    )
+    db_dir = out_dir / "db"
+    db_dir.mkdir(exist_ok=True)
+    load_recorded_tables(replay_dir, db_dir)
+    engine = create_replay_engine(db_dir)
+
+    # тестовые сертификаты сервера заглушки атс и клиента
+    xml_signing = importlib.import_module("xml_signing")
+    tls_dir = out_dir / "tls"
+    for key_dir, common_name in (("server", "127.0.0.1"), ("client", "replay client")):
+        if not (tls_dir / key_dir / "cert.pem").exists():
+            xml_signing.create_test_key(str(tls_dir / key_dir), common_name)
+    client_cert = (
+        str(tls_dir / "client" / "cert.pem"),
+        str(tls_dir / "client" / "key.pem"),
+    )
+    smtp_sink = SmtpSink(out_dir / "smtp")
+    ats_stub = AtsStub(
+        replay_dir / "monitoring",
+        smtp_sink,
+        args.tls_cert or str(tls_dir / "server" / "cert.pem"),
+        args.tls_key or str(tls_dir / "server" / "key.pem"),
+        client_cert[0],
+        tuple(args.reject_gtp),
+    )
+    for server in (smtp_sink, ats_stub):
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    certificates_path = write_replay_settings(
+        replay_dir, out_dir, smtp_sink.server_address[1]
+    )
+    os.environ["CREATE_XML_SETTINGS"] = str(out_dir / "settings.yaml")
+    install_com_stand_ins(certificates_path, ats_stub.base_url, client_cert)
+    sys.path.insert(0, str(pathlib.Path(__file__).parent.absolute()))
+    create_xml = importlib.import_module("create_xml")
+
+    cryptosendmail_path = out_dir / "CryptoSendMail.exe"
+    cryptosendmail_path.touch()
+    create_xml.TARGET_DATE = target_date.strftime("%Y%m%d")
+    create_xml.TARGET_DATE_FOR_ATS = target_date.strftime("%d.%m.%Y")
+    create_xml.TIMEOUT_BEFORE_CHECK_CZ = 0
+    create_xml.WORK_ROOT = str(out_dir / "CZ")
+    create_xml.ARCHIVE_PATH = str(out_dir / "archive")
+    create_xml.JOURNAL_PATH = str(out_dir / "journal")
+    create_xml.FORECAST_FILE_PATH = str(out_dir)
+    create_xml.CRYPTOSENDMAIL_PATH = str(cryptosendmail_path)
+    create_xml.BID_XSD_PATH = str(replay_dir / "bid_schema.xsd")
+    create_xml.telegram = lambda i, text: logging.info(f"replay: telegram {i} - {text}")
+    create_xml.connection = lambda i: engine.connect()
+    create_xml.SEND_POLL_SECONDS = 0.1
+    create_xml.RESUBMIT_CHECK_SECONDS = 0
+    gate_closure = datetime.datetime.now() + datetime.timedelta(
+        seconds=args.gate_closure_seconds
+    )
+    create_xml.gate_closure_deadline = lambda target_date: gate_closure
+    bat_threads = []
+
+    def start_bat(work_path: str, bat_file_name: str, company: str) -> None:
+        # bat файл читается сразу, как при запуске через os.startfile
+        bat_thread = threading.Thread(
+            target=emulate_bat,
+            args=(work_path, bat_file_name, company, args.bid_delay),
+        )
+        bat_thread.start()
+        bat_threads.append(bat_thread)
+
+    create_xml.send_xml_cz_bat = start_bat
+
+    os.chdir(out_dir)
+    started = time.perf_counter()
+    if args.queue:
+        # координатор и один обработчик очереди в этом же процессе
+        create_xml.QUEUE_PATH = str(out_dir / "queue")
+        create_xml.QUEUE_POLL_SECONDS = 0.1
+        create_xml.enqueue_run_jobs()
+        if args.profile:
+            create_xml.PROFILE_PATH = str(out_dir)
+            create_xml.run_worker_profiled("replay")
+        else:
+            create_xml.run_worker("replay")
+        print(
+            create_xml.queue_status(create_xml.QUEUE_PATH)[
+                [
+                    "company",
+                    "direction",
+                    "stage",
+                    "status",
+                    "attempts",
+                    "result",
+                    "error",
+                ]
+            ].to_string()
+        )
+    elif args.profile:
+        create_xml.PROFILE_PATH = str(out_dir)
+        create_xml.main_profiled()
+    else:
+        create_xml.main()
+    elapsed = time.perf_counter() - started
+    for bat_thread in bat_threads:
+        bat_thread.join()
+
+    smtp_sink.shutdown()
+    ats_stub.shutdown()
+    within_budget = elapsed <= args.budget
+    print(f"replay: дата {args.date}, результаты в {out_dir}")
+    print(f"replay: отправлено писем {len(smtp_sink.messages)}")
+    print(f"replay: авторизаций на атс {ats_stub.authorizations}")
+    print(f"replay: tls соединений с сертификатом клиента {ats_stub.client_handshakes}")
+    print(
+        f"replay: время {elapsed:.2f} с, бюджет {args.budget:.2f} с - "
+        f"{'OK' if within_budget else 'ПРЕВЫШЕН'}"
+    )
+    return 0 if within_budget else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Прогон create_xml.py на записанных данных."
+    )
+    parser.add_argument("--replay-dir", required=True, help="папка с записью")
+    parser.add_argument(
+        "--date",
+        default=(datetime.date.today() + datetime.timedelta(days=1)).isoformat(),
+        help="операционные сутки ценовых заявок, ГГГГ-ММ-ДД",
+    )
+    parser.add_argument(
+        "--budget", type=float, default=120.0, help="бюджет времени, секунд"
+    )
+    parser.add_argument("--out-dir", default=None, help="папка для результатов")
+    parser.add_argument(
+        "--bid-delay",
+        type=float,
+        default=0.0,
+        help="пауза bat файла перед каждой заявкой, секунд",
+    )
+    parser.add_argument(
+        "--gate-closure-seconds",
+        type=float,
+        default=24 * 60 * 60,
+        help="через сколько секунд от старта закрывается прием заявок",
+    )
+    parser.add_argument(
+        "--profile", action="store_true", help="записать профиль прогона"
+    )
+    parser.add_argument(
+        "--queue", action="store_true", help="прогон в режиме очереди заданий"
+    )
+    parser.add_argument(
+        "--reject-gtp",
+        action="append",
+        default=[],
+        help="гтп, первая заявка по которой отклоняется в мониторинге "
+        "(статус Отклонена, задается в monitoring.rejected_cz_statuses)",
+    )
+    parser.add_argument(
+        "--tls-cert",
+        default=None,
+        help="сертификат https заглушки атс (по умолчанию тестовый)",
+    )
+    parser.add_argument("--tls-key", default=None, help="ключ https заглушки атс")
+    sys.exit(run_replay(parser.parse_args()))
@@ -0,0 +1,194 @@
+"""
+Выборочный профилировщик для запусков в работе.
+
+Фоновый поток с заданным интервалом снимает стеки всех потоков
+(sys._current_frames) и считает одинаковые стеки. Результат пишется
+в свернутом формате (folded stacks: "кадр;кадр;кадр количество"),
+который читают flamegraph.pl, speedscope и аналоги.
+
+Корень каждого стека - метка потока (например направление "ask"),
+следующий уровень - вид работы: cpu или ожидание (wait-com,
+wait-network, wait-sleep, wait-thread). Ожидание сетевых библиотек
+и потоков определяется по модулям стека, вызовы COM и паузы
+размечаются в коде контекстным менеджером wait_section.
+
+Пример просмотра:
+    flamegraph.pl create_xml_profile_20261020_0930.folded > profile.svg
+"""
+
+import collections
+import contextlib
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from typing import Dict, Iterator, List, Tuple
+
+# интервал снятия стеков, секунд
+SAMPLE_INTERVAL = 0.01
+# модули, время в которых считается ожиданием, по виду ожидания
+WAIT_MODULES = (
+    ("wait-com", ("win32com", "pythoncom", "pywintypes")),
+    (
+        "wait-network",
+        (
+            "socket.py",
+            "ssl.py",
+            "selectors.py",
+            "smtplib.py",
+            f"http{os.sep}client.py",
+            "urllib3",
+            "pymysql",
+            "MySQLdb",
+        ),
+    ),
+    ("wait-thread", ("threading.py", f"concurrent{os.sep}futures")),
+)
+
+# размеченные ожидания {id потока: вид ожидания}
+# и метки потоков {id потока: метка}
+THREAD_WAITS = {}
+THREAD_TAGS = {}
+
+
+@contextlib.contextmanager
+def wait_section(kind: str) -> Iterator[None]:
+    """
+    Контекстный менеджер разметки ожидания (com, network, sleep)
+    в текущем потоке. Вне профилирования почти ничего не стоит.
+    """
+    thread_id = threading.get_ident()
+    previous = THREAD_WAITS.get(thread_id)
+    THREAD_WAITS[thread_id] = f"wait-{kind}"
+    try:
+        yield
+    finally:
+        if previous is None:
+            THREAD_WAITS.pop(thread_id, None)
+        else:
+            THREAD_WAITS[thread_id] = previous
+
+
+def set_thread_tag(tag: str) -> None:
+    """
+    Функция задания метки текущего потока (корня стеков профиля).
+    """
+    THREAD_TAGS[threading.get_ident()] = tag
+
+
+def frame_label(frame) -> str:
+    code = frame.f_code
+    return (
+        f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+    )
+
+
+def classify_stack(thread_id: int, frames: List) -> str:
+    """
+    Функция определения вида работы по стеку:
+    размеченное ожидание, ожидание по модулям стека или cpu.
+    """
+    if thread_id in THREAD_WAITS:
+        return THREAD_WAITS[thread_id]
+    if not frames:
+        return "cpu"
+    # ожидание определяется по самому внутреннему кадру: блокирующий
+    # вызов на C виден как последний кадр python модуля сети или потоков
+    filename = frames[-1].f_code.co_filename
+    for kind, modules in WAIT_MODULES:
+        if any(module in filename for module in modules):
+            return kind
+    return "cpu"
+
+
+class SamplingProfiler:
+    """
+    Выборочный профилировщик всех потоков процесса.
+    """
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL) -> None:
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(
+            target=self.run, name="sampling_profiler", daemon=True
+        )
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stop_event.set()
+        self.thread.join()
+
+    def run(self) -> None:
+        own_id = threading.get_ident()
+        thread_names = {}
+        while not self.stop_event.wait(self.interval):
+            for thread in threading.enumerate():
+                # потоки одного пула (xml_write_0, xml_write_1) - одна метка
+                thread_names[thread.ident] = re.sub(r"_\d+$", "", thread.name)
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                frames = []
+                while frame is not None:
+                    frames.append(frame)
+                    frame = frame.f_back
+                frames.reverse()
+                tag = THREAD_TAGS.get(thread_id) or thread_names.get(
+                    thread_id, str(thread_id)
+                )
+                self.stacks[
+                    (
+                        tag,
+                        classify_stack(thread_id, frames),
+                        tuple(frame_label(frame) for frame in frames),
+                    )
+                ] += 1
+            self.samples += 1
+
+    def write_folded(self, file_path: str) -> None:
+        """
+        Функция записи профиля в свернутом формате.
+        """
+        with open(file_path, "w", encoding="utf8") as folded_file:
+            for (tag, kind, labels), count in sorted(self.stacks.items()):
+                stack = ";".join((tag, kind, *labels)).replace(" ", "_")
+                folded_file.write(f"{stack} {count}\n")
+
+    def summary(self) -> Dict[Tuple[str, str], float]:
+        """
+        Функция получения оценки времени по метке потока и виду работы,
+        секунд.
+        """
+        totals = collections.Counter()
+        for (tag, kind, labels), count in self.stacks.items():
+            totals[(tag, kind)] += count
+        return {key: count * self.interval for key, count in sorted(totals.items())}
+
+
+@contextlib.contextmanager
+def sampling_profile(file_path: str) -> Iterator[SamplingProfiler]:
+    """
+    Контекстный менеджер профилирования блока кода: по выходу
+    профиль пишется в file_path, сводка по видам работы - в лог.
+    """
+    profiler = SamplingProfiler()
+    started = time.perf_counter()
+    profiler.start()
+    try:
+        yield profiler
+    finally:
+        profiler.stop()
+        profiler.write_folded(file_path)
+        elapsed = time.perf_counter() - started
+        logging.info(
+            f"sampling_profiler: Профиль {file_path}, {elapsed:.1f} с, "
+            f"снимков {profiler.samples}"
+        )
+        for (tag, kind), seconds in profiler.summary().items():
+            logging.info(f"sampling_profiler: {tag} {kind} ~{seconds:.2f} с")
@@ -0,0 +1,77 @@
+import pytest
+
+# архив читается датафреймом, без pandas тесты пропускаются
+pytest.importorskip("pandas")
+
+import bids_archive  # noqa: E402
+
+
+def write_bid(tmp_path, name, volumes):
+    hours = "".join(
+        f'<hour number="{hour}"><high-value>{str(volume).replace(".", ",")}'
+        "</high-value></hour>"
+        for hour, volume in volumes
+    )
+    xml_path = tmp_path / name
+    xml_path.write_bytes(
+        f'<?xml version="1.0" encoding="UTF-8"?><message>{hours}</message>'.encode(
+            "utf8"
+        )
+    )
+    return str(xml_path)
+
+
+def sent_bid(xml_path, gtp="GVIE0001"):
+    return {"company": "AVSOLTEK", "gtp": gtp, "direction": "ask", "path": xml_path}
+
+
+def test_archived_bid_is_read_back(tmp_path):
+    archive_path = str(tmp_path / "archive")
+    xml_path = write_bid(tmp_path, "first.xml", [(0, 0.1), (1, 1.5)])
+    other_path = write_bid(tmp_path, "other.xml", [(0, 2.0)])
+    added = bids_archive.archive_sent_bids(
+        archive_path,
+        "20261020",
+        [sent_bid(xml_path), sent_bid(other_path, "GVIE0002")],
+    )
+    assert added == 2
+
+    found = bids_archive.find_sent_bids(archive_path, "20261020", gtp="GVIE0001")
+    assert list(found["filename"]) == ["first.xml"]
+    row = found.iloc[0]
+    xml_bytes = bids_archive.read_sent_bid(
+        archive_path,
+        row["segment"],
+        int(row["segment_offset"]),
+        int(row["segment_length"]),
+    )
+    with open(xml_path, "rb") as xml_file:
+        assert xml_bytes == xml_file.read()
+
+    volumes = bids_archive.sent_volumes_dataframe(archive_path, "20261020")
+    assert list(zip(volumes["gtp"], volumes["hour"], volumes["volume"])) == [
+        ("GVIE0001", 0, 0.1),
+        ("GVIE0001", 1, 1.5),
+        ("GVIE0002", 0, 2.0),
+    ]
+
+
+def test_resent_bid_replaces_latest_volumes(tmp_path):
+    archive_path = str(tmp_path / "archive")
+    bids_archive.archive_sent_bids(
+        archive_path, "20261020", [sent_bid(write_bid(tmp_path, "a.xml", [(0, 1.0)]))]
+    )
+    bids_archive.archive_sent_bids(
+        archive_path, "20261020", [sent_bid(write_bid(tmp_path, "b.xml", [(0, 3.0)]))]
+    )
+    latest = bids_archive.sent_volumes_dataframe(archive_path, "20261020")
+    assert list(latest["volume"]) == [3.0]
+    all_sent = bids_archive.sent_volumes_dataframe(
+        archive_path, "20261020", latest_only=False
+    )
+    assert list(all_sent["volume"]) == [1.0, 3.0]
+    assert bids_archive.find_sent_bids(archive_path, "20261021").empty
+
+
+def test_nothing_to_archive(tmp_path):
+    assert bids_archive.archive_sent_bids(str(tmp_path), "20261020", []) == 0
@@ -0,0 +1,66 @@
+import pytest
+
+# модуль работает с датафреймами, без pandas тесты пропускаются
+np = pytest.importorskip("numpy")
+pd = pytest.importorskip("pandas")
+
+import monitoring_history  # noqa: E402
+
+
+def report(rows):
+    return pd.DataFrame(rows, columns=list(monitoring_history.HISTORY_COLUMNS))
+
+
+PREVIOUS = report(
+    [
+        ("AVSOLTEK", "GVIE0001", "Принята", "Активна", "101", 27.7, 27.7),
+        ("AVSOLTEK", "GVIE0002", "Принята", "Активна", "102", 27.7, 27.7),
+        ("AVSOLTEK", "GVIE0003", "Отклонена", "Активна", np.nan, np.nan, 27.7),
+    ]
+)
+
+
+def test_unchanged_report_has_no_changes():
+    assert monitoring_history.monitoring_changes(PREVIOUS, PREVIOUS.copy()).empty
+
+
+def test_changed_columns_are_flagged():
+    current = PREVIOUS.copy()
+    current.loc[1, "total_volume"] = 20.0
+    current.loc[2, ["cz_status", "cz_number", "total_volume"]] = [
+        "Принята",
+        "103",
+        27.7,
+    ]
+    changes = monitoring_history.monitoring_changes(PREVIOUS, current).set_index("gtp")
+    assert list(changes.index) == ["GVIE0002", "GVIE0003"]
+    assert changes.loc["GVIE0002", "total_volume_changed"]
+    assert not changes.loc["GVIE0002", "cz_status_changed"]
+    assert changes.loc["GVIE0002", "total_volume_previous"] == 27.7
+    assert changes.loc["GVIE0003", "cz_status_changed"]
+    assert changes.loc["GVIE0003", "cz_status_previous"] == "Отклонена"
+    assert changes.loc["GVIE0003", "cz_number_changed"]
+    assert not changes["is_new"].any()
+
+
+def test_gtp_without_previous_check_is_new():
+    current = pd.concat(
+        [
+            PREVIOUS,
+            report([("GREENRUS", "GVIE0004", "Принята", "Активна", "104", 1.0, 1.0)]),
+        ],
+        ignore_index=True,
+    )
+    changes = monitoring_history.monitoring_changes(PREVIOUS, current)
+    assert list(changes["gtp"]) == ["GVIE0004"]
+    assert changes.loc[0, "is_new"]
+    assert not changes.loc[0, "cz_status_changed"]
+
+
+def test_excel_number_and_rounding_are_not_changes():
+    current = PREVIOUS.copy()
+    # номер заявки из excel числом, объем с хвостом float32
+    current["cz_number"] = current["cz_number"].astype(float)
+    current.loc[0, "total_volume"] = 27.7000001
+    current.loc[0, "cz_status"] = " Принята "
+    assert monitoring_history.monitoring_changes(PREVIOUS, current).empty
@@ -0,0 +1,67 @@
+import os
+import pathlib
+import subprocess
+import sys
+
+import pytest
+
+# прогон main() целиком: нужны все зависимости create_xml
+for module in ("pandas", "sqlalchemy", "lxml", "yaml", "requests", "openpyxl"):
+    pytest.importorskip(module)
+pytest.importorskip("cryptography")
+
+REPO_PATH = pathlib.Path(__file__).parent.parent
+# записанный прогон: 3 гтп двух компаний, ses_gtp и настройки
+REPLAY_PATH = pathlib.Path(__file__).parent / "replay" / "20261020"
+
+
+def run_replay(out_dir, *args):
+    result = subprocess.run(
+        [
+            sys.executable,
+            str(REPO_PATH / "replay_create_xml.py"),
+            "--replay-dir",
+            str(REPLAY_PATH),
+            "--date",
+            "2026-10-20",
+            "--out-dir",
+            str(out_dir),
+            *args,
+        ],
+        capture_output=True,
+        text=True,
+        timeout=300,
+        env=dict(os.environ, CREATE_XML_FRESH_RUN="1"),
+    )
+    assert result.returncode == 0, result.stdout + result.stderr
+    return result.stdout
+
+
+def sent_xml(out_dir):
+    return sorted(path.name for path in (out_dir / "sent").glob("*.xml"))
+
+
+def test_replay_sends_every_gtp_once(tmp_path):
+    output = run_replay(tmp_path)
+    assert "отправлено писем 3" in output
+    # вход на атс только по сертификату клиента, по разу на компанию
+    assert "авторизаций на атс 2" in output
+    assert sent_xml(tmp_path) == [
+        "ASP_AVSOLTEK_GVIE0001_20261020.xml",
+        "ASP_AVSOLTEK_GVIE0002_20261020.xml",
+        "ASP_GREENRUS_GVIE0003_20261020.xml",
+    ]
+    assert len(list((tmp_path / "smtp").glob("*.eml"))) == 3
+
+
+def test_replay_resubmits_rejected_gtp(tmp_path):
+    output = run_replay(tmp_path, "--reject-gtp", "GVIE0002")
+    assert "отправлено писем 4" in output
+    # повторная проверка по cookie из кэша идет без сертификата клиента
+    assert "tls соединений с сертификатом клиента 4" in output
+
+
+def test_replay_queue_mode(tmp_path):
+    output = run_replay(tmp_path, "--queue")
+    assert "отправлено писем 3" in output
+    assert "failed" not in output
@@ -0,0 +1,120 @@
+import json
+import sqlite3
+
+import pytest
+
+import work_queue
+
+
+def enqueue_one(queue_path, max_attempts=3):
+    return work_queue.enqueue_jobs(
+        queue_path, [("AVSOLTEK", "ask", "20261020")], max_attempts
+    )
+
+
+def job_row(queue_path):
+    connection = work_queue.open_queue(queue_path)
+    connection.row_factory = sqlite3.Row
+    try:
+        return dict(connection.execute("SELECT * FROM jobs ORDER BY job_id").fetchone())
+    finally:
+        connection.close()
+
+
+def test_enqueue_does_not_duplicate_jobs(tmp_path):
+    assert enqueue_one(str(tmp_path)) == 1
+    assert enqueue_one(str(tmp_path)) == 0
+    assert work_queue.unfinished_jobs(str(tmp_path)) == 1
+
+
+def test_claim_leases_job_to_one_worker(tmp_path):
+    queue_path = str(tmp_path)
+    enqueue_one(queue_path)
+    job = work_queue.claim_job(queue_path, "worker-1")
+    assert job["company"] == "AVSOLTEK"
+    assert job["stage"] == "send"
+    assert job["attempts"] == 1
+    assert work_queue.claim_job(queue_path, "worker-2") is None
+    assert work_queue.complete_job(queue_path, job["job_id"], "worker-1", {"sent": 2})
+    assert work_queue.unfinished_jobs(queue_path) == 0
+    row = job_row(queue_path)
+    assert row["status"] == "done"
+    assert json.loads(row["result"]) == {"sent": 2}
+
+
+def test_expired_lease_is_taken_by_another_worker(tmp_path):
+    queue_path = str(tmp_path)
+    enqueue_one(queue_path)
+    job = work_queue.claim_job(queue_path, "worker-1", lease_seconds=-1)
+    reclaimed = work_queue.claim_job(queue_path, "worker-2")
+    assert reclaimed["job_id"] == job["job_id"]
+    assert reclaimed["attempts"] == 2
+    # аренду забрал другой обработчик, прежний не может ее продлить или завершить
+    assert not work_queue.renew_lease(queue_path, job["job_id"], "worker-1")
+    assert not work_queue.complete_job(queue_path, job["job_id"], "worker-1", {})
+    assert work_queue.renew_lease(queue_path, job["job_id"], "worker-2")
+
+
+def test_expired_lease_without_attempts_left_fails(tmp_path):
+    queue_path = str(tmp_path)
+    enqueue_one(queue_path, max_attempts=1)
+    work_queue.claim_job(queue_path, "worker-1", lease_seconds=-1)
+    assert work_queue.claim_job(queue_path, "worker-2") is None
+    row = job_row(queue_path)
+    assert row["status"] == "failed"
+    assert row["error"] == "аренда истекла"
+
+
+def test_failed_job_is_retried_until_max_attempts(tmp_path):
+    queue_path = str(tmp_path)
+    enqueue_one(queue_path, max_attempts=2)
+    job = work_queue.claim_job(queue_path, "worker-1")
+    assert work_queue.fail_job(queue_path, job, "worker-1", "нет связи", retry_delay=0)
+    job = work_queue.claim_job(queue_path, "worker-1")
+    assert job["attempts"] == 2
+    assert job["error"] == "нет связи"
+    assert work_queue.fail_job(queue_path, job, "worker-1", "нет связи", retry_delay=0)
+    assert work_queue.claim_job(queue_path, "worker-1") is None
+    assert job_row(queue_path)["status"] == "failed"
+
+
+def test_retry_waits_for_retry_delay(tmp_path):
+    queue_path = str(tmp_path)
+    enqueue_one(queue_path)
+    job = work_queue.claim_job(queue_path, "worker-1")
+    work_queue.fail_job(queue_path, job, "worker-1", "нет связи", retry_delay=600)
+    assert work_queue.claim_job(queue_path, "worker-1") is None
+    assert work_queue.unfinished_jobs(queue_path) == 1
+
+
+def test_deferred_job_continues_with_next_stage(tmp_path):
+    queue_path = str(tmp_path)
+    enqueue_one(queue_path)
+    job = work_queue.claim_job(queue_path, "worker-1")
+    assert work_queue.defer_job(queue_path, job, "worker-1", "verify", 0, {"sent": 2})
+    job = work_queue.claim_job(queue_path, "worker-2")
+    assert job["stage"] == "verify"
+    assert job["attempts"] == 1
+    assert json.loads(job["result"]) == {"sent": 2}
+
+
+def test_deferred_job_waits_for_delay(tmp_path):
+    queue_path = str(tmp_path)
+    enqueue_one(queue_path)
+    job = work_queue.claim_job(queue_path, "worker-1")
+    work_queue.defer_job(queue_path, job, "worker-1", "verify", 600, {"sent": 2})
+    assert work_queue.claim_job(queue_path, "worker-1") is None
+    assert work_queue.unfinished_jobs(queue_path) == 1
+
+
+def test_queue_status_filters_by_target_date(tmp_path):
+    pytest.importorskip("pandas")
+    queue_path = str(tmp_path)
+    work_queue.enqueue_jobs(
+        queue_path,
+        [("AVSOLTEK", "ask", "20261020"), ("AVSOLTEK", "ask", "20261021")],
+        3,
+    )
+    status = work_queue.queue_status(queue_path, "20261021")
+    assert list(status["target_date"]) == ["20261021"]
+    assert len(work_queue.queue_status(queue_path)) == 2
@@ -0,0 +1,80 @@
+import hashlib
+
+import pytest
+
+import xml_signing
+
+
+class DigestSigner(xml_signing.XmlSigner):
+    """
+    Тестовый подписант: подпись - sha256 данных, считает загрузки ключа.
+    """
+
+    loads = 0
+
+    def load(self):
+        self.loads += 1
+        return "digest"
+
+    def sign(self, data: bytes) -> bytes:
+        self.loaded_key()
+        return hashlib.sha256(data).digest()
+
+
+class FailingSigner(DigestSigner):
+    """
+    Подписант, который не может подписать.
+    """
+
+    def sign(self, data: bytes) -> bytes:
+        raise RuntimeError("подпись недоступна")
+
+
+def write_xml(tmp_path, name, text):
+    xml_path = tmp_path / name
+    xml_path.write_text(text, encoding="utf8")
+    return str(xml_path)
+
+
+def read_signature(xml_path):
+    with open(xml_signing.signature_path(xml_path), "rb") as signature_file:
+        return signature_file.read()
+
+
+def test_signer_must_implement_sign():
+    with pytest.raises(TypeError):
+        xml_signing.XmlSigner()
+
+
+def test_batch_loads_key_once(tmp_path):
+    signer = DigestSigner()
+    xml_paths = [write_xml(tmp_path, f"{i}.xml", f"<a{i}/>") for i in range(3)]
+    assert xml_signing.sign_batch(signer, xml_paths) == {}
+    assert signer.loads == 1
+    assert read_signature(xml_paths[1]) == hashlib.sha256(b"<a1/>").digest()
+
+
+def test_failed_signature_is_reported(tmp_path):
+    xml_path = write_xml(tmp_path, "a.xml", "<a/>")
+    failed = xml_signing.sign_batch(FailingSigner(), [xml_path])
+    assert list(failed) == [xml_path]
+    assert "подпись недоступна" in failed[xml_path]
+
+
+def test_missing_xml_is_reported(tmp_path):
+    missing_path = str(tmp_path / "missing.xml")
+    assert list(xml_signing.sign_batch(DigestSigner(), [missing_path])) == [
+        missing_path
+    ]
+
+
+def test_openssl_signer_writes_detached_signature(tmp_path):
+    pkcs7 = pytest.importorskip("cryptography.hazmat.primitives.serialization.pkcs7")
+    xml_signing.create_test_key(str(tmp_path / "key"))
+    signer = xml_signing.OpensslCmsSigner(
+        str(tmp_path / "key" / "cert.pem"), str(tmp_path / "key" / "key.pem")
+    )
+    xml_path = write_xml(tmp_path, "a.xml", "<a/>")
+    assert xml_signing.sign_batch(signer, [xml_path]) == {}
+    certificates = pkcs7.load_der_pkcs7_certificates(read_signature(xml_path))
+    assert len(certificates) == 1
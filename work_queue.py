@@ -0,0 +1,314 @@
+"""
+Очередь заданий на подачу ценовых заявок.
+
+Координатор ставит в очередь по одному заданию на (компания,
+направление, дата), любое количество обработчиков (процессов одного
+хоста) берут задания в аренду на LEASE_SECONDS, продлевают аренду
+во время работы и сообщают результат. Упавшее задание или задание
+с истекшей арендой возвращается в очередь с паузой, после
+max_attempts попыток помечается как failed.
+
+Задание выполняется по этапам (stage): после этапа обработчик
+может перевести задание на следующий этап с паузой (defer_job),
+аренда при этом освобождается и во время паузы обработчик
+берет другие задания.
+
+Очередь - sqlite файл, все изменения в транзакциях BEGIN IMMEDIATE.
+Файл должен лежать на локальном диске: блокировки sqlite через
+сетевые папки (SMB, NFS) ненадежны, и одно задание могут взять
+два обработчика. Для нескольких хостов нужна очередь на сервере.
+
+Пример просмотра из командной строки:
+    python work_queue.py queue 20261020
+"""
+
+import argparse
+import datetime
+import json
+import os
+import sqlite3
+from typing import Any, Dict, List, Tuple, Union
+
+QUEUE_FILE_NAME = "work_queue.sqlite"
+# аренда задания, секунд (продлевается обработчиком во время работы)
+LEASE_SECONDS = 600
+# пауза перед повтором упавшего задания, секунд (растет с номером попытки)
+RETRY_DELAY_SECONDS = 60
+MAX_ATTEMPTS = 3
+
+
+class LeaseLost(Exception):
+    """
+    Аренду задания забрал другой обработчик или она не продлена:
+    задание прерывается, результат в очередь не пишется.
+    """
+
+
+def now_iso(delta_seconds: float = 0) -> str:
+    return (
+        datetime.datetime.now() + datetime.timedelta(seconds=delta_seconds)
+    ).isoformat(timespec="seconds")
+
+
+def open_queue(queue_path: str) -> sqlite3.Connection:
+    """
+    Функция открытия очереди, при первом вызове
+    создает папку очереди и таблицу заданий.
+    """
+    os.makedirs(queue_path, exist_ok=True)
+    connection = sqlite3.connect(
+        os.path.join(queue_path, QUEUE_FILE_NAME),
+        timeout=30,
+        isolation_level=None,
+    )
+    connection.row_factory = sqlite3.Row
+    connection.executescript("""
+        CREATE TABLE IF NOT EXISTS jobs (
+            job_id INTEGER PRIMARY KEY,
+            company TEXT NOT NULL,
+            direction TEXT NOT NULL,
+            target_date TEXT NOT NULL,
+            stage TEXT NOT NULL DEFAULT 'send',
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL,
+            not_before TEXT NOT NULL,
+            lease_owner TEXT,
+            lease_expires TEXT,
+            result TEXT,
+            error TEXT,
+            updated_at TEXT NOT NULL,
+            UNIQUE (company, direction, target_date)
+        );
+        CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, not_before);
+        """)
+    columns = [row["name"] for row in connection.execute("PRAGMA table_info(jobs)")]
+    if "stage" not in columns:
+        # очередь прежних версий без этапов заданий
+        try:
+            connection.execute(
+                "ALTER TABLE jobs ADD COLUMN stage TEXT NOT NULL DEFAULT 'send'"
+            )
+        except sqlite3.OperationalError:
+            # столбец уже добавил другой обработчик
+            pass
+    return connection
+
+
+def enqueue_jobs(
+    queue_path: str,
+    jobs: List[Tuple[str, str, str]],
+    max_attempts: int = MAX_ATTEMPTS,
+) -> int:
+    """
+    Функция постановки заданий (компания, направление, дата) в очередь.
+    Уже поставленные задания не дублируются.
+    Возвращает количество новых заданий.
+    """
+    connection = open_queue(queue_path)
+    try:
+        connection.execute("BEGIN IMMEDIATE")
+        added = 0
+        for company, direction, target_date in jobs:
+            cursor = connection.execute(
+                "INSERT OR IGNORE INTO jobs (company, direction, target_date, "
+                "max_attempts, not_before, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (company, direction, target_date, max_attempts, now_iso(), now_iso()),
+            )
+            added += cursor.rowcount
+        connection.execute("COMMIT")
+    except Exception:
+        connection.execute("ROLLBACK")
+        raise
+    finally:
+        connection.close()
+    return added
+
+
+def claim_job(
+    queue_path: str, worker_id: str, lease_seconds: int = LEASE_SECONDS
+) -> Union[Dict[str, Any], None]:
+    """
+    Функция взятия задания в аренду: первое ожидающее задание или
+    задание с истекшей арендой. Задания с истекшей арендой и без
+    оставшихся попыток помечаются как failed.
+    Возвращает задание или None, если брать нечего.
+    """
+    connection = open_queue(queue_path)
+    try:
+        connection.execute("BEGIN IMMEDIATE")
+        now = now_iso()
+        connection.execute(
+            "UPDATE jobs SET status = 'failed', error = 'аренда истекла', "
+            "updated_at = ? WHERE status = 'leased' AND lease_expires < ? "
+            "AND attempts >= max_attempts",
+            (now, now),
+        )
+        row = connection.execute(
+            "SELECT * FROM jobs WHERE (status = 'pending' AND not_before <= ?) "
+            "OR (status = 'leased' AND lease_expires < ?) ORDER BY job_id LIMIT 1",
+            (now, now),
+        ).fetchone()
+        if row is None:
+            connection.execute("COMMIT")
+            return None
+        connection.execute(
+            "UPDATE jobs SET status = 'leased', attempts = attempts + 1, "
+            "lease_owner = ?, lease_expires = ?, updated_at = ? WHERE job_id = ?",
+            (worker_id, now_iso(lease_seconds), now, row["job_id"]),
+        )
+        connection.execute("COMMIT")
+    except Exception:
+        connection.execute("ROLLBACK")
+        raise
+    finally:
+        connection.close()
+    job = dict(row)
+    job["attempts"] += 1
+    return job
+
+
+def update_leased_job(
+    queue_path: str, job_id: int, worker_id: str, assignments: str, parameters: Tuple
+) -> bool:
+    """
+    Функция изменения задания, только если аренда принадлежит
+    обработчику. Возвращает False, если аренду уже забрал другой.
+    """
+    connection = open_queue(queue_path)
+    try:
+        cursor = connection.execute(
+            f"UPDATE jobs SET {assignments}, updated_at = ? "
+            "WHERE job_id = ? AND status = 'leased' AND lease_owner = ?",
+            (*parameters, now_iso(), job_id, worker_id),
+        )
+        return cursor.rowcount == 1
+    finally:
+        connection.close()
+
+
+def renew_lease(
+    queue_path: str, job_id: int, worker_id: str, lease_seconds: int = LEASE_SECONDS
+) -> bool:
+    """
+    Функция продления аренды задания.
+    """
+    return update_leased_job(
+        queue_path, job_id, worker_id, "lease_expires = ?", (now_iso(lease_seconds),)
+    )
+
+
+def complete_job(
+    queue_path: str, job_id: int, worker_id: str, result: Dict[str, Any]
+) -> bool:
+    """
+    Функция завершения задания с результатом.
+    """
+    return update_leased_job(
+        queue_path,
+        job_id,
+        worker_id,
+        "status = 'done', lease_owner = NULL, lease_expires = NULL, result = ?",
+        (json.dumps(result, ensure_ascii=False, default=str),),
+    )
+
+
+def defer_job(
+    queue_path: str,
+    job: Dict[str, Any],
+    worker_id: str,
+    stage: str,
+    delay_seconds: float,
+    result: Dict[str, Any],
+) -> bool:
+    """
+    Функция перевода задания на этап stage: аренда освобождается,
+    задание ждет в очереди delay_seconds, результат прошлого этапа
+    сохраняется в result, попытки считаются заново.
+    """
+    return update_leased_job(
+        queue_path,
+        job["job_id"],
+        worker_id,
+        "status = 'pending', stage = ?, attempts = 0, lease_owner = NULL, "
+        "lease_expires = NULL, result = ?, error = NULL, not_before = ?",
+        (
+            stage,
+            json.dumps(result, ensure_ascii=False, default=str),
+            now_iso(delay_seconds),
+        ),
+    )
+
+
+def fail_job(
+    queue_path: str,
+    job: Dict[str, Any],
+    worker_id: str,
+    error: str,
+    retry_delay: int = RETRY_DELAY_SECONDS,
+) -> bool:
+    """
+    Функция отметки ошибки задания: задание возвращается в очередь
+    с паузой retry_delay * номер попытки или, если попытки
+    закончились, помечается как failed.
+    """
+    if job["attempts"] >= job["max_attempts"]:
+        return update_leased_job(
+            queue_path,
+            job["job_id"],
+            worker_id,
+            "status = 'failed', lease_owner = NULL, lease_expires = NULL, error = ?",
+            (error,),
+        )
+    return update_leased_job(
+        queue_path,
+        job["job_id"],
+        worker_id,
+        "status = 'pending', lease_owner = NULL, lease_expires = NULL, "
+        "error = ?, not_before = ?",
+        (error, now_iso(retry_delay * job["attempts"])),
+    )
+
+
+def unfinished_jobs(queue_path: str, target_date: Union[str, None] = None) -> int:
+    """
+    Функция подсчета незавершенных заданий (ожидающих и в аренде).
+    """
+    connection = open_queue(queue_path)
+    try:
+        query = "SELECT COUNT(*) FROM jobs WHERE status IN ('pending', 'leased')"
+        parameters: List[Any] = []
+        if target_date is not None:
+            query += " AND target_date = ?"
+            parameters.append(target_date)
+        return connection.execute(query, parameters).fetchone()[0]
+    finally:
+        connection.close()
+
+
+def queue_status(queue_path: str, target_date: Union[str, None] = None) -> Any:
+    """
+    Функция получения заданий очереди датафреймом.
+    pandas нужен только для просмотра, сама очередь работает на sqlite3.
+    """
+    import pandas as pd
+
+    connection = open_queue(queue_path)
+    try:
+        where = "" if target_date is None else "WHERE target_date = ?"
+        parameters = [] if target_date is None else [target_date]
+        return pd.read_sql(
+            f"SELECT * FROM jobs {where} ORDER BY job_id", connection, params=parameters
+        )
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Просмотр очереди заданий.")
+    parser.add_argument("queue_path", help="папка очереди на локальном диске")
+    parser.add_argument(
+        "target_date", nargs="?", default=None, help="операционные сутки, ГГГГММДД"
+    )
+    args = parser.parse_args()
+    print(queue_status(args.queue_path, args.target_date).to_string())
@@ -0,0 +1,222 @@
+"""
+Пакетная подпись xml ценовых заявок.
+
+Открепленные подписи (CMS, DER) пишутся рядом с xml (<xml>.p7s).
+Подпись выполняется в вызывающем потоке: контейнер ключа открывается
+один раз на подписанта, поэтому ПИН запрашивается не более одного раза.
+
+Модуль пока не подключен к отправке create_xml: вызов CryptoSendMail
+с готовой подписью не подтвержден, bat файл подписывает письмо сам.
+Модуль используется для проверки подписи вне отправки.
+
+Подписанты:
+- CadesComSigner - КриптоПро CAdES COM по отпечатку сертификата (Windows);
+- OpensslCmsSigner - CMS подпись сертификатом и ключом из pem файлов
+  (Linux, прогон с тестовым ключом).
+
+Пример создания тестового ключа и подписи:
+    python xml_signing.py test-key sign_test
+    python xml_signing.py sign sign_test/cert.pem sign_test/key.pem *.xml
+"""
+
+import abc
+import argparse
+import base64
+import datetime
+import os
+from typing import Any, Dict, List
+
+from atomic_file import write_file_atomic
+
+# константы CAdES COM
+CAPICOM_CERTIFICATE_FIND_SHA1_HASH = 0
+CADESCOM_BASE64_TO_BINARY = 1
+CADESCOM_CADES_BES = 1
+CAPICOM_ENCODE_BASE64 = 0
+
+
+class XmlSigner(abc.ABC):
+    """
+    Подписант xml: sign(data) - открепленная подпись данных в DER.
+    Сертификат и ключ загружаются при первой подписи (load)
+    и переиспользуются для всех xml пакета.
+    """
+
+    loaded = None
+
+    @abc.abstractmethod
+    def load(self) -> Any:
+        """
+        Загрузка сертификата и ключа подписанта.
+        """
+
+    @abc.abstractmethod
+    def sign(self, data: bytes) -> bytes:
+        """
+        Открепленная подпись данных в DER.
+        """
+
+    def loaded_key(self) -> Any:
+        if self.loaded is None:
+            self.loaded = self.load()
+        return self.loaded
+
+
+class CadesComSigner(XmlSigner):
+    """
+    Подпись CAdES-BES через КриптоПро CAdES COM
+    сертификатом из хранилища по отпечатку.
+    """
+
+    def __init__(self, thumbprint: str) -> None:
+        self.thumbprint = str(thumbprint).lower()
+
+    def load(self) -> Any:
+        import win32com.client
+
+        store = win32com.client.Dispatch("CAdESCOM.Store")
+        store.Open(2, "My", 0)
+        certificates = store.Certificates.Find(
+            CAPICOM_CERTIFICATE_FIND_SHA1_HASH, self.thumbprint
+        )
+        if certificates.Count == 0:
+            raise LookupError(f"Не найден сертификат {self.thumbprint} в хранилище")
+        cp_signer = win32com.client.Dispatch("CAdESCOM.CPSigner")
+        cp_signer.Certificate = certificates.Item(1)
+        return cp_signer
+
+    def sign(self, data: bytes) -> bytes:
+        import win32com.client
+
+        cp_signer = self.loaded_key()
+        signed_data = win32com.client.Dispatch("CAdESCOM.CadesSignedData")
+        signed_data.ContentEncoding = CADESCOM_BASE64_TO_BINARY
+        signed_data.Content = base64.b64encode(data).decode("ascii")
+        signature = signed_data.SignCades(
+            cp_signer, CADESCOM_CADES_BES, True, CAPICOM_ENCODE_BASE64
+        )
+        return base64.b64decode(signature)
+
+
+class OpensslCmsSigner(XmlSigner):
+    """
+    Подпись CMS (PKCS#7, SHA-256) сертификатом и ключом из pem файлов.
+    """
+
+    def __init__(self, cert_path: str, key_path: str) -> None:
+        self.cert_path = cert_path
+        self.key_path = key_path
+
+    def load(self) -> Any:
+        from cryptography import x509
+        from cryptography.hazmat.primitives import serialization
+
+        with open(self.cert_path, "rb") as cert_file:
+            certificate = x509.load_pem_x509_certificate(cert_file.read())
+        with open(self.key_path, "rb") as key_file:
+            private_key = serialization.load_pem_private_key(key_file.read(), None)
+        return certificate, private_key
+
+    def sign(self, data: bytes) -> bytes:
+        from cryptography.hazmat.primitives import hashes, serialization
+        from cryptography.hazmat.primitives.serialization import pkcs7
+
+        certificate, private_key = self.loaded_key()
+        return (
+            pkcs7.PKCS7SignatureBuilder()
+            .set_data(data)
+            .add_signer(certificate, private_key, hashes.SHA256())
+            .sign(
+                serialization.Encoding.DER,
+                [pkcs7.PKCS7Options.DetachedSignature, pkcs7.PKCS7Options.Binary],
+            )
+        )
+
+
+def signature_path(xml_path: str) -> str:
+    return f"{xml_path}.p7s"
+
+
+def sign_batch(signer: XmlSigner, xml_paths: List[str]) -> Dict[str, str]:
+    """
+    Функция подписи пакета xml в вызывающем потоке
+    (для CadesComSigner поток должен выполнить CoInitialize).
+    Подпись пишется рядом с xml (<xml>.p7s).
+    Возвращает словарь {путь xml: текст ошибки} по неподписанным xml.
+    """
+    failed = {}
+    for xml_path in xml_paths:
+        try:
+            with open(xml_path, "rb") as xml_file:
+                data = xml_file.read()
+        except OSError as err:
+            failed[xml_path] = str(err)
+            continue
+        try:
+            signature = signer.sign(data)
+        except Exception as err:
+            failed[xml_path] = str(err)
+            continue
+        try:
+            write_file_atomic(signature_path(xml_path), signature)
+        except OSError as err:
+            failed[xml_path] = str(err)
+    return failed
+
+
+def create_test_key(key_dir: str, common_name: str = "create_xml test") -> None:
+    """
+    Функция создания самоподписанного тестового сертификата
+    и ключа (cert.pem, key.pem) для подписи на Linux.
+    """
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from cryptography.x509.oid import NameOID
+
+    os.makedirs(key_dir, exist_ok=True)
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, common_name)])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(private_key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=365))
+        .sign(private_key, hashes.SHA256())
+    )
+    with open(os.path.join(key_dir, "key.pem"), "wb") as key_file:
+        key_file.write(
+            private_key.private_bytes(
+                serialization.Encoding.PEM,
+                serialization.PrivateFormat.PKCS8,
+                serialization.NoEncryption(),
+            )
+        )
+    with open(os.path.join(key_dir, "cert.pem"), "wb") as cert_file:
+        cert_file.write(certificate.public_bytes(serialization.Encoding.PEM))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Подпись xml ценовых заявок.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    test_key_parser = subparsers.add_parser(
+        "test-key", help="создать тестовый сертификат и ключ"
+    )
+    test_key_parser.add_argument("key_dir", help="папка для cert.pem и key.pem")
+    sign_parser = subparsers.add_parser("sign", help="подписать xml файлы")
+    sign_parser.add_argument("cert_path")
+    sign_parser.add_argument("key_path")
+    sign_parser.add_argument("xml_paths", nargs="+")
+    args = parser.parse_args()
+    if args.command == "test-key":
+        create_test_key(args.key_dir)
+    else:
+        errors = sign_batch(
+            OpensslCmsSigner(args.cert_path, args.key_path), args.xml_paths
+        )
+        for xml_path, error in errors.items():
+            print(f"{xml_path}: {error}")